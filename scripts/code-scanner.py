@@ -1,167 +1,13 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import os
+import sys
 
-from elftools.elf.elffile import ELFFile
-
-
-class CodeScanner(object):
-    SECURE_APIS = [
-        'xTaskCreateRestricted',
-        'vTaskFinishInit',
-        'vTaskDelete',
-        'vTaskDelayUntil',
-        'vTaskDelay',
-        'vTaskPrioritySet',
-        'vTaskSuspend',
-        'vTaskResume',
-        'vTaskAllocateMPURegions',
-        'ulTaskNotifyTake',
-        'xTaskNotifyWait',
-        'xTaskGenericNotify',
-        'xTaskNotifyStateClear',
-
-        'vTaskMissedYield',
-        'xTaskPriorityInherit',
-        'xTaskPriorityDisinherit',
-        'xTaskPriorityDisinheritAfterTimeout',
-        'pvTaskIncrementMutexHeldCount',
-        'vTaskSuspendAll',
-        'xTaskResumeAll',
-        'vTaskPlaceOnEventList',
-        'vTaskPlaceOnEventListRestricted',
-        'vTaskPlaceOnUnorderedEventList',
-        'xTaskRemoveFromEventList',
-        'vTaskRemoveFromUnorderedEventList',
-
-        'xTaskResumeFromISR',
-        'xTaskGenericNotifyFromISR',
-        'vTaskNotifyGiveFromISR',
-
-        'vPortEnterCritical',
-        'vPortExitCritical',
-
-        'vMainUARTPrintString',
-    ]
-
-    def __init__(self, binary, sections, unaligned):
-        self.binary = binary
-        self.sections = sections
-        self.unaligned = unaligned
-
-        self.__elf = ELFFile(open(binary, 'rb'))
-        self.__privileged_section = self.__elf.get_section_by_name('privileged_functions')
-        assert self.__privileged_section, 'No section named privileged_functions'
-        for section in self.sections:
-            text = self.__elf.get_section_by_name(section)
-            assert text, 'Section does not exist: {:s}'.format(section)
-            assert text.data_size % 2 == 0, 'Odd code section size: {:s}'.format(section)
-
-        # Construct a map of PC -> function name
-        symtab = self.__elf.get_section_by_name('.symtab')
-        assert symtab, 'Stripped binary not supported'
-        self.__funcs = {}
-        for sym in symtab.iter_symbols():
-            if sym.entry['st_info']['type'] == 'STT_FUNC':
-                self.__funcs[sym.entry['st_value'] & ~0x1] = {
-                    'name': sym.name,
-                    'section': self.__elf.get_section(sym.entry['st_shndx']).name,
-                }
-
-    def scan(self):
-        offending = False
-
-        for section in self.sections:
-            text = self.__elf.get_section_by_name(section)
-
-            i = 0
-            while i < text.data_size:
-                byte0 = text.data()[i]
-                byte1 = text.data()[i + 1]
-                inst = (byte1 << 8) | byte0
-                addr = text.header['sh_addr'] + i
-
-                # Determine if it's a Thumb or Thumb-2 instruction
-                prefix = inst >> 11
-                if prefix == 0b11101 or prefix == 0b11110 or prefix == 0b11111:
-                    assert i + 2 < text.data_size, 'Truncated Thumb-2 instruction: {:s}'.format(section)
-
-                    byte2 = text.data()[i + 2]
-                    byte3 = text.data()[i + 3]
-                    inst2 = (byte3 << 8) | byte2
-                    inst = (inst << 16) | inst2
-
-                    # Skip our CFI label
-                    if inst == 0xf871f870:
-                        i += 4
-                        continue
-
-                    offending |= self.__scan_4byte_inst(inst, addr)
-                    if self.unaligned:
-                        offending |= self.__scan_2byte_inst(inst2, addr + 2)
-                    i += 4
-                else:
-                    offending |= self.__scan_2byte_inst(inst, addr)
-                    i += 2
-
-        return offending
-
-    def __scan_2byte_inst(self, inst, addr):
-        # Scan for CPS
-        cps_opcode = 0xb660
-        cps_opcode_mask = 0xffec
-        if (inst & cps_opcode_mask) == cps_opcode:
-            print('[CS] CPS at 0x{:x}'.format(addr))
-            return True
-
-        return False
-
-    def __scan_4byte_inst(self, inst, addr):
-        # Scan for MSR
-        msr_opcode = 0xf3808000
-        msr_opcode_mask = 0xfff0f300
-        if (inst & msr_opcode_mask) == msr_opcode:
-            sysm_list = {
-                0x8: 'MSP',
-                0x9: 'PSP',
-                0x10: 'PRIMASK',
-                0x13: 'FAULTMASK',
-                0x14: 'CONTROL',
-            }
-            sysm = inst & 0xff
-            if sysm in sysm_list:
-                print('[CS] MSR {:s} at 0x{:x}'.format(sysm_list[sysm], addr))
-                return True
-
-        # Scan for BL (normal call) and B (tail call)
-        bl_opcode = 0xf000d000
-        bl_opcode_mask = 0xf800d000
-        b_opcode = 0xf0009000
-        b_opcode_mask = 0xf800d000
-        if (inst & bl_opcode_mask) == bl_opcode or (inst & b_opcode_mask) == b_opcode:
-            imm11 = inst & 0x7ff
-            imm10 = (inst >> 16) & 0x3ff
-            j2 = (inst >> 11) & 0x1
-            j1 = (inst >> 13) & 0x1
-            s = (inst >> 26) & 0x1
-            opcode = 'BL' if (inst & bl_opcode_mask) == bl_opcode else 'B'
-
-            i1 = not(j1 ^ s)
-            i2 = not(j2 ^ s)
-            offset = (s << 24) | (i1 << 23) | (i2 << 22) | (imm10 << 12) | (imm11 << 1)
-            # Sign extend with sign bit 25
-            offset = (offset & ((1 << 24) - 1)) - (offset & (1 << 24))
-
-            dest = addr + 4 + offset
-            priv_start = self.__privileged_section.header['sh_addr']
-            priv_end = priv_start + self.__privileged_section.data_size
-            if dest >= priv_start and dest < priv_end:
-                assert dest in self.__funcs, 'Jump to the middle of trusted function'
-                if self.__funcs[dest]['name'] not in CodeScanner.SECURE_APIS:
-                    print('[CS] {:s} {:s} at 0x{:x}'.format(opcode, self.__funcs[dest]['name'], addr))
-                    return True
-
-        return False
+from kage_tools.client import DEFAULT_SOCKET, DaemonClient, DaemonError
+from kage_tools.scan_cache import DEFAULT_CACHE
+from kage_tools.scan_report import SarifWriter, Summary, format_json, format_text, print_reports
 
 
 def main():
@@ -171,19 +17,97 @@ def main():
                         help='name of the code section to scan')
     parser.add_argument('-u', '--unaligned', action='store_true',
                         help='scan unaligned instructions as well')
-    parser.add_argument('binary', help='path to the binary executable')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (0: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=256 * 1024,
+                        help='split sections into chunks of whole functions of about this many bytes when scanning in '
+                             'parallel')
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE,
+                        help='reuse the results of unchanged functions from a result cache '
+                             '(default: {:s})'.format(DEFAULT_CACHE))
+    parser.add_argument('--format', choices=('text', 'jsonl', 'sarif'), default='text',
+                        help='print violations as text, as JSON lines or as a SARIF log')
+    parser.add_argument('--summary', action='store_true',
+                        help='report the number of violations per class and per function')
+    parser.add_argument('--daemon', nargs='?', const=DEFAULT_SOCKET,
+                        help='let a running analysis daemon (python -m kage_tools.daemon) listening on this '
+                             'socket scan the binaries (default: {:s})'.format(DEFAULT_SOCKET))
+    parser.add_argument('binary', nargs='+',
+                        help='path to a binary executable, a directory of binaries or a glob pattern')
 
     # Parse CLI arguments
     args = parser.parse_args()
-    binary = args.binary
     if not args.section:
         args.section.append('.text')
     sections = set(args.section)
     unaligned = args.unaligned
-
-    # Construct and run a code scanner
-    scanner = CodeScanner(binary, sections, unaligned)
-    if scanner.scan():
+    jobs = args.jobs or os.cpu_count()
+
+    results = None
+    if args.daemon:
+        try:
+            with DaemonClient(args.daemon) as client:
+                results = client.scan(args.binary, sections, unaligned, args.cache)
+        except DaemonError as e:
+            print('[CS] WARNING: {:s}, scanning without the daemon'.format(str(e)), file=sys.stderr)
+
+    if results is not None:
+        single = len(results) == 1 and jobs == 1
+        if not single and args.format == 'text':
+            results = print_reports(results)
+    else:
+        # Only import the scanner when scanning in this process: importing
+        # its dependencies takes longer than a scan by the daemon
+        from elftools.common.exceptions import ELFError
+
+        from kage_tools.code_scanner import CodeScanner, ScanError, expand_binaries, stream_batch
+
+        binaries = expand_binaries(args.binary)
+        single = len(binaries) == 1 and jobs == 1
+        if single:
+            # Construct and run a code scanner
+            try:
+                scanner = CodeScanner(binaries[0], sections, unaligned, args.cache)
+                results = [(binaries[0], list(scanner.violations()), None)]
+            except (ScanError, OSError, ELFError) as e:
+                results = [(binaries[0], [], str(e))]
+        else:
+            # Scan all binaries in parallel
+            results = stream_batch(binaries, sections, unaligned, args.cache, jobs, args.chunk_size)
+            if args.format == 'text':
+                results = print_reports(results)
+
+    offending = False
+    summary = Summary()
+    sarif = SarifWriter() if args.format == 'sarif' else None
+    for binary, violations, error in results:
+        for violation in violations:
+            offending = True
+            summary.add(violation)
+            if args.format == 'jsonl':
+                print(format_json(violation))
+            elif sarif is not None:
+                sarif.add(violation)
+            elif single:
+                print(format_text(violation))
+        if error is not None:
+            offending = True
+            summary.add_error()
+            if args.format == 'jsonl':
+                print(json.dumps({'binary': binary, 'error': error}))
+            elif sarif is not None:
+                sarif.add_error(binary, error)
+            elif single:
+                print('[CS] ERROR: {:s}'.format(error), file=sys.stderr)
+
+    if sarif is not None:
+        sarif.write(sys.stdout, summary if args.summary else None)
+    elif args.summary and args.format == 'jsonl':
+        print(json.dumps({'summary': summary.as_dict()}))
+    elif args.summary:
+        print(summary.format())
+
+    if offending:
         exit(1)
 
 
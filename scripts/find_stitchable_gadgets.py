@@ -2,24 +2,140 @@
 
 import sys
 import getopt
+import os
 import os.path
-import pdb
-from pprint import pprint
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Number of gadget lines classified at once by a worker
+CHUNK_LINES = 1 << 16
+
+# Gadget classes
+OTHER = 0
+STITCHABLE = 1
+BRANCH = 2
+
+# Classes of gadgets by the first two characters of their last instruction.
+# Gadgets ending in a return/call/jump to register (bx, bxne, bl, blx) are
+# stitchable, and those ending in b.w may branch to another gadget.
+TERMINATORS = {'bx': STITCHABLE, 'bl': STITCHABLE, 'b.': BRANCH}
+# Instructions writing to pc (pop.*pc, ld[rm].*\spc or ldmia.*{.*pc.*})
+# anywhere in a gadget, as a single pattern
+PC_WRITER = re.compile(r'(?:^|; )(?:pop[^;]*pc|ld[rm][^;]*\spc|ldmia[^;]*{[^;]*pc[^;]*})')
+# Branch to a static address, which may be the start of another gadget
+BRANCH_W = re.compile(r'b\.w.*#0x.*')
+# Separator between instructions, with any whitespace around it
+SEPARATOR = re.compile(r'\s*;\s*')
+
 
-gadgets = dict()
-stitchable = dict()
-not_stitchable = dict()
 def usage():
-    print(f"./{os.path.basename(__file__)} -f <gadgetfile>")
+    print(f"./{os.path.basename(__file__)} [-i] [-j <jobs>] -f <gadgetfile>")
+
+
+def is_normalized(gadget):
+    """Check if all instructions of a gadget are separated by exactly " ; "."""
+    return (gadget.count(";") == gadget.count(" ; ") and "\t" not in gadget and
+            "  ;" not in gadget and ";  " not in gadget)
+
+
+def classify(gadget):
+    """Return (class, branch target) of a gadget given as normalized text."""
+    last = gadget.rpartition(" ; ")[2]
+    kind = TERMINATORS.get(last[:2], OTHER)
+    if kind == STITCHABLE:
+        return STITCHABLE, None
+    if PC_WRITER.search(gadget):
+        return STITCHABLE, None
+    if kind == BRANCH and BRANCH_W.match(last):
+        return BRANCH, int(last.split(" ")[-1][1:], 16)
+    return OTHER, None
+
+
+def classify_lines(lines):
+    """Parse and classify gadget lines into (address, gadget, class, branch target) tuples."""
+    result = []
+    for line in lines:
+        # Skip anything but gadgets, e.g. headers of ROPgadget output
+        if not line.startswith('0x'):
+            continue
+        a, g = line.split(":", 1)
+        # Remove whitespace around gadget, address and instructions
+        addr = int(a.strip(), 16)
+        gadget = g.strip()
+        if not is_normalized(gadget):
+            gadget = SEPARATOR.sub(" ; ", gadget)
+        result.append((addr, gadget) + classify(gadget))
+    return result
+
+
+def classify_file(fp, jobs):
+    """Classify all gadgets of a file, in file order.
+
+    Chunks of the file are classified in a process pool while it is read,
+    with a bounded number of chunks in flight.
+    """
+    chunks = iter(lambda: list(islice(fp, CHUNK_LINES)), [])
+    if jobs == 1:
+        for chunk in chunks:
+            yield from classify_lines(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(classify_lines, chunk))
+            if len(pending) > 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class StitchabilityAnalysis(object):
+    def __init__(self, classified):
+        # Map gadget addresses to their text and class. A later gadget at the
+        # same address replaces an earlier one, but keeps its position.
+        self.gadgets = dict()
+        for addr, gadget, kind, target in classified:
+            self.gadgets[addr] = (gadget, kind, target)
+        self.__stitchable = dict()
+
+    def stitchable(self, addr):
+        """Check if the gadget at addr is stitchable.
+
+        A gadget ending in b.w is stitchable if following the chain of b.w
+        targets through the gadget index leads to a stitchable gadget.
+        """
+        chain = []
+        result = False
+        while True:
+            if addr in self.__stitchable:
+                result = self.__stitchable[addr]
+                break
+            if addr not in self.gadgets:
+                break
+            _, kind, target = self.gadgets[addr]
+            if kind != BRANCH:
+                result = kind == STITCHABLE
+                break
+            # Branch cycles never reach a stitchable gadget
+            if addr in chain:
+                break
+            chain.append(addr)
+            addr = target
+        for addr in chain:
+            self.__stitchable[addr] = result
+        return result
+
 
 def main(argv):
 
     gadgetfilename = ""
     INVERSE=False
+    jobs = 1
     # Fetch arguments
     try :
-        opts, args = getopt.getopt(argv, "hif:")
+        opts, args = getopt.getopt(argv, "hif:j:")
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -29,6 +145,9 @@ def main(argv):
             sys.exit()
         elif opt == "-f":
             gadgetfilename = arg
+        elif opt == "-j":
+            # 0 means one worker per CPU
+            jobs = int(arg) or os.cpu_count()
         if opt == "-i":
             INVERSE=True
 
@@ -36,80 +155,17 @@ def main(argv):
         usage()
         sys.exit(2)
 
-    # Open file containing gadgets
+    # Open file containing gadgets and classify each of them
     with open(gadgetfilename) as fp:
-        # Loop through each line containing a gadget
-        for line in fp:
-            # Sanity check, first word is an address
-            a, g = line.split(":", 1)
-            # Remove whitespace around gadget and address
-            addr = int(a.strip(),16)
-            gadget = g.strip()
-            gadgetl = [x.strip() for x in gadget.split(";")]
-
-            # Map gadget address to its instructions in dictionary
-            gadgets[addr] = gadgetl
-            
-
-    # Set of regexes that make gadgets stitchable
-    stitchers = [r'bx', r'bxne', r'bl', r'blx']
-    # Set of regexes that describe instructions writing to pc
-    pc_writers = [r'pop.*pc', r'ld[rm].*\spc', r'ldmia.*{.*pc.*}']
-
-    # instructions that are obviously stitchable
-    for addr,gadget in gadgets.items():
-        found = False
-        # Stitchable if gadget ends in a return/call/jump to register
-        for s in stitchers:
-            x = re.compile(s)
-            if x.match(gadget[-1]):
-                stitchable[addr] = gadget
-                found = True
-                break
-        if found:
-            continue
-        # Check if gadget instructions write to pc
-        for p in pc_writers:
-            x = re.compile(p)
-            # Check each instruction in the current gadget
-            for instr in gadget:
-                if x.match(instr):
-                    stitchable[addr] = gadget
-                    found = True
-                    break
-            if found:
-                break
-        if found:
-            continue
+        analysis = StitchabilityAnalysis(classify_file(fp, jobs))
+
+    # output stitchable gadgets, or non-stitchable gadgets if inverted
+    out = []
+    for addr, (gadget, _, _) in analysis.gadgets.items():
+        if analysis.stitchable(addr) != INVERSE:
+            out.append(f"{hex(addr)} : {gadget}\n")
+    sys.stdout.writelines(out)
+
 
-        # Check if branch to static address is the start of another gadget
-        b = re.compile(r'b\.w.*#0x.*')
-        if b.match(gadget[-1]):
-            # Check if branch destination is a gadget address
-            jumps_to = int(gadget[-1].split(" ")[-1][1:],16)
-            if jumps_to in gadgets:
-                stitchable[addr] = gadget
-                continue
-            
-    # output non-stitchable gadgets
-    if INVERSE:
-        # Remove stitchable gadgets from gadgets list
-        for addr in stitchable.keys():
-            gadgets.pop(addr)
-
-        for addr,gadget in gadgets.items():
-            gadget_str = " ; ".join(gadget)
-            print(f"{hex(addr)} : {gadget_str}")
-
-    # output stitchable gadgets
-    else :
-        for addr,gadget in stitchable.items():
-            gadget_str = " ; ".join(gadget)
-            print(f"{hex(addr)} : {gadget_str}")
-
-
-
-    
 if __name__ == "__main__":
     main(sys.argv[1:])
-
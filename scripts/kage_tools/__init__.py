@@ -0,0 +1,56 @@
+"""Library of the Kage code scanner, gadget analysis and benchmark tools.
+
+The scripts in the parent directory are command line front ends of this
+package. It is not installable; import it from that directory, or with it
+on PYTHONPATH. Its stable API is exported here:
+
+- CodeScanner, stream_batch() and scan_batch() scan binaries for
+  instructions that may escape Kage's protection, yielding Violations.
+- analyze_binary() finds the gadgets of a binary, those reachable under Kage
+  and their privileged stores.
+- ResultParser collects the results of a benchmark run from its output.
+- DaemonClient asks a running analysis daemon (see daemon) to scan or
+  analyze binaries it keeps parsed between requests.
+
+The names are imported from their modules on first use, so that importing a
+single module (e.g. the daemon client) does not load the dependencies of all
+others (NumPy, pyelftools, Capstone).
+"""
+
+import importlib
+
+_EXPORTS = {
+    'CodeScanner': 'code_scanner',
+    'expand_binaries': 'code_scanner',
+    'ScanError': 'code_scanner',
+    'scan_batch': 'code_scanner',
+    'stream_batch': 'code_scanner',
+    'Summary': 'scan_report',
+    'Violation': 'scan_report',
+    'Analysis': 'gadget_analysis',
+    'AnalysisError': 'gadget_analysis',
+    'analyze_binary': 'gadget_analysis',
+    'find_gadgets': 'gadget_finder',
+    'find_gadgets_within': 'gadget_finder',
+    'StoreCounter': 'gadget_model',
+    'GadgetCache': 'gadget_cache',
+    'ResultParser': 'benchmark_parsers',
+    'MappedELF': 'elf_access',
+    'SymbolIndex': 'symbol_index',
+    'DaemonClient': 'client',
+    'DaemonError': 'client',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,129 @@
+"""Parsers for the serial output of our benchmark programs.
+
+Every benchmark family (queue, stream-buffer, ...) is described by a list of
+rules, each a compiled regex extracting one result from a line, and by the
+condition on which a run of the benchmark is complete. Families are looked
+up by name in the name of a benchmark binary, so supporting a new benchmark
+only takes registering another family here.
+"""
+
+import re
+
+
+class Rule(object):
+    def __init__(self, pattern, label='', metric=None, convert=int, records_size=False, terminates=False):
+        """Extract a result from lines matching pattern.
+
+        The first group of pattern is the value, converted with convert, and
+        label is appended to the configuration name to form the result name.
+        metric identifies the result among those of the benchmark in
+        machine-readable output; it defaults to the label with dashes for
+        spaces. If records_size is set, the code size of the binary is
+        recorded under the configuration name, and if terminates is set, the
+        run is complete after a match.
+        """
+        self.regex = re.compile(pattern)
+        self.label = label
+        self.metric = metric or label.strip(': ').replace(' ', '-').lower()
+        self.convert = convert
+        self.records_size = records_size
+        self.terminates = terminates
+
+
+class Family(object):
+    def __init__(self, name, rules, terminator=None, rename=None):
+        """A benchmark family whose binaries contain name.
+
+        The run is complete once a line matches the terminator pattern (or
+        a terminating rule matches). rename maps the configuration name to
+        the name results are reported under.
+        """
+        self.name = name
+        self.rules = rules
+        self.terminator = None if terminator is None else re.compile(terminator)
+        self.rename = rename or (lambda conf_name: conf_name)
+
+
+FAMILIES = {}
+
+
+def register(family):
+    FAMILIES[family.name] = family
+    return family
+
+
+LOW_PRIORITY_STARTED = r'Started Microbenchmark Low Priority Task'
+
+register(Family('stream-buffer', [
+    Rule(r'Creating stream buffer.*?: (\d+)', ': create'),
+    Rule(r'Received unsigned 9 from stream buffer.*?: (\d+)', ': send and receive', records_size=True),
+], terminator=LOW_PRIORITY_STARTED))
+
+register(Family('queue', [
+    Rule(r'Creating queue.*?: (\d+)', ': create'),
+    Rule(r'Received unsigned 9 from queue.*?: (\d+)', ': send and receive', records_size=True),
+], terminator=LOW_PRIORITY_STARTED))
+
+register(Family('exception-dispatcher', [
+    Rule(r'DIV_BY_0.*?: 0 (\d+)', metric='latency', records_size=True),
+], terminator=LOW_PRIORITY_STARTED, rename=lambda conf_name: conf_name.replace('dispatcher', '')))
+
+register(Family('context-switch', [
+    Rule(r'Context Switch cycle.*?: (\d+)', metric='latency', records_size=True, terminates=True),
+]))
+
+register(Family('secure-api', [
+    Rule(r'MPU checks.*?: (\d+)', ': MPU region configuration'),
+    Rule(r'xVerifyTCB.*?: (\d+)', ': task control block'),
+    Rule(r'xVerifyUntrustedData.*?: (\d+)', ': other pointers'),
+    Rule(r'Exception priority.*?: (\d+)', ': exception priority', records_size=True, terminates=True),
+]))
+
+register(Family('coremark', [
+    Rule(r'Iterations/Sec.*?: ([0-9.]+)', metric='throughput', convert=float, records_size=True),
+], terminator=r'CoreMark 1\.0'))
+
+
+class ResultParser(object):
+    """Collect the results of one run of a benchmark binary from its output."""
+
+    def __init__(self, binary_name, conf_name, size):
+        self.families = [family for name, family in FAMILIES.items() if name in binary_name]
+        self.conf_name = conf_name
+        self.size = size
+        self.perf = {}
+        self.sizes = {}
+        self.done = False
+        self.lines = 0
+
+    def result_names(self):
+        """Return the sub-metrics of all results the binary may report by
+        result name, and the names its code size may be reported under."""
+        metrics = {}
+        sizes = set()
+        for family in self.families:
+            name = family.rename(self.conf_name)
+            for rule in family.rules:
+                metrics[name + rule.label] = rule.metric
+                if rule.records_size:
+                    sizes.add(name)
+        return metrics, sizes
+
+    def feed(self, line):
+        """Parse a line of output. Returns whether the run is complete."""
+        self.lines += 1
+        for family in self.families:
+            name = family.rename(self.conf_name)
+            for rule in family.rules:
+                match = rule.regex.search(line)
+                if match is None:
+                    continue
+                self.perf[name + rule.label] = rule.convert(match.group(1))
+                # The size is missing if the binary could not be analyzed
+                if rule.records_size and self.size is not None:
+                    self.sizes[name] = self.size
+                if rule.terminates:
+                    self.done = True
+            if family.terminator is not None and family.terminator.search(line):
+                self.done = True
+        return self.done
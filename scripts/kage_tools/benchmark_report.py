@@ -0,0 +1,114 @@
+"""Machine-readable benchmark results and the overhead of Kage over FreeRTOS.
+
+Results are identified by stable keys derived from the build configurations
+of the binaries rather than from their human-readable names: the program,
+the project configuration (baseline, baseline_mpu or kage), the variant of
+the binary (the prefix of its build configuration, e.g. kage-no-silhouette),
+the benchmark (the rest of its build configuration, e.g. queue), the
+sub-metric (e.g. send-and-receive) and the unit.
+"""
+
+import csv
+import json
+from collections import namedtuple
+
+import numpy as np
+
+# Variants of Kage, and the variants of FreeRTOS they are compared to
+KAGE_VARIANTS = ('kage', 'kage-no-silhouette', 'kage-os-only')
+REFERENCE_VARIANTS = ('baseline', 'mpu')
+# Units for which higher values are better; for all others, lower is better
+HIGHER_IS_BETTER = {'iter/sec'}
+
+# Identifies a result within the results of a project
+ResultKey = namedtuple('ResultKey', ['variant', 'benchmark', 'metric'])
+MetricKey = namedtuple('MetricKey', ['program', 'config', 'variant', 'benchmark', 'metric', 'unit'])
+Row = namedtuple('Row', MetricKey._fields + ('board', 'count', 'median', 'mean', 'std', 'ci95', 'outliers',
+                                             'samples'))
+Overhead = namedtuple('Overhead', ['program', 'variant', 'reference', 'benchmark', 'metric', 'unit', 'ratio'])
+GeometricMean = namedtuple('GeometricMean', ['program', 'variant', 'reference', 'count', 'ratio'])
+
+CSV_COLUMNS = ['table', 'program', 'config', 'variant', 'reference', 'benchmark', 'metric', 'unit', 'board',
+               'count', 'median', 'mean', 'std', 'ci95', 'outliers', 'ratio']
+
+
+def result_rows(perf_dict, size_dict, key_dict, board_dict):
+    """Return a row for every performance result and every part (trusted or
+    untrusted) of every code size.
+
+    key_dict holds the ResultKey of every result name of perf_dict and
+    size_dict, and board_dict the board a result was measured on.
+    """
+    rows = []
+    for program in perf_dict:
+        unit = 'iter/sec' if program == 'coremark' else 'cycles'
+        for config, results in perf_dict[program].items():
+            for name in sorted(results):
+                samples = results[name]
+                summary = samples.summary()
+                key = key_dict[program][config][name]
+                rows.append(Row(program, config, key.variant, key.benchmark, key.metric, unit,
+                                board_dict[program][config].get(name), summary.count, summary.median,
+                                summary.mean, summary.std, summary.ci if summary.count > 1 else None,
+                                len(samples.rejected), list(samples)))
+    for program in size_dict:
+        for config, results in size_dict[program].items():
+            for name in sorted(results):
+                key = key_dict[program][config][name]
+                for part in sorted(results[name]):
+                    size = results[name][part]
+                    rows.append(Row(program, config, key.variant, key.benchmark, part + '-code-size', 'bytes',
+                                    board_dict[program][config].get(name), 1, size, size, 0., None, 0, [size]))
+    return rows
+
+
+def overheads(rows):
+    """Relate every performance result of a Kage variant to the same result
+    of each FreeRTOS variant.
+
+    A ratio above 1 means Kage is slower: it is Kage's result divided by
+    FreeRTOS', or the inverse for results where higher is better.
+    """
+    medians = {(row.program, row.variant, row.benchmark, row.metric, row.unit): row.median
+               for row in rows if row.unit != 'bytes'}
+    result = []
+    for (program, variant, benchmark, metric, unit), median in sorted(medians.items()):
+        if variant not in KAGE_VARIANTS:
+            continue
+        for reference in REFERENCE_VARIANTS:
+            referenceMedian = medians.get((program, reference, benchmark, metric, unit))
+            if not referenceMedian or not median:
+                continue
+            ratio = referenceMedian / median if unit in HIGHER_IS_BETTER else median / referenceMedian
+            result.append(Overhead(program, variant, reference, benchmark, metric, unit, ratio))
+    return result
+
+
+def geometric_means(overheads):
+    """Return the geometric mean of the overheads of each Kage variant over
+    each FreeRTOS variant, across the benchmarks of a program."""
+    groups = {}
+    for overhead in overheads:
+        groups.setdefault((overhead.program, overhead.variant, overhead.reference), []).append(overhead.ratio)
+    return [GeometricMean(program, variant, reference, len(ratios), float(np.exp(np.log(ratios).mean())))
+            for (program, variant, reference), ratios in sorted(groups.items())]
+
+
+def write_json(file, rows, overheads, means):
+    json.dump({'results': [row._asdict() for row in rows],
+               'overheads': [overhead._asdict() for overhead in overheads],
+               'geometric_means': [mean._asdict() for mean in means]}, file, indent=2)
+    file.write('\n')
+
+
+def write_csv(file, rows, overheads, means):
+    """Write results, overheads and their geometric means as one table,
+    telling them apart by the "table" column."""
+    writer = csv.DictWriter(file, CSV_COLUMNS, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(dict(row._asdict(), table='result'))
+    for overhead in overheads:
+        writer.writerow(dict(overhead._asdict(), table='overhead'))
+    for mean in means:
+        writer.writerow(dict(mean._asdict(), table='geometric mean', benchmark='*'))
@@ -0,0 +1,126 @@
+"""Statistics over repeated measurements of a benchmark metric.
+
+The samples of a metric are kept in a compact array (integers for cycle
+counts, doubles for rates) and aggregated with NumPy. Outliers are detected
+with the modified z-score of Iglewicz and Hoaglin, which relies on the median
+and is therefore not skewed by the outliers themselves.
+"""
+
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+# Modified z-score above which a sample is an outlier
+OUTLIER_THRESHOLD = 3.5
+# Below this many samples, the median absolute deviation is too unstable to
+# tell outliers apart
+MIN_OUTLIER_SAMPLES = 5
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom
+T95 = [float('inf'), 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z95 = 1.960
+
+Summary = namedtuple('Summary', ['count', 'median', 'mean', 'std', 'ci'])
+
+
+def t95(dof):
+    return T95[dof] if dof < len(T95) else Z95
+
+
+class Samples(object):
+    def __init__(self, values=()):
+        self.__values = None
+        self.rejected = []
+        self.extend(values)
+
+    def append(self, value):
+        if self.__values is None:
+            self.__values = array('q' if isinstance(value, int) else 'd')
+        elif self.__values.typecode == 'q' and not isinstance(value, int):
+            self.__values = array('d', self.__values)
+        self.__values.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return 0 if self.__values is None else len(self.__values)
+
+    def __iter__(self):
+        return iter(self.__values or ())
+
+    def __getitem__(self, index):
+        return self.__values[index]
+
+    def array(self):
+        """Return the samples as a NumPy array sharing their memory."""
+        if self.__values is None:
+            return np.empty(0)
+        return np.frombuffer(self.__values, dtype=np.int64 if self.__values.typecode == 'q' else np.float64)
+
+    def summary(self):
+        """Return the count, median, mean, standard deviation and the half
+        width of the 95% confidence interval of the mean."""
+        values = self.array()
+        count = len(values)
+        if count == 0:
+            return Summary(0, float('nan'), float('nan'), float('nan'), float('inf'))
+        mean = float(values.mean())
+        std = float(values.std(ddof=1)) if count > 1 else 0.
+        ci = t95(count - 1) * std / count ** .5 if count > 1 else float('inf')
+        return Summary(count, float(np.median(values)), mean, std, ci)
+
+    def relative_ci(self):
+        summary = self.summary()
+        if summary.mean == 0:
+            return 0. if summary.ci == 0 else float('inf')
+        return summary.ci / abs(summary.mean)
+
+    def reject_outliers(self, threshold=OUTLIER_THRESHOLD):
+        """Move outliers from the samples to rejected; returns the number of
+        newly rejected samples.
+
+        Outliers are judged against all samples collected so far, including
+        earlier rejected ones, so that repeated calls do not trim the
+        samples further and further.
+        """
+        kept = self.array()
+        values = np.concatenate([kept, np.array(self.rejected, dtype=kept.dtype)])
+        if len(values) < MIN_OUTLIER_SAMPLES:
+            return 0
+        deviation = np.abs(values - np.median(values))
+        # Scale the median absolute deviation to the standard deviation of a
+        # normal distribution, falling back to the mean absolute deviation
+        # when more than half of the samples are equal
+        scale = np.median(deviation) / 0.6745
+        if scale == 0:
+            scale = deviation.mean() * 1.253314
+        if scale == 0:
+            return 0
+        outliers = deviation / scale > threshold
+        count = int(np.count_nonzero(outliers)) - len(self.rejected)
+        self.rejected = values[outliers].tolist()
+        self.__values = array(self.__values.typecode, values[~outliers].tolist())
+        return max(count, 0)
+
+
+def significantly_different(a, b):
+    """Tell if the means of the samples a and b differ at 95% confidence by
+    Welch's t-test. Returns None if either has fewer than two samples."""
+    a = a.array()
+    b = b.array()
+    if len(a) < 2 or len(b) < 2:
+        return None
+    va = a.var(ddof=1) / len(a)
+    vb = b.var(ddof=1) / len(b)
+    difference = abs(float(b.mean() - a.mean()))
+    if va + vb == 0:
+        return difference != 0
+    t = difference / (va + vb) ** .5
+    # Welch-Satterthwaite degrees of freedom, rounded down to be conservative
+    dof = (va + vb) ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1))
+    return bool(t > t95(int(dof)))
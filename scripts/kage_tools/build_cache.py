@@ -0,0 +1,113 @@
+"""On-disk cache of benchmark builds and measurements.
+
+A project is only rebuilt when the hash of its sources (including linker
+scripts and Eclipse project files) and of the toolchain differs from the one
+recorded at its last successful build. Measurements are recorded together
+with the hash of the binary they were taken from, so a binary only needs to
+be flashed and run again once it changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+DEFAULT_BUILD_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'kage', 'benchmarks.db')
+
+# Files that influence a build
+SOURCE_SUFFIXES = {'.c', '.h', '.s', '.S', '.ld', '.inc'}
+SOURCE_NAMES = {'.project', '.cproject'}
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_sources(root, exclude=()):
+    """Hash the contents of all source files below root.
+
+    Directories in exclude (e.g. build output directories) are skipped.
+    """
+    exclude = {os.path.realpath(directory) for directory in exclude}
+    digest = hashlib.sha256()
+    for directory, subdirs, files in os.walk(root):
+        subdirs[:] = sorted(d for d in subdirs
+                            if d != '.git' and os.path.realpath(os.path.join(directory, d)) not in exclude)
+        for name in sorted(files):
+            if name in SOURCE_NAMES or os.path.splitext(name)[1] in SOURCE_SUFFIXES:
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode() + b'\0')
+                digest.update(hash_file(path).encode())
+    return digest.hexdigest()
+
+
+def fingerprint_toolchain(paths):
+    """Identify a toolchain by the names, sizes and modification times of its files."""
+    digest = hashlib.sha256()
+    for root in paths:
+        root = os.path.expanduser(str(root))
+        digest.update(root.encode() + b'\0')
+        if os.path.isfile(root):
+            stat = os.stat(root)
+            digest.update('{:d}:{:d}'.format(stat.st_size, stat.st_mtime_ns).encode())
+            continue
+        for directory, subdirs, files in os.walk(root):
+            subdirs.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                digest.update('{:s}:{:d}:{:d}'.format(os.path.relpath(path, root), stat.st_size,
+                                                      stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Builders and boards use the cache from several threads
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS builds (project TEXT PRIMARY KEY, source_hash TEXT)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS results '
+                          '(binary TEXT PRIMARY KEY, elf_hash TEXT, perf TEXT, sizes TEXT)')
+
+    def is_built(self, project, source_hash):
+        """Check if project was last built successfully from sources with source_hash."""
+        with self.__lock:
+            row = self.__db.execute('SELECT source_hash FROM builds WHERE project = ?', (project,)).fetchone()
+        return row is not None and row[0] == source_hash
+
+    def record_build(self, project, source_hash):
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO builds VALUES (?, ?)', (project, source_hash))
+            self.__db.commit()
+
+    def results(self, binary, elf_hash):
+        """Return the (perf, sizes) measured for binary with elf_hash, or None."""
+        with self.__lock:
+            row = self.__db.execute('SELECT elf_hash, perf, sizes FROM results WHERE binary = ?',
+                                    (binary,)).fetchone()
+        if row is None or row[0] != elf_hash:
+            return None
+        return json.loads(row[1]), json.loads(row[2])
+
+    def record_results(self, binary, elf_hash, perf, sizes):
+        with self.__lock:
+            self.__db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                              (binary, elf_hash, json.dumps(perf), json.dumps(sizes)))
+            self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
@@ -0,0 +1,90 @@
+"""Client of the analysis daemon (see daemon).
+
+Requests and responses are JSON objects, one per line. A request names a
+command and its arguments; a response holds either its result or an error.
+This module imports nothing but the standard library and scan_report, so
+asking a running daemon costs little more than starting the interpreter.
+"""
+
+import json
+import os
+import socket
+
+from .scan_report import Violation
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.cache', 'kage', 'daemon.sock')
+
+
+class DaemonError(Exception):
+    """The daemon could not be reached or could not serve a request."""
+    pass
+
+
+class DaemonClient(object):
+    def __init__(self, path=DEFAULT_SOCKET):
+        """Connect to the daemon listening on the Unix socket at path."""
+        self.path = path
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.__socket.connect(path)
+        except OSError as e:
+            self.__socket.close()
+            raise DaemonError('Cannot connect to the daemon at {:s}: {:s}'.format(path, e.strerror or str(e)))
+        self.__file = self.__socket.makefile('rw')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.__file.close()
+        self.__socket.close()
+
+    def request(self, command, **args):
+        """Send a request and return its result."""
+        try:
+            self.__file.write(json.dumps(dict(args, command=command)) + '\n')
+            self.__file.flush()
+            line = self.__file.readline()
+        except OSError as e:
+            raise DaemonError('Lost the connection to the daemon: {:s}'.format(e.strerror or str(e)))
+        if not line:
+            raise DaemonError('The daemon closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise DaemonError(response['error'])
+        return response['result']
+
+    def ping(self):
+        """Return the process ID of the daemon."""
+        return self.request('ping')['pid']
+
+    def scan(self, paths, sections=('.text',), unaligned=False, cache=None):
+        """Scan binaries, directories of binaries or glob patterns like
+        CodeScanner does.
+
+        Returns a (binary, violations, error) triple per binary, like those
+        of code_scanner.stream_batch(); error is None unless the scan of
+        the binary failed. Binaries are named by their absolute paths.
+        """
+        results = self.request('scan', paths=[os.path.abspath(path) for path in paths], sections=sorted(sections),
+                               unaligned=unaligned, cache=cache and os.path.abspath(cache))
+        return [(result['binary'], [Violation(**violation) for violation in result['violations']], result['error'])
+                for result in results]
+
+    def analyze(self, binary, mode, secure_api_path, engine='native', cache_dir=None):
+        """Analyze the gadgets of a binary like gadget_analysis.analyze_binary().
+
+        Returns a dict of the numbers of all and of reachable gadgets
+        ('total', 'reachable') and the StoreCounter.as_dict() of the
+        privileged stores ('stores').
+        """
+        return self.request('analyze', binary=os.path.abspath(binary), mode=mode,
+                            secure_api_path=os.path.abspath(secure_api_path), engine=engine,
+                            cache_dir=cache_dir and os.path.abspath(cache_dir))
+
+    def shutdown(self):
+        """Stop the daemon."""
+        self.request('shutdown')
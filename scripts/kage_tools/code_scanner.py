@@ -0,0 +1,436 @@
+"""Kage code scanner: find instructions in untrusted code that may escape the
+protection of the trusted region.
+
+CodeScanner decodes the code sections of a binary and yields a Violation
+(see scan_report) for every offending instruction. stream_batch() and
+scan_batch() scan many binaries across a process pool.
+"""
+
+import glob
+import os
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, repeat
+from pathlib import Path
+
+import numpy as np
+from elftools.common.exceptions import ELFError
+
+from .elf_access import MappedELF
+from .scan_cache import ScanCache
+from .scan_report import Violation, format_text
+from .symbol_index import SymbolIndex
+from .thumb_decoder import DecodedSection, TruncatedInstruction, halfwords, instruction_boundary
+
+
+class ScanError(Exception):
+    """A binary or code section that cannot be scanned."""
+    pass
+
+
+class CodeScanner(object):
+    SECURE_APIS = [
+        'xTaskCreateRestricted',
+        'vTaskFinishInit',
+        'vTaskDelete',
+        'vTaskDelayUntil',
+        'vTaskDelay',
+        'vTaskPrioritySet',
+        'vTaskSuspend',
+        'vTaskResume',
+        'vTaskAllocateMPURegions',
+        'ulTaskNotifyTake',
+        'xTaskNotifyWait',
+        'xTaskGenericNotify',
+        'xTaskNotifyStateClear',
+
+        'vTaskMissedYield',
+        'xTaskPriorityInherit',
+        'xTaskPriorityDisinherit',
+        'xTaskPriorityDisinheritAfterTimeout',
+        'pvTaskIncrementMutexHeldCount',
+        'vTaskSuspendAll',
+        'xTaskResumeAll',
+        'vTaskPlaceOnEventList',
+        'vTaskPlaceOnEventListRestricted',
+        'vTaskPlaceOnUnorderedEventList',
+        'xTaskRemoveFromEventList',
+        'vTaskRemoveFromUnorderedEventList',
+
+        'xTaskResumeFromISR',
+        'xTaskGenericNotifyFromISR',
+        'vTaskNotifyGiveFromISR',
+
+        'vPortEnterCritical',
+        'vPortExitCritical',
+
+        'vMainUARTPrintString',
+    ]
+
+    # Section of the system call stubs, the only code allowed to use SVC
+    SYSCALL_SECTION = 'freertos_system_calls'
+
+    # MPU registers within the System Control Space
+    MPU_START = 0xe000ed90
+    MPU_END = 0xe000edbc
+
+    def __init__(self, binary, sections, unaligned, cache=None):
+        self.binary = binary
+        self.sections = sections
+        self.unaligned = unaligned
+
+        self.__elf = MappedELF(binary)
+        self.__privileged_section = self.__elf.section('privileged_functions')
+        if not self.__privileged_section:
+            raise ScanError('No section named privileged_functions')
+        for section in self.sections:
+            text = self.__elf.section(section)
+            if not text:
+                raise ScanError('Section does not exist: {:s}'.format(section))
+            if text.data_size % 2:
+                raise ScanError('Odd code section size: {:s}'.format(section))
+
+        # Construct an index of PC -> function
+        if not self.__elf.section('.symtab'):
+            raise ScanError('Stripped binary not supported')
+        self.__funcs = SymbolIndex.from_elf(self.__elf)
+
+        # Open the result cache, keyed by everything that affects the findings
+        self.__functions = {}
+        self.__cache = None
+        if cache is not None:
+            self.__cache = ScanCache(cache, {
+                'secure_apis': sorted(CodeScanner.SECURE_APIS),
+                'unaligned': self.unaligned,
+            })
+
+    def scan(self):
+        offending = False
+
+        for violation in self.violations():
+            print(format_text(violation))
+            offending = True
+
+        return offending
+
+    def close(self):
+        """Close the binary and the result cache."""
+        self.__elf.close()
+        if self.__cache is not None:
+            self.__cache.close()
+
+    def violations(self):
+        """Yield a Violation for each violation in the scanned sections, as found."""
+        for section in self.sections:
+            yield from self.scan_section(section)
+
+    def chunks(self, section, chunk_size):
+        """Split a section into byte ranges of about chunk_size bytes.
+
+        Chunks consist of whole functions (see functions()): literal loads
+        are only paired with the instructions using them within a function,
+        so each chunk has the same findings as in a scan of the section.
+        """
+        size = self.__elf.section(section).data_size
+        boundaries = [0]
+        for _, end in self.functions(section):
+            if end - boundaries[-1] >= chunk_size or end == size:
+                boundaries.append(end)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def functions(self, section):
+        """Split a section at function starts into byte ranges.
+
+        Function starts are moved forward to the next instruction boundary,
+        so each range decodes exactly as it does as part of the section.
+        """
+        if section in self.__functions:
+            return self.__functions[section]
+
+        text = self.__elf.section(section)
+        base = text.header['sh_addr']
+        size = text.data_size
+        hw = halfwords(self.__elf.section_data(section))
+        boundaries = [0]
+        for addr in self.__funcs.in_section(section):
+            if base < addr < base + size:
+                pos = 2 * instruction_boundary(hw, (addr - base) // 2)
+                if boundaries[-1] < pos < size:
+                    boundaries.append(pos)
+        boundaries.append(size)
+        self.__functions[section] = list(zip(boundaries[:-1], boundaries[1:]))
+        return self.__functions[section]
+
+    def scan_section(self, section, start=0, end=None):
+        """Yield a Violation for each violation in bytes [start, end) of a section.
+
+        start must be an instruction boundary, e.g. one returned by chunks().
+        """
+        text = self.__elf.section(section)
+        base = text.header['sh_addr']
+        data = self.__elf.section_data(section)
+        end = len(data) if end is None else end
+        try:
+            if self.__cache is None:
+                findings = self.__decode(section, start, end)
+            else:
+                functions = [(func_start, func_end) for func_start, func_end in self.functions(section)
+                             if start <= func_start and func_end <= end]
+                findings = self.__decode_cached(section, data, base, functions)
+        except TruncatedInstruction as e:
+            raise ScanError('{}: {:s}'.format(e, section)) from None
+
+        reports = {
+            'CPS': self.__report_cps,
+            'SVC': self.__report_svc,
+            'MSR': self.__report_msr,
+            'BRANCH': self.__report_branch,
+            'INDIRECT': self.__report_indirect,
+            'SCS_STORE': self.__report_scs_store,
+        }
+        for addr, kind, operand in findings:
+            violation = reports[kind](section, addr, operand)
+            if violation is not None:
+                yield violation
+
+    def __decode(self, section, start, end, all_branches=False):
+        """Decode bytes [start, end) of a section into (address, kind, operand)
+        findings.
+
+        Only calls and tail calls into the trusted region are included unless
+        all_branches is set. Literals are read from the whole section, but
+        only within the function of the instruction loading them.
+        """
+        base = self.__elf.section(section).header['sh_addr']
+        data = self.__elf.section_data(section)
+        functions = np.array([base + func_start for func_start, _ in self.functions(section)], dtype=np.int64)
+        decoded = DecodedSection(data[start:end], base + start, self.unaligned, (data, base), functions)
+
+        # Collect the findings of all instruction classes and report them
+        # in address order
+        findings = [(addr, 'CPS', None) for addr in decoded.cps.tolist()]
+        findings += [(addr, 'SVC', imm) for addr, imm in zip(decoded.svc.tolist(), decoded.svc_imm.tolist())]
+        findings += [(addr, 'MSR', sysm)
+                     for addr, sysm in zip(decoded.msr.tolist(), decoded.msr_sysm.tolist())]
+        findings += [(addr, 'SCS_STORE', dest)
+                     for addr, dest in zip(decoded.scs_store.tolist(), decoded.scs_store_dest.tolist())]
+
+        branches = [('BRANCH', decoded.branch, decoded.branch_link, decoded.branch_dest),
+                    ('INDIRECT', decoded.indirect, decoded.indirect_link, decoded.indirect_dest)]
+        for kind, addrs, links, dests in branches:
+            if all_branches:
+                selected = slice(None)
+            else:
+                priv_start = self.__privileged_section.header['sh_addr']
+                priv_end = priv_start + self.__privileged_section.data_size
+                selected = (dests >= priv_start) & (dests < priv_end)
+            findings += [(addr, kind, (link, dest))
+                         for addr, link, dest in zip(addrs[selected].tolist(), links[selected].tolist(),
+                                                     dests[selected].tolist())]
+
+        findings.sort(key=lambda finding: finding[0])
+        return findings
+
+    def __decode_cached(self, section, data, base, functions):
+        """Like __decode(), but reuse the findings cached for unchanged functions.
+
+        functions is a list of consecutive (start, end) byte ranges of data.
+        Only the ranges whose bytes (at their alignment) are not in the
+        cache are decoded. Calls and tail calls leaving a function are
+        cached with their destination relative to the function and are
+        resolved against the current privileged functions on every scan, so
+        a moved trusted callee is reported correctly without decoding the
+        caller again. Literal addresses, e.g. of BX/BLX through a register,
+        are absolute and cached as they are.
+        """
+        keys = [self.__cache.key(data[start:end], base + start) for start, end in functions]
+        cached = self.__cache.get_many(keys)
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        # Decode each run of adjacent changed functions at once and split the
+        # findings up afterwards
+        for _, run in groupby(enumerate(missing), key=lambda item: item[1] - item[0]):
+            run = [i for _, i in run]
+            decoded = self.__decode(section, functions[run[0]][0], functions[run[-1]][1], all_branches=True)
+            addrs = [addr for addr, _, _ in decoded]
+            for i in run:
+                start, end = functions[i]
+                func_findings = []
+                for addr, kind, operand in decoded[bisect_left(addrs, base + start):
+                                                   bisect_left(addrs, base + end)]:
+                    if kind == 'BRANCH':
+                        link, dest = operand
+                        if base + start <= dest < base + end:
+                            # Branches within the function cannot reach the trusted region
+                            continue
+                        operand = (link, dest - base - start)
+                    func_findings.append((addr - base - start, kind, operand))
+                cached[keys[i]] = func_findings
+                self.__cache.put(keys[i], func_findings)
+        if missing:
+            self.__cache.commit()
+
+        findings = []
+        for (start, _), key in zip(functions, keys):
+            for offset, kind, operand in cached[key]:
+                if kind == 'BRANCH':
+                    operand = (operand[0], base + start + operand[1])
+                findings.append((base + start + offset, kind, operand))
+        return findings
+
+    def __violation(self, section, addr, kind, instruction, target, message):
+        func = self.__funcs.lookup(addr)
+        return Violation(self.binary, section, addr, self.__funcs.name(func) if func >= 0 else None, kind,
+                         instruction, target, message)
+
+    def __report_cps(self, section, addr, _):
+        return self.__violation(section, addr, 'CPS', 'CPS', None, 'CPS at 0x{:x}'.format(addr))
+
+    def __report_svc(self, section, addr, imm):
+        func = self.__funcs.lookup(addr)
+        if func >= 0 and self.__funcs.section(func) == CodeScanner.SYSCALL_SECTION:
+            return None
+
+        return self.__violation(section, addr, 'SVC', 'SVC', '#{:d}'.format(imm),
+                                'SVC #{:d} at 0x{:x}'.format(imm, addr))
+
+    def __report_msr(self, section, addr, sysm):
+        sysm_list = {
+            0x8: 'MSP',
+            0x9: 'PSP',
+            0x10: 'PRIMASK',
+            0x11: 'BASEPRI',
+            0x12: 'BASEPRI_MAX',
+            0x13: 'FAULTMASK',
+            0x14: 'CONTROL',
+        }
+        if sysm in sysm_list:
+            return self.__violation(section, addr, 'MSR', 'MSR', sysm_list[sysm],
+                                    'MSR {:s} at 0x{:x}'.format(sysm_list[sysm], addr))
+
+        return None
+
+    def __report_scs_store(self, section, addr, dest):
+        region = 'MPU' if CodeScanner.MPU_START <= dest < CodeScanner.MPU_END else 'SCS'
+        return self.__violation(section, addr, 'SCS_STORE', 'STORE', '0x{:x}'.format(dest),
+                                'Store to {:s} register 0x{:x} at 0x{:x}'.format(region, dest, addr))
+
+    def __report_branch(self, section, addr, operand):
+        link, dest = operand
+        priv_start = self.__privileged_section.header['sh_addr']
+        priv_end = priv_start + self.__privileged_section.data_size
+        if dest < priv_start or dest >= priv_end:
+            return None
+
+        opcode = 'BL' if link else 'B'
+        func = self.__funcs.find(dest)
+        if func < 0:
+            raise ScanError('Jump to the middle of trusted function')
+        name = self.__funcs.name(func)
+        if name not in CodeScanner.SECURE_APIS:
+            return self.__violation(section, addr, 'BRANCH', opcode, name,
+                                    '{:s} {:s} at 0x{:x}'.format(opcode, name, addr))
+
+        return None
+
+    def __report_indirect(self, section, addr, operand):
+        link, dest = operand
+        priv_start = self.__privileged_section.header['sh_addr']
+        priv_end = priv_start + self.__privileged_section.data_size
+        if dest < priv_start or dest >= priv_end:
+            return None
+
+        opcode = 'BLX' if link else 'BX'
+        func = self.__funcs.find(dest)
+        name = self.__funcs.name(func) if func >= 0 else '0x{:x}'.format(dest)
+        if name not in CodeScanner.SECURE_APIS:
+            return self.__violation(section, addr, 'INDIRECT', opcode, name,
+                                    '{:s} {:s} at 0x{:x}'.format(opcode, name, addr))
+
+        return None
+
+
+# Scanners opened by the current (worker) process, keyed by their arguments
+_scanners = {}
+
+
+def _get_scanner(binary, sections, unaligned, cache):
+    key = (binary, sections, unaligned, cache)
+    if key not in _scanners:
+        _scanners[key] = CodeScanner(binary, set(sections), unaligned, cache)
+    return _scanners[key]
+
+
+def _plan_binary(binary, sections, unaligned, cache, chunk_size):
+    """List the (section, start, end) chunks of a binary to be scanned."""
+    try:
+        scanner = _get_scanner(binary, sections, unaligned, cache)
+        return [(section, start, end)
+                for section in sections
+                for start, end in scanner.chunks(section, chunk_size)], None
+    except (ScanError, OSError, ELFError) as e:
+        return [], str(e)
+
+
+def _scan_chunk(binary, sections, unaligned, cache, section, start, end):
+    try:
+        return list(_get_scanner(binary, sections, unaligned, cache).scan_section(section, start, end)), None
+    except ScanError as e:
+        return [], str(e)
+
+
+def expand_binaries(paths):
+    """Expand directories and glob patterns into a sorted list of ELF paths."""
+    binaries = []
+    for path in paths:
+        if os.path.isdir(path):
+            binaries += sorted(str(p) for p in Path(path).rglob('*.elf'))
+        elif glob.has_magic(path):
+            binaries += sorted(glob.glob(path, recursive=True))
+        else:
+            binaries.append(path)
+    # Remove duplicates but keep the order
+    return list(dict.fromkeys(binaries))
+
+
+def stream_batch(binaries, sections, unaligned, cache, jobs, chunk_size):
+    """Scan several binaries across a process pool.
+
+    Yields a (binary, violations, error) triple for each scanned chunk in
+    the order of binaries, as soon as it and all chunks before it are
+    scanned; error is None unless the scan failed. A binary that cannot be
+    opened yields a single triple without violations. The remaining chunks
+    are cancelled if the caller stops early.
+    """
+    sections = tuple(sorted(sections))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        plans = list(pool.map(_plan_binary, binaries, repeat(sections), repeat(unaligned), repeat(cache),
+                              repeat(chunk_size)))
+
+        tasks = [(binary, chunk) for binary, (chunks, _) in zip(binaries, plans) for chunk in chunks]
+        results = pool.map(_scan_chunk,
+                           [binary for binary, _ in tasks], repeat(sections), repeat(unaligned), repeat(cache),
+                           *zip(*[chunk for _, chunk in tasks]))
+        try:
+            for binary, (chunks, error) in zip(binaries, plans):
+                if error is not None:
+                    yield binary, [], error
+                for _ in chunks:
+                    violations, error = next(results)
+                    yield binary, violations, error
+        finally:
+            results.close()
+
+
+def scan_batch(binaries, sections, unaligned, cache, jobs, chunk_size):
+    """Scan several binaries across a process pool.
+
+    Returns a dict mapping each binary to a (violations, error) pair, where
+    error is None unless the scan of the binary failed.
+    """
+    reports = {binary: ([], None) for binary in binaries}
+    for binary, violations, error in stream_batch(binaries, sections, unaligned, cache, jobs, chunk_size):
+        reports[binary][0].extend(violations)
+        if error is not None and reports[binary][1] is None:
+            reports[binary] = (reports[binary][0], error)
+    return reports
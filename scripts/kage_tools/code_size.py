@@ -0,0 +1,166 @@
+"""Code size of binaries by section and by function.
+
+Every function symbol of .symtab is attributed its size, its section and the
+bytes of CFI labels (0xf871f870) instrumented into it. Comparing a Kage
+binary to the FreeRTOS build of the same benchmark shows which functions
+grew, and how much of their growth is CFI labels; the rest is other
+instrumentation, e.g. of the shadow stack, and changed code generation.
+
+    python -m kage_tools.code_size [-j <jobs>] [-n <functions>] [--baseline <binary>] <binary>...
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .elf_access import MappedELF
+from .symbol_index import SymbolIndex
+from .thumb_decoder import CFI_LABEL, TruncatedInstruction, decode, halfwords, wide_words
+
+# Sections of the trusted and untrusted code of Kage. In FreeRTOS, all code
+# is trusted.
+TRUSTED_SECTIONS = ('privileged_functions',)
+UNTRUSTED_SECTIONS = ('freertos_system_calls', '.text')
+
+FunctionSize = namedtuple('FunctionSize', ['section', 'size', 'cfi_bytes'])
+Growth = namedtuple('Growth', ['name', 'section', 'baseline_size', 'size', 'growth', 'cfi_bytes'])
+
+
+class CodeSize(object):
+    def __init__(self, path, sections, functions):
+        """Code size of the binary at path: sections maps the names of code
+        sections to their sizes, and functions the names of functions to
+        their FunctionSize."""
+        self.path = path
+        self.sections = sections
+        self.functions = functions
+
+    def split(self, baseline):
+        """Return the trusted and untrusted code size, where all code of a
+        baseline (FreeRTOS) binary is trusted."""
+        trusted = sum(self.sections.get(name, 0) for name in TRUSTED_SECTIONS)
+        untrusted = sum(self.sections.get(name, 0) for name in UNTRUSTED_SECTIONS)
+        if baseline:
+            return {'trusted': trusted + untrusted, 'untrusted': 0}
+        return {'trusted': trusted, 'untrusted': untrusted}
+
+    def total(self):
+        return sum(self.sections.values())
+
+    def cfi_bytes(self):
+        return sum(function.cfi_bytes for function in self.functions.values())
+
+    def unattributed(self):
+        """Bytes of each code section not covered by a function symbol."""
+        covered = {}
+        for function in self.functions.values():
+            covered[function.section] = covered.get(function.section, 0) + function.size
+        return {name: size - covered.get(name, 0) for name, size in self.sections.items()}
+
+
+def analyze(path):
+    """Measure the code sections and functions of the binary at path."""
+    with MappedELF(str(path)) as elf:
+        index = SymbolIndex.from_elf(elf)
+        sections = {}
+        cfi = np.zeros(len(index), dtype=np.int64)
+        for name in elf.executable_sections():
+            sections[name] = elf.section_size(name)
+            start, _ = elf.section_bounds(name)
+            hw = halfwords(elf.section_data(name))
+            try:
+                _, wide = decode(hw)
+            except TruncatedInstruction:
+                # The section ends in data, e.g. a literal, that looks like
+                # the start of a 32-bit instruction
+                hw = hw[:-1]
+                _, wide = decode(hw)
+            labels = start + 2 * wide[wide_words(hw, wide) == CFI_LABEL].astype(np.int64)
+            owners = index.lookup_many(labels)
+            cfi += 4 * np.bincount(owners[owners >= 0], minlength=len(index))
+            del hw, wide
+        functions = {}
+        for i in range(len(index)):
+            name = index.name(i)
+            size = int(index.sizes[i])
+            if index.section(i) not in sections:
+                continue
+            if name in functions:
+                # Local functions of the same name in several files
+                previous = functions[name]
+                size += previous.size
+                cfi[i] += previous.cfi_bytes
+            functions[name] = FunctionSize(index.section(i), size, int(cfi[i]))
+    return CodeSize(str(path), sections, functions)
+
+
+def analyze_all(paths, jobs=None):
+    """Analyze several binaries in parallel; returns their CodeSize by path."""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return dict(zip(paths, executor.map(analyze, paths)))
+
+
+def growth(baseline, result):
+    """Per-function growth from a baseline binary to another, largest first.
+
+    Functions missing from the baseline grew by their whole size.
+    """
+    changes = []
+    for name, function in result.functions.items():
+        old = baseline.functions.get(name)
+        oldSize = 0 if old is None else old.size
+        changes.append(Growth(name, function.section, oldSize, function.size, function.size - oldSize,
+                              function.cfi_bytes - (0 if old is None else old.cfi_bytes)))
+    changes.sort(key=lambda change: (-change.growth, change.name))
+    return changes
+
+
+def format_growth(changes, limit=None):
+    """Tabulate the first limit changes returned by growth."""
+    lines = ['{:40s} {:24s} {:>9s} {:>9s} {:>9s} {:>9s}'.format('function', 'section', 'baseline', 'size',
+                                                                'growth', 'CFI')]
+    for change in changes[:limit]:
+        lines.append('{:40s} {:24s} {:9d} {:9d} {:+9d} {:+9d}'.format(
+            change.name, change.section, change.baseline_size, change.size, change.growth, change.cfi_bytes))
+    return '\n'.join(lines)
+
+
+def format_functions(size, limit=None):
+    """Tabulate the limit largest functions of a binary."""
+    lines = ['{:40s} {:24s} {:>9s} {:>9s}'.format('function', 'section', 'size', 'CFI')]
+    for name, function in sorted(size.functions.items(), key=lambda item: (-item[1].size, item[0]))[:limit]:
+        lines.append('{:40s} {:24s} {:9d} {:9d}'.format(name, function.section, function.size, function.cfi_bytes))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the code size of binaries by section and function')
+    parser.add_argument('binaries', nargs='+', help='binaries to analyze')
+    parser.add_argument('--baseline', help='report the growth of each function over this binary')
+    parser.add_argument('-n', dest='limit', type=int, default=20,
+                        help='number of functions to report per binary (default: 20)')
+    parser.add_argument('-j', dest='jobs', type=int, help='number of binaries analyzed in parallel')
+    args = parser.parse_args()
+
+    paths = args.binaries + ([args.baseline] if args.baseline else [])
+    sizes = analyze_all(paths, args.jobs)
+    for path in args.binaries:
+        size = sizes[path]
+        print('{:s}:'.format(path))
+        for name, sectionSize in sorted(size.sections.items()):
+            print('  {:40s} {:9d} bytes ({:d} outside functions)'.format(name, sectionSize,
+                                                                          size.unattributed()[name]))
+        if args.baseline:
+            baseline = sizes[args.baseline]
+            print('  Growth over {:s}: {:+d} bytes, {:+d} of them CFI labels'.format(
+                args.baseline, size.total() - baseline.total(), size.cfi_bytes() - baseline.cfi_bytes()))
+            table = format_growth(growth(baseline, size), args.limit)
+        else:
+            table = format_functions(size, args.limit)
+        print('\n'.join('  ' + line for line in table.splitlines()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Long-lived analysis daemon, serving scans and gadget analyses over a Unix socket.
+
+Starting the interpreter, importing NumPy and pyelftools and parsing a
+binary dominate every run of the code scanner on a single binary. The
+daemon keeps the CodeScanner of each recently scanned binary, with its
+mapped ELF file, symbol index and function boundaries, and the gadget
+analysis of each recently analyzed binary. They are reused until the binary
+changes on disk (by size, modification time or inode), so e.g. an editor or
+a pre-commit hook only pays for decoding the binary once per build.
+
+Run it with
+
+    python -m kage_tools.daemon [--socket <path>]
+
+and pass --daemon to code-scanner.py, or use a client.DaemonClient. It
+serves every connection in a thread of its own, so an idle client does not
+hold up the others; each connection may send any number of requests.
+Scans and analyses run one at a time.
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+
+from elftools.common.exceptions import ELFError
+
+from .client import DEFAULT_SOCKET
+from .code_scanner import CodeScanner, ScanError, expand_binaries
+from .gadget_analysis import MODES, AnalysisError, analyze_binary
+
+# Number of binaries whose scanners and analyses are kept at a time
+MAX_BINARIES = 32
+
+
+def file_identity(path):
+    """Identify the contents of a file without reading it."""
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class AnalysisState(object):
+    """Scanners and gadget analyses of the most recently used binaries."""
+
+    def __init__(self, max_binaries=MAX_BINARIES):
+        self.max_binaries = max_binaries
+        # (arguments) -> (file identity, scanner or analysis), least
+        # recently used first
+        self.__scanners = OrderedDict()
+        self.__analyses = OrderedDict()
+        # Guards both, and the scanners and analyses in them
+        self.__lock = threading.Lock()
+
+    def __reuse(self, entries, key, identity, create, close=None):
+        entry = entries.pop(key, None)
+        if entry is not None and entry[0] != identity:
+            if close is not None:
+                close(entry[1])
+            entry = None
+        if entry is None:
+            entry = (identity, create())
+        entries[key] = entry
+        while len(entries) > self.max_binaries:
+            _, (_, value) = entries.popitem(last=False)
+            if close is not None:
+                close(value)
+        return entry[1]
+
+    def scanner(self, binary, sections, unaligned, cache):
+        """Return a CodeScanner of the current contents of binary."""
+        return self.__reuse(self.__scanners, (binary, sections, unaligned, cache), file_identity(binary),
+                            lambda: CodeScanner(binary, set(sections), unaligned, cache),
+                            lambda scanner: scanner.close())
+
+    def scan(self, paths, sections, unaligned, cache):
+        """Scan the binaries given by paths (expanded like expand_binaries())."""
+        results = []
+        for binary in expand_binaries(paths):
+            try:
+                with self.__lock:
+                    scanner = self.scanner(binary, tuple(sections), unaligned, cache)
+                    violations = [violation._asdict() for violation in scanner.violations()]
+                results.append({'binary': binary, 'violations': violations, 'error': None})
+            except (ScanError, OSError, ELFError) as e:
+                results.append({'binary': binary, 'violations': [], 'error': str(e)})
+        return results
+
+    def analyze(self, binary, mode, secure_api_path, engine, cache_dir):
+        """Analyze the gadgets of binary like analyze_binary()."""
+        if mode not in MODES:
+            raise AnalysisError('Unknown mode: {:s}'.format(mode))
+        identity = (file_identity(binary), file_identity(secure_api_path) if mode == 'kage' else None)
+
+        def create():
+            analysis = analyze_binary(binary, mode, secure_api_path, engine, cache_dir=cache_dir)
+            return {'total': analysis.total, 'reachable': analysis.reachable, 'stores': analysis.stores.as_dict()}
+
+        with self.__lock:
+            return self.__reuse(self.__analyses, (binary, mode, secure_api_path, engine, cache_dir), identity,
+                                create)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                command = request.pop('command')
+                response = {'result': self.server.dispatch(command, request)}
+            except (ValueError, KeyError, TypeError, AnalysisError, OSError) as e:
+                response = {'error': '{:s}: {}'.format(type(e).__name__, e)}
+            except Exception as e:
+                # A bug rather than a bad request: keep serving, but log it
+                print('ERROR: Request {:s} failed'.format(line.decode(errors='replace').strip()), file=sys.stderr)
+                traceback.print_exc()
+                response = {'error': '{:s}: {}'.format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            if self.server.stopping:
+                # Let serve() return; shutdown() waits for it, so it cannot
+                # be called from the thread serving connections
+                threading.Thread(target=self.server.shutdown).start()
+                break
+
+
+class AnalysisDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Open connections do not keep the daemon from exiting
+    daemon_threads = True
+
+    def __init__(self, path, max_binaries=MAX_BINARIES):
+        """Listen on a Unix socket at path, replacing a stale one."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError('A daemon is already listening on {:s}'.format(path))
+            except ConnectionRefusedError:
+                os.unlink(path)
+            finally:
+                probe.close()
+        # Only the user running the daemon may send it requests
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, RequestHandler)
+        finally:
+            os.umask(umask)
+        self.state = AnalysisState(max_binaries)
+        self.stopping = False
+
+    def dispatch(self, command, args):
+        if command == 'ping':
+            return {'pid': os.getpid()}
+        if command == 'scan':
+            return self.state.scan(args['paths'], args.get('sections', ['.text']), args.get('unaligned', False),
+                                   args.get('cache'))
+        if command == 'analyze':
+            return self.state.analyze(args['binary'], args['mode'], args['secure_api_path'],
+                                      args.get('engine', 'native'), args.get('cache_dir'))
+        if command == 'shutdown':
+            self.stopping = True
+            return None
+        raise ValueError('Unknown command: {:s}'.format(command))
+
+    def serve(self):
+        """Serve connections until a shutdown request, SIGINT or SIGTERM."""
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            os.unlink(self.server_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kage analysis daemon')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='path of the Unix socket to listen on (default: {:s})'.format(DEFAULT_SOCKET))
+    parser.add_argument('--max-binaries', type=int, default=MAX_BINARIES,
+                        help='number of binaries kept parsed at a time')
+    args = parser.parse_args()
+
+    try:
+        daemon = AnalysisDaemon(args.socket, args.max_binaries)
+    except OSError as e:
+        print('ERROR: {}'.format(e))
+        exit(1)
+    print('Listening on {:s}'.format(args.socket), flush=True)
+    daemon.serve()
+
+
+if __name__ == '__main__':
+    main()
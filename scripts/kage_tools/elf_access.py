@@ -0,0 +1,128 @@
+"""Memory-mapped, zero-copy access to ELF binaries.
+
+Section contents and symbol tables are handed out as memoryview slices (or
+NumPy views over them) of a single read-only mapping of the binary, so no
+section is ever copied into a separate bytes object.
+"""
+
+import mmap
+
+import numpy as np
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+
+STT_FUNC = 2
+SHF_EXECINSTR = 0x4
+PF_X = 0x1
+
+
+class MappedELF(object):
+    def __init__(self, path):
+        self.path = path
+
+        self.__file = open(path, 'rb')
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            self.__file.close()
+            raise ELFError('{:s} is empty'.format(path))
+        self.__view = memoryview(self.__map)
+        # pyelftools only needs read() and seek(), which the mapping provides
+        self.elf = ELFFile(self.__map)
+
+        byteorder = '<' if self.elf.little_endian else '>'
+        if self.elf.elfclass == 32:
+            self.__sym_dtype = np.dtype([('st_name', byteorder + 'u4'), ('st_value', byteorder + 'u4'),
+                                         ('st_size', byteorder + 'u4'), ('st_info', 'u1'),
+                                         ('st_other', 'u1'), ('st_shndx', byteorder + 'u2')])
+        else:
+            self.__sym_dtype = np.dtype([('st_name', byteorder + 'u4'), ('st_info', 'u1'),
+                                         ('st_other', 'u1'), ('st_shndx', byteorder + 'u2'),
+                                         ('st_value', byteorder + 'u8'), ('st_size', byteorder + 'u8')])
+
+        symtab = self.section('.symtab')
+        if symtab is not None:
+            self.__strtab_offset = self.elf.get_section(symtab.header['sh_link']).header['sh_offset']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmap the binary. Views handed out must no longer be referenced."""
+        self.__view.release()
+        self.__map.close()
+        self.__file.close()
+
+    def section(self, name):
+        return self.elf.get_section_by_name(name)
+
+    def section_name(self, index):
+        """Name of the section at index, or None for undefined/reserved indices."""
+        if index == 0 or index >= 0xff00:
+            return None
+        return self.elf.get_section(index).name
+
+    def section_size(self, name):
+        """Size of a section in bytes, or 0 if the binary has no such section."""
+        section = self.section(name)
+        return 0 if section is None else section.data_size
+
+    def section_bounds(self, name):
+        """Address range [start, end) of a section, or None if it does not exist."""
+        section = self.section(name)
+        if section is None:
+            return None
+        return section.header['sh_addr'], section.header['sh_addr'] + section.data_size
+
+    def section_data(self, name):
+        """Contents of a section as a zero-copy memoryview."""
+        section = self.section(name)
+        if section is None:
+            return None
+        if section.header['sh_type'] == 'SHT_NOBITS':
+            return memoryview(b'')
+        offset = section.header['sh_offset']
+        return self.__view[offset:offset + section.header['sh_size']]
+
+    def executable_segments(self):
+        """List (address, zero-copy contents) of all executable segments."""
+        segments = []
+        for segment in self.elf.iter_segments():
+            if segment.header['p_flags'] & PF_X:
+                offset = segment.header['p_offset']
+                segments.append((segment.header['p_vaddr'],
+                                 self.__view[offset:offset + segment.header['p_filesz']]))
+        return segments
+
+    def executable_sections(self):
+        """Names of all sections containing instructions."""
+        return [section.name for section in self.elf.iter_sections()
+                if section.header['sh_flags'] & SHF_EXECINSTR and section.header['sh_type'] != 'SHT_NOBITS']
+
+    def symbols(self):
+        """Symbol table as a zero-copy NumPy record array, or None if stripped."""
+        data = self.section_data('.symtab')
+        if data is None:
+            return None
+        return np.frombuffer(data, dtype=self.__sym_dtype)
+
+    def symbol_name(self, st_name):
+        start = self.__strtab_offset + st_name
+        return self.__map[start:self.__map.find(b'\0', start)].decode()
+
+    def functions(self):
+        """Iterate over (address, size, name, section index) of all STT_FUNC symbols.
+
+        The Thumb bit is cleared from the returned addresses.
+        """
+        syms = self.symbols()
+        if syms is None:
+            return
+        funcs = syms[(syms['st_info'] & 0xf) == STT_FUNC]
+        for value, size, st_name, shndx in zip(funcs['st_value'].tolist(), funcs['st_size'].tolist(),
+                                               funcs['st_name'].tolist(), funcs['st_shndx'].tolist()):
+            yield value & ~0x1, size, self.symbol_name(st_name), shndx
@@ -0,0 +1,87 @@
+"""Gadget analysis of a binary: all gadgets, those reachable under Kage (or,
+in FreeRTOS, all of them) and the privileged stores of the reachable ones.
+
+This is the analysis run-gadgets.py reports for one binary and compares
+across the builds of a manifest.
+"""
+
+from collections import namedtuple
+
+from .gadget_cache import GadgetCache, elf_functions, elf_sections
+from .gadget_finder import find_gadgets, find_gadgets_within, format_gadget
+from .gadget_model import StoreCounter
+from .reachability import KageReachability, filter_reachable, read_secure_apis
+from .symbol_index import SymbolIndex
+
+MODES = ('kage', 'freertos')
+
+# Result of analyzing the gadgets of one binary. stores is a StoreCounter
+# (without symbols) and texts the set of the texts of all reachable gadgets
+# (None unless requested).
+Analysis = namedtuple('Analysis', ['total', 'reachable', 'stores', 'texts'])
+
+
+class AnalysisError(Exception):
+    """An error that terminates the analysis of a binary."""
+    pass
+
+
+def analyze_binary(binary, mode, secure_api_path, engine='native', total_file=None, reach_file=None,
+                   collect_texts=False, cache_dir=None):
+    """Find the gadgets of a binary and the privileged stores of those
+    reachable in the given mode (one of MODES).
+
+    The secure APIs are read from secure_api_path in kage mode. All gadgets
+    and the reachable ones are written to the files total_file and
+    reach_file if given. With a cache directory, the gadgets and symbols of
+    the binary are reused from earlier runs.
+    """
+    cache = None if cache_dir is None else GadgetCache(binary, cache_dir)
+
+    # Stores are attributed to the functions of the binary. In kage mode,
+    # only gadgets in .text, the untrusted code, are reachable.
+    symbols = SymbolIndex(elf_functions(binary, cache))
+    text_range = elf_sections(binary, cache).get('.text')
+    if mode == 'kage' and text_range is None:
+        raise AnalysisError('Could not find the range of untrusted code section.')
+
+    total = 0
+    reachable = 0
+    stores = StoreCounter(symbols)
+    texts = set() if collect_texts else None
+    if mode == 'freertos':
+        # For freertos, all gadgets are reachable since there is no
+        # protection at all
+        for gadget in find_gadgets(binary, engine, cache=cache):
+            line = format_gadget(*gadget) + '\n'
+            total += 1
+            reachable += 1
+            stores.add(*gadget)
+            if total_file:
+                total_file.write(line)
+            if reach_file:
+                reach_file.write(line)
+            if texts is not None:
+                texts.add(gadget[1])
+    else:
+        # Find all gadgets, regardless if they're reachable, along with those
+        # in .text in the same search
+        gadgets, untrusted = find_gadgets_within(binary, text_range, engine, cache=cache)
+        for gadget in gadgets:
+            total += 1
+            if total_file:
+                total_file.write(format_gadget(*gadget) + '\n')
+
+        # Find reachable gadgets
+        entries = KageReachability(binary, read_secure_apis(secure_api_path), cache)
+        for gadget in filter_reachable(untrusted, entries):
+            reachable += 1
+            stores.add(*gadget)
+            if reach_file:
+                reach_file.write(format_gadget(*gadget) + '\n')
+            if texts is not None:
+                texts.add(gadget[1])
+
+    # The symbols are not needed anymore, nor worth sending between processes
+    stores.symbols = None
+    return Analysis(total, reachable, stores, texts)
@@ -0,0 +1,182 @@
+"""On-disk cache of the parsed contents and gadgets of binaries, keyed by content hash.
+
+Everything the gadget scripts derive from a binary, i.e. its function
+table, code sections, return sites and gadgets, depends on nothing but the
+bytes of the binary (and, for gadgets, the search settings). The first
+script to need a piece of it computes it and stores it under the SHA-256 of
+the binary; all later runs of any of the scripts load it instead.
+
+Each piece is a NumPy .npz file in the directory of its binary. Addresses
+are int64 arrays, and strings (function names, instructions) are interned
+into a table stored as one UTF-8 blob with an array of offsets. Gadgets are
+stored as the interned instructions they consist of, which are far fewer
+than gadgets.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .elf_access import MappedELF
+from .thumb_decoder import TruncatedInstruction, return_sites
+
+DEFAULT_GADGET_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'kage', 'gadgets')
+
+# Bump when the format or the contents of cached files change
+CACHE_VERSION = 1
+
+# Separator of the instructions of a gadget in ROPgadget's format
+INSTRUCTION_SEPARATOR = ' ; '
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pack_strings(strings):
+    """Intern strings into a table; returns (blob, offsets, indices)."""
+    table = {}
+    indices = np.array([table.setdefault(string, len(table)) for string in strings], dtype=np.int32)
+    encoded = [string.encode() for string in table]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded], dtype=np.int64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, indices
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[start:end].decode() for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class GadgetCache(object):
+    def __init__(self, binary, directory=DEFAULT_GADGET_CACHE):
+        """Open the cache entry of the binary at path binary."""
+        self.binary = binary
+        self.path = os.path.join(directory, 'v{:d}'.format(CACHE_VERSION), file_digest(binary))
+
+    def __load(self, name):
+        try:
+            with np.load(os.path.join(self.path, name + '.npz')) as data:
+                return {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None
+
+    def __store(self, name, **arrays):
+        # Write to a temporary file first, so concurrent readers never see
+        # a partial file
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, os.path.join(self.path, name + '.npz'))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def symbols(self, name, compute):
+        """Return the (address, size, name, section) tuples stored as name,
+        computing and storing them with compute() if missing."""
+        data = self.__load(name)
+        if data is None:
+            symbols = list(compute())
+            blob, offsets, indices = _pack_strings([symbol[2] for symbol in symbols] +
+                                                   [symbol[3] or '' for symbol in symbols])
+            self.__store(name, addrs=np.array([symbol[0] for symbol in symbols], dtype=np.int64),
+                         sizes=np.array([symbol[1] or 0 for symbol in symbols], dtype=np.int64),
+                         strings=blob, offsets=offsets, indices=indices)
+            return symbols
+        strings = _unpack_strings(data['strings'], data['offsets'])
+        count = len(data['addrs'])
+        names = [strings[i] for i in data['indices'][:count].tolist()]
+        sections = [strings[i] or None for i in data['indices'][count:].tolist()]
+        return list(zip(data['addrs'].tolist(), data['sizes'].tolist(), names, sections))
+
+    def addresses(self, name, compute):
+        """Return the address array stored as name, computing and storing it
+        with compute() if missing."""
+        data = self.__load(name)
+        if data is None:
+            addrs = np.asarray(compute(), dtype=np.int64)
+            self.__store(name, addrs=addrs)
+            return addrs
+        return data['addrs']
+
+    def gadgets(self, name, compute):
+        """Return the (address, text) gadgets stored as name, computing and
+        storing them with compute() if missing."""
+        data = self.__load(name)
+        if data is None:
+            gadgets = list(compute())
+            insns = [text.split(INSTRUCTION_SEPARATOR) for _, text in gadgets]
+            blob, offsets, indices = _pack_strings(insn for gadget in insns for insn in gadget)
+            bounds = np.zeros(len(gadgets) + 1, dtype=np.int64)
+            bounds[1:] = np.cumsum([len(gadget) for gadget in insns], dtype=np.int64)
+            self.__store(name, addrs=np.array([addr for addr, _ in gadgets], dtype=np.int64),
+                         strings=blob, offsets=offsets, indices=indices, bounds=bounds)
+            return gadgets
+        strings = _unpack_strings(data['strings'], data['offsets'])
+        indices = data['indices'].tolist()
+        bounds = data['bounds'].tolist()
+        return [(addr, INSTRUCTION_SEPARATOR.join(strings[i] for i in indices[start:end]))
+                for addr, start, end in zip(data['addrs'].tolist(), bounds[:-1], bounds[1:])]
+
+
+def _elf_functions(binary):
+    with MappedELF(binary) as elf:
+        names = {}
+        for addr, size, name, shndx in elf.functions():
+            if shndx not in names:
+                names[shndx] = elf.section_name(shndx)
+            yield addr, size, name, names[shndx]
+
+
+def _elf_sections(binary):
+    with MappedELF(binary) as elf:
+        for name in elf.executable_sections():
+            start, end = elf.section_bounds(name)
+            yield start, end - start, name, None
+
+
+def _section_return_sites(elf, name):
+    data = elf.section_data(name)
+    start, _ = elf.section_bounds(name)
+    try:
+        return return_sites(data, start)
+    except TruncatedInstruction:
+        # The section ends in data that looks like the start of a 32-bit
+        # instruction, which cannot be a call
+        return return_sites(data[:-2], start)
+
+
+def _elf_return_sites(binary):
+    with MappedELF(binary) as elf:
+        sites = [_section_return_sites(elf, name) for name in elf.executable_sections()]
+    return np.concatenate(sites) if sites else np.zeros(0, dtype=np.int64)
+
+
+def elf_functions(binary, cache=None):
+    """List the (address, size, name, section name) of all function symbols."""
+    if cache is None:
+        return list(_elf_functions(binary))
+    return cache.symbols('functions', lambda: _elf_functions(binary))
+
+
+def elf_sections(binary, cache=None):
+    """Map the names of all code sections to their address ranges [start, end)."""
+    sections = _elf_sections(binary) if cache is None else cache.symbols('sections', lambda: _elf_sections(binary))
+    return {name: (start, start + size) for start, size, name, _ in sections}
+
+
+def elf_return_sites(binary, cache=None):
+    """Addresses of the instructions following a call in all code sections."""
+    if cache is None:
+        return _elf_return_sites(binary)
+    return cache.addresses('return-sites', lambda: _elf_return_sites(binary))
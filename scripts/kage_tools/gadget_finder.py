@@ -0,0 +1,320 @@
+"""In-process Thumb/Thumb-2 gadget discovery and Kage reachability filtering.
+
+This is a native replacement for running ROPgadget through
+find_filter_gadgets.sh. Gadget terminators are located with vectorized
+halfword lookups, instruction boundaries are followed with the same Thumb-2
+length decoding the code scanner uses, and only the instructions on valid
+gadget paths are disassembled (once per address) with Capstone, the
+disassembler ROPgadget itself uses. Output lines have ROPgadget's format.
+"""
+
+import argparse
+import sys
+
+import numpy as np
+from capstone import CS_ARCH_ARM, CS_MODE_THUMB, Cs
+
+from .elf_access import MappedELF
+from .gadget_cache import DEFAULT_GADGET_CACHE, GadgetCache
+from .reachability import KageReachability, filter_reachable, read_secure_apis, run_ropgadget
+from .thumb_decoder import halfwords, instruction_sizes
+
+# ROPgadget's default search depth
+DEPTH = 10
+
+
+def _terminator_table():
+    """Map every halfword to the index of the gadget terminator it starts (0: none)."""
+    # Terminators in ROPgadget's order: (first halfwords, size in halfwords)
+    terminators = [
+        # bx reg
+        ([0x4700 | low for low in (0x00, 0x08, 0x10, 0x18, 0x20, 0x28, 0x30, 0x38, 0x40, 0x48, 0x70)], 1),
+        # blx reg
+        ([0x4700 | low for low in (0x80, 0x88, 0x90, 0x98, 0xa0, 0xa8, 0xb0, 0xb8, 0xc0, 0xc8, 0xf0)], 1),
+        # pop {..., pc}
+        (range(0xbd00, 0xbe00), 1),
+        # ldm.w reg{!}, {..., pc}
+        (list(range(0xe890, 0xe8a0)) + list(range(0xe8b0, 0xe8c0)), 2),
+        # ldmdb reg{!}, {..., pc}
+        (list(range(0xe910, 0xe920)) + list(range(0xe930, 0xe940)), 2),
+    ]
+    table = np.zeros(0x10000, dtype=np.uint8)
+    sizes = [0]
+    for i, (values, size) in enumerate(terminators, 1):
+        table[list(values)] = i
+        sizes.append(size)
+    return table, np.array(sizes)
+
+
+TERMINATORS, TERMINATOR_SIZES = _terminator_table()
+
+
+class GadgetFinder(object):
+    def __init__(self, binary, depth=DEPTH):
+        self.binary = binary
+        self.depth = depth
+
+        self.__elf = MappedELF(binary)
+        self.__md = Cs(CS_ARCH_ARM, CS_MODE_THUMB)
+
+    def __candidates(self, hw):
+        """Find all (terminator kind, start, end) halfword index triples.
+
+        A start up to depth halfwords before a terminator qualifies if
+        decoding from it ends exactly where the terminator ends. Like with
+        ROPgadget, the terminator may thus also be the second half of the
+        last instruction. The triples are in ROPgadget's search order.
+        """
+        kinds = TERMINATORS[hw]
+        refs = np.flatnonzero(kinds)
+        kinds = kinds[refs]
+        # The terminator must fit into the code
+        fits = refs + TERMINATOR_SIZES[kinds] <= len(hw)
+        refs, kinds = refs[fits], kinds[fits]
+
+        back = np.arange(self.depth)
+        starts = (refs[:, None] - back[None, :]).ravel()
+        ends = np.repeat(refs + TERMINATOR_SIZES[kinds], self.depth)
+        kinds = np.repeat(kinds, self.depth)
+        valid = starts >= 0
+        starts, ends, kinds = starts[valid], ends[valid], kinds[valid]
+
+        # Follow the instruction boundaries from each start towards the end
+        sizes = instruction_sizes(hw)
+        pos = starts.copy()
+        for _ in range(self.depth + 2):
+            pending = pos < ends
+            if not pending.any():
+                break
+            pos[pending] += sizes[pos[pending]]
+        valid = pos == ends
+
+        kinds, starts, ends = kinds[valid], starts[valid], ends[valid]
+        # ROPgadget tries terminators by kind and address, and walks back
+        # from each of them
+        order = np.lexsort((-starts, ends, kinds))
+        return kinds[order], starts[order], ends[order]
+
+    def __disassemble(self, code, addr):
+        insns = list(self.__md.disasm_lite(code, addr))
+        if sum(size for _, size, _, _ in insns) != len(code):
+            return None
+        return insns
+
+    def __fill_cache(self, insn_cache, code, base, sizes, pos, last):
+        """Disassemble the instructions from halfword pos up to last into insn_cache.
+
+        Gadgets ending at the same terminator share their last instructions,
+        so these are disassembled in one go. Instructions following an IT
+        are left to be disassembled on their own, and so is an instruction
+        not decoded in the run (e.g. one that extends past last).
+        """
+        for insn in self.__md.disasm_lite(bytes(code[2 * pos:2 * last]), base + 2 * pos):
+            if insn[1] != 2 * sizes[pos]:
+                insn_cache[pos] = None
+                return
+            insn_cache[pos] = insn
+            pos += sizes[pos]
+            if insn[2].startswith('it') or pos in insn_cache:
+                break
+        if pos < last and pos not in insn_cache:
+            insn = next(self.__md.disasm_lite(bytes(code[2 * pos:2 * pos + 4]), base + 2 * pos, 1), None)
+            if insn is not None and insn[1] != 2 * sizes[pos]:
+                insn = None
+            insn_cache[pos] = insn
+
+    def search(self, start=None, end=None):
+        """Yield (address, instructions) of all gadgets in ROPgadget's search order.
+
+        If given, only code in [start, end) is searched.
+        """
+        for vaddr, data in self.__elf.executable_segments():
+            # Limit the search to the given range
+            lo = 0 if start is None else min(max(start - vaddr, 0), len(data))
+            hi = len(data) if end is None else max(min(end - vaddr, len(data)), lo)
+            if lo == hi:
+                continue
+            lo += (vaddr + lo) & 1
+            base = vaddr + lo
+            code = data[lo:hi]
+            hw = halfwords(code[:len(code) & ~1])
+
+            # Disassemble every instruction at most once; the cache is only
+            # bypassed for gadgets containing an IT block, since it changes
+            # how the instructions following it are decoded
+            insn_cache = {}
+            sizes = instruction_sizes(hw).tolist()
+            _, starts, ends = self.__candidates(hw)
+            starts, ends = starts.tolist(), ends.tolist()
+            # The starts of the gadgets ending at each terminator
+            terminator_starts = {}
+            for first, last in zip(starts, ends):
+                terminator_starts.setdefault(last, []).append(first)
+            for first, last in zip(starts, ends):
+                if last in terminator_starts:
+                    # Disassemble the farthest starts first, since the
+                    # instruction runs from the others mostly join them
+                    for pos in sorted(terminator_starts.pop(last)):
+                        if pos not in insn_cache:
+                            self.__fill_cache(insn_cache, code, base, sizes, pos, last)
+                insns = []
+                pos = first
+                while pos < last:
+                    if pos not in insn_cache:
+                        self.__fill_cache(insn_cache, code, base, sizes, pos, last)
+                    insn = insn_cache[pos]
+                    if insn is None:
+                        break
+                    insns.append(insn)
+                    pos += insn[1] // 2
+                if pos != last:
+                    continue
+                if any(mnemonic.startswith('it') for _, _, mnemonic, _ in insns[:-1]):
+                    insns = self.__disassemble(bytes(code[2 * first:2 * last]), base + 2 * first)
+                    if insns is None:
+                        continue
+                yield base + 2 * first, insns
+
+    def gadgets(self, start=None, end=None, unique=True):
+        """Return a list of (address, text) of all gadgets, sorted by text.
+
+        Like ROPgadget, only the first gadget found for each text is kept
+        unless unique is False.
+        """
+        return _sorted_gadgets(((addr, gadget_text(insns)) for addr, insns in self.search(start, end)), unique)
+
+    def gadgets_within(self, start, end, unique=True):
+        """Return the gadgets() of the whole binary and those of [start, end)
+        from a single search.
+        """
+        gadgets = []
+        within = []
+        for addr, insns in self.search():
+            gadget = (addr, gadget_text(insns))
+            gadgets.append(gadget)
+            if start <= addr and addr + sum(size for _, size, _, _ in insns) <= end:
+                within.append(gadget)
+        return _sorted_gadgets(gadgets, unique), _sorted_gadgets(within, unique)
+
+
+def _sorted_gadgets(gadgets, unique=True):
+    """Sort (address, text) gadgets in search order by text, keeping only the
+    first gadget of each text if unique."""
+    if unique:
+        seen = set()
+        first = []
+        for gadget in gadgets:
+            if gadget[1] not in seen:
+                seen.add(gadget[1])
+                first.append(gadget)
+        gadgets = first
+    return sorted(gadgets, key=lambda gadget: gadget[1])
+
+
+def _ropgadget_within(binary, start, end):
+    """Run ROPgadget once for the gadgets of a binary and those of [start, end)."""
+    gadgets = []
+    within = []
+    # With --all, ROPgadget lists all gadgets found, stably sorted by text;
+    # --dump appends their bytes
+    for addr, text in run_ropgadget(binary, options=['--all', '--dump']):
+        text, _, dump = text.rpartition(' // ')
+        gadgets.append((addr, text))
+        if start <= addr and addr + len(dump) // 2 <= end:
+            within.append((addr, text))
+    return _sorted_gadgets(gadgets), _sorted_gadgets(within)
+
+
+def _cache_name(engine, depth, text_range=None):
+    name = 'gadgets-native-{:d}'.format(depth) if engine == 'native' else 'gadgets-ropgadget'
+    if text_range is not None:
+        name += '-{:x}-{:x}'.format(*text_range)
+    return name
+
+
+def find_gadgets(binary, engine='native', text_range=None, depth=DEPTH, cache=None):
+    """Return an iterable of the (address, text) gadgets of a binary, found
+    in-process (native) or by ROPgadget, or loaded from a GadgetCache if given.
+
+    If given, only gadgets within the (start, end) address range text_range
+    are found.
+    """
+    def compute():
+        if engine == 'native':
+            return GadgetFinder(binary, depth).gadgets(*(text_range or (None, None)))
+        return run_ropgadget(binary, text_range)
+
+    if cache is None:
+        return compute()
+    return cache.gadgets(_cache_name(engine, depth, text_range), compute)
+
+
+def find_gadgets_within(binary, text_range, engine='native', depth=DEPTH, cache=None):
+    """Return the lists of the (address, text) gadgets of a binary and of
+    those within the (start, end) address range text_range, like
+    find_gadgets() without and with the range, but searching the binary only
+    once.
+    """
+    found = []
+
+    def compute():
+        if not found:
+            if engine == 'native':
+                found.extend(GadgetFinder(binary, depth).gadgets_within(*text_range))
+            else:
+                found.extend(_ropgadget_within(binary, *text_range))
+        return found
+
+    if cache is None:
+        return tuple(compute())
+    return (cache.gadgets(_cache_name(engine, depth), lambda: compute()[0]),
+            cache.gadgets(_cache_name(engine, depth, text_range), lambda: compute()[1]))
+
+
+def gadget_text(insns):
+    """Format disassembled instructions like ROPgadget does."""
+    return ' ; '.join('{}{}{}'.format(mnemonic, ' ' if op_str else '', op_str)
+                      for _, _, mnemonic, op_str in insns).replace('  ', ' ')
+
+
+def format_gadget(addr, text):
+    return '0x{:08x} : {:s}'.format(addr, text)
+
+
+def parse_range(text):
+    start, end = text.split('-')
+    return int(start, 16), int(end, 16)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Produce a list of Kage-reachable Thumb gadgets of an ELF file')
+    parser.add_argument('-f', dest='binary', required=True,
+                        help='path to the binary executable')
+    parser.add_argument('-a', dest='all', action='store_true',
+                        help='emit all gadgets, even those unreachable in Kage')
+    parser.add_argument('-r', dest='range', type=parse_range,
+                        help='emit gadgets within an address range 0x...-0x...')
+    parser.add_argument('-s', dest='secure_api',
+                        help='file containing newline separated names of reachable secure API functions')
+    parser.add_argument('--depth', type=int, default=DEPTH,
+                        help='search depth in halfwords (default: {:d})'.format(DEPTH))
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_GADGET_CACHE,
+                        help='reuse the gadgets and symbols of identical binaries from a cache directory '
+                             '(default: {:s})'.format(DEFAULT_GADGET_CACHE))
+    args = parser.parse_args()
+
+    secure_apis = read_secure_apis(args.secure_api) if args.secure_api else set()
+
+    cache = GadgetCache(args.binary, args.cache) if args.cache else None
+    gadgets = find_gadgets(args.binary, 'native', args.range, args.depth, cache)
+    if not args.all:
+        reachable = KageReachability(args.binary, secure_apis, cache)
+        gadgets = filter_reachable(gadgets, reachable)
+
+    for addr, text in gadgets:
+        sys.stdout.write(format_gadget(addr, text) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""Directed graph of gadget chains with reachability queries.
+
+Nodes are the gadgets of a binary. Control leaves a gadget at its first
+unconditional transfer (which need not be its last instruction), and an edge
+leads from a gadget to every gadget starting where control may continue:
+
+- static branches (b, b.w, cbz, ...) to their target,
+- calls (bl, blx #imm) to their target,
+- fallthroughs to the end of the gadget, if none of its instructions always
+  transfers control (e.g. if its terminator is the second half of its last
+  instruction),
+- stitch points: gadgets with an indirect transfer (bx, pop {pc}, ...) may
+  continue at any reachable entry point. These edges all go through a
+  single virtual stitch node, which traversals pass without taking a hop.
+
+The graph is stored in compressed sparse row form, so queries run as
+vectorized frontier expansions over NumPy arrays.
+"""
+
+import argparse
+import re
+
+import numpy as np
+
+from .gadget_finder import DEPTH, GadgetFinder, gadget_text
+from .gadget_model import CONDITIONS, count_privileged_stores
+from .reachability import KageReachability, read_secure_apis
+
+# Edge kinds
+BRANCH = 0
+CALL = 1
+FALLTHROUGH = 2
+STITCH = 3
+EDGE_KINDS = ['branch', 'call', 'fallthrough', 'stitch']
+
+# Direct branches, optionally conditional
+DIRECT_BRANCH = re.compile(r'(?:b|cbn?z)({:s})?(?:\.[nw])?$'.format(CONDITIONS))
+# Calls to an immediate target
+DIRECT_CALL = re.compile(r'blx?({:s})?$'.format(CONDITIONS))
+# Branches to a register
+INDIRECT_BRANCH = re.compile(r'bl?x({:s})?$'.format(CONDITIONS))
+# Instructions writing to pc (pop {..., pc}, ldm ..., {..., pc}, ldr pc, ...)
+PC_WRITE = re.compile(r'(?:^pc,|[{ ]pc[,}])')
+CONDITIONAL = re.compile(r'.+({:s})(?:\.[nw])?$'.format(CONDITIONS))
+
+
+def transfer(mnemonic, op_str):
+    """Classify how an instruction of a gadget transfers control.
+
+    Returns (edge kind or None, static target or None, falls through).
+    """
+    if DIRECT_BRANCH.match(mnemonic) and '#' in op_str:
+        target = int(op_str.rsplit('#', 1)[1], 16)
+        conditional = bool(DIRECT_BRANCH.match(mnemonic).group(1)) or mnemonic.startswith('cb')
+        return BRANCH, target, conditional
+    if DIRECT_CALL.match(mnemonic) and op_str.startswith('#'):
+        return CALL, int(op_str[1:], 16), True
+    if INDIRECT_BRANCH.match(mnemonic) or PC_WRITE.search(op_str):
+        # Indirect calls return to the next instruction, and conditional
+        # indirect transfers may not be taken
+        return STITCH, None, mnemonic.startswith('blx') or bool(CONDITIONAL.match(mnemonic))
+    return None, None, True
+
+
+def _expand(starts, counts):
+    """Concatenate the index ranges [start, start + count)."""
+    total = counts.sum()
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+
+class GadgetGraph(object):
+    def __init__(self, addrs, ends, texts, insns, entries):
+        """Build the graph of gadgets given in ascending order of address.
+
+        insns holds the list of (mnemonic, op_str) of the instructions of
+        each gadget, and entries is a boolean array of the gadgets that are
+        reachable entry points.
+        """
+        self.addrs = np.asarray(addrs, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.texts = texts
+        self.entries = np.asarray(entries, dtype=bool)
+        self.stores = np.array([count_privileged_stores(text) for text in texts], dtype=np.int32)
+        n = len(self.addrs)
+        # The virtual stitch node comes after all gadgets
+        self.stitch = n
+        self.size = n + 1
+
+        sources = []
+        targets = []
+        kinds = []
+        stitchers = []
+        for i, gadget in enumerate(insns):
+            for mnemonic, op_str in gadget:
+                kind, target, falls_through = transfer(mnemonic, op_str)
+                if kind == STITCH:
+                    if not stitchers or stitchers[-1] != i:
+                        stitchers.append(i)
+                elif kind is not None:
+                    sources.append(i)
+                    targets.append(target)
+                    kinds.append(kind)
+                if not falls_through:
+                    break
+            else:
+                sources.append(i)
+                targets.append(self.ends[i])
+                kinds.append(FALLTHROUGH)
+
+        # Resolve target addresses to all gadgets starting there
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        kinds = np.array(kinds, dtype=np.int8)
+        lo = np.searchsorted(self.addrs, targets, side='left')
+        hi = np.searchsorted(self.addrs, targets, side='right')
+        counts = hi - lo
+        edge_sources = np.repeat(sources, counts)
+        edge_targets = _expand(lo, counts)
+        edge_kinds = np.repeat(kinds, counts)
+
+        # Stitch edges into and out of the stitch node
+        stitchers = np.array(stitchers, dtype=np.int64)
+        entry_nodes = np.flatnonzero(self.entries)
+        edge_sources = np.concatenate((edge_sources, stitchers, np.full(len(entry_nodes), self.stitch)))
+        edge_targets = np.concatenate((edge_targets, np.full(len(stitchers), self.stitch), entry_nodes))
+        edge_kinds = np.concatenate((edge_kinds, np.full(len(stitchers) + len(entry_nodes), STITCH, dtype=np.int8)))
+
+        order = np.argsort(edge_sources, kind='stable')
+        self.indices = edge_targets[order].astype(np.int32)
+        self.kinds = edge_kinds[order]
+        self.indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edge_sources, minlength=self.size), out=self.indptr[1:])
+
+    @classmethod
+    def from_binary(cls, binary, secure_apis=(), kage=True, depth=DEPTH):
+        """Build the graph of all gadgets of a binary.
+
+        In Kage mode, only Kage-reachable gadgets are entry points, otherwise
+        every gadget is.
+        """
+        gadgets = []
+        seen = set()
+        for addr, insns in GadgetFinder(binary, depth).search():
+            last_addr, last_size, _, _ = insns[-1]
+            # Gadgets of different terminators may coincide
+            if (addr, last_addr + last_size) in seen:
+                continue
+            seen.add((addr, last_addr + last_size))
+            gadgets.append((addr, last_addr + last_size, gadget_text(insns),
+                            [insn[2:] for insn in insns]))
+        gadgets.sort(key=lambda gadget: gadget[:2])
+
+        addrs = [gadget[0] for gadget in gadgets]
+        if kage:
+            reachable = KageReachability(binary, secure_apis)
+            entries = [addr in reachable for addr in addrs]
+        else:
+            entries = [True] * len(addrs)
+        return cls(addrs, [gadget[1] for gadget in gadgets], [gadget[2] for gadget in gadgets],
+                   [gadget[3] for gadget in gadgets], entries)
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def successors(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def __expand(self, frontier):
+        """Return (successors, predecessors) of all edges leaving the frontier."""
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        return self.indices[_expand(starts, counts)], np.repeat(frontier, counts)
+
+    def bfs(self, sources, max_hops=None):
+        """Breadth-first search from the source gadgets.
+
+        Returns (hops, parents): the number of hops to each node (-1 if it is
+        not reached within max_hops) and its predecessor on a shortest chain.
+        Passing the stitch node takes no hop.
+        """
+        hops = np.full(self.size, -1, dtype=np.int32)
+        parents = np.full(self.size, -1, dtype=np.int32)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        hops[frontier] = 0
+        level = 0
+        while len(frontier) and (max_hops is None or level < max_hops):
+            nodes, preds = self.__expand(frontier)
+            if hops[self.stitch] < 0 and (nodes == self.stitch).any():
+                hops[self.stitch] = level
+                parents[self.stitch] = preds[np.argmax(nodes == self.stitch)]
+                entries = self.successors(self.stitch)
+                nodes = np.concatenate((nodes, entries))
+                preds = np.concatenate((preds, np.full(len(entries), self.stitch)))
+            new = hops[nodes] < 0
+            # Keep the first predecessor found for each new node
+            nodes, first = np.unique(nodes[new], return_index=True)
+            level += 1
+            hops[nodes] = level
+            parents[nodes] = preds[new][first]
+            frontier = nodes.astype(np.int64)
+        return hops, parents
+
+    def dfs(self, source, max_hops=None):
+        """Yield (node, hops) of all nodes reachable from source in depth-first order."""
+        visited = np.zeros(self.size, dtype=bool)
+        stack = [(source, 0)]
+        while stack:
+            node, level = stack.pop()
+            if visited[node]:
+                continue
+            visited[node] = True
+            yield node, level
+            if max_hops is not None and level >= max_hops:
+                continue
+            for succ in reversed(self.successors(node).tolist()):
+                if not visited[succ]:
+                    # The stitch node is passed without taking a hop
+                    stack.append((succ, level if succ == self.stitch else level + 1))
+
+    def chain(self, parents, node):
+        """Follow BFS parents back from node to the gadget chain leading to it."""
+        chain = []
+        while node >= 0:
+            if node != self.stitch:
+                chain.append(node)
+            node = parents[node]
+        chain.reverse()
+        return chain
+
+    def reachable(self, max_hops=None):
+        """Gadgets reachable from the entry points in at most max_hops hops."""
+        hops, _ = self.bfs(np.flatnonzero(self.entries), max_hops)
+        return np.flatnonzero(hops[:self.stitch] >= 0)
+
+    def store_chains(self, max_hops=None):
+        """Yield the shortest chain from an entry point to each privileged store gadget."""
+        hops, parents = self.bfs(np.flatnonzero(self.entries), max_hops)
+        for node in np.flatnonzero((hops[:self.stitch] >= 0) & (self.stores > 0)).tolist():
+            yield self.chain(parents, node)
+
+    def edge_counts(self):
+        """Number of edges of each kind."""
+        return np.bincount(self.kinds, minlength=len(EDGE_KINDS))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the gadget chain graph of an ELF file and report chain-level metrics')
+    parser.add_argument('-f', dest='binary', required=True,
+                        help='path to the binary executable')
+    parser.add_argument('--mode', choices=['kage', 'freertos'], default='kage',
+                        help='entry points are Kage-reachable gadgets (kage) or all gadgets (freertos)')
+    parser.add_argument('-s', dest='secure_api',
+                        help='file containing newline separated names of reachable secure API functions')
+    parser.add_argument('--hops', type=int,
+                        help='maximum number of hops from an entry point (default: unlimited)')
+    parser.add_argument('--chains', action='store_true',
+                        help='print the shortest chain reaching each privileged store')
+    parser.add_argument('--depth', type=int, default=DEPTH,
+                        help='gadget search depth in halfwords (default: {:d})'.format(DEPTH))
+    args = parser.parse_args()
+
+    secure_apis = read_secure_apis(args.secure_api) if args.secure_api else set()
+    graph = GadgetGraph.from_binary(args.binary, secure_apis, args.mode == 'kage', args.depth)
+
+    print('Gadgets: ', len(graph))
+    for kind, count in zip(EDGE_KINDS, graph.edge_counts().tolist()):
+        print('Edges ({:s}): '.format(kind), count)
+    print('Entry gadgets: ', int(graph.entries.sum()))
+    reachable = graph.reachable(args.hops)
+    print('Reachable gadgets: ', len(reachable))
+    print('Reachable gadgets with privileged stores: ', int((graph.stores[reachable] > 0).sum()))
+
+    if args.chains:
+        for chain in graph.store_chains(args.hops):
+            print(' -> '.join('0x{:08x}'.format(graph.addrs[node]) for node in chain))
+            for node in chain:
+                print('    0x{:08x} : {:s}'.format(graph.addrs[node], graph.texts[node]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Parsed gadget instructions and classification of the stores they make.
+
+Gadgets are handled as text in ROPgadget's format ("str r0, [r1, #4] ; bx lr").
+Their instructions are parsed into Instruction records once per distinct
+instruction text, and StoreCounter tallies the stores of gadgets in a single
+pass as the gadgets stream in: by kind, by the region they may write, and by
+the function the gadget is part of.
+
+A store is privileged unless it is an unprivileged STRT/STRBT/STRHT, whose
+accesses the MPU checks as if made by untrusted code. Privileged stores
+relative to sp write the stack (Kage's shadow stack lies at a fixed distance
+from it); those through any other base register may write arbitrary memory,
+including the kernel's data and the shadow stack.
+"""
+
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+CONDITIONS = 'eq|ne|cs|hs|cc|lo|mi|pl|vs|vc|hi|ls|ge|lt|gt|le|al'
+
+# Store mnemonics with an optional condition (e.g. strlt inside an IT block)
+STORE_MNEMONIC = re.compile(r'(push|stm(?:ia|ea|db|fd)?|str(?:ex)?[bhd]?|str[bh]?t)({:s})?$'.format(CONDITIONS))
+
+# condition is only split off the mnemonics of stores. base is the base
+# register of a memory access, writeback whether it is updated, and
+# registers the registers transferred (for a store: the stored ones).
+Instruction = namedtuple('Instruction', ['mnemonic', 'condition', 'base', 'writeback', 'registers'])
+
+STORE_KINDS = ('single', 'dual', 'exclusive', 'multiple', 'push')
+STORE_TARGETS = ('stack', 'arbitrary')
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_instruction(text):
+    """Parse the text of an instruction into an Instruction."""
+    mnemonic, _, operands = text.strip().partition(' ')
+    mnemonic = mnemonic.split('.')[0]
+    condition = None
+    match = STORE_MNEMONIC.match(mnemonic)
+    if match:
+        mnemonic, condition = match.groups()
+
+    base = None
+    writeback = False
+    registers = ()
+    if '{' in operands:
+        # push {...}, stm rn{!}, {...} and the like
+        head, _, tail = operands.partition('{')
+        registers = tuple(register.strip() for register in tail.rstrip('}').split(','))
+        if mnemonic in ('push', 'pop'):
+            base, writeback = 'sp', True
+        elif head.strip():
+            base = head.strip().rstrip(',').strip()
+            writeback = base.endswith('!')
+            base = base.rstrip('!')
+    elif '[' in operands:
+        # Loads and stores: rt{, rt2}, [rn{, offset}]{!}{, offset}
+        head, _, tail = operands.partition('[')
+        address, _, post = tail.partition(']')
+        registers = tuple(register.strip() for register in head.split(',') if register.strip())
+        if mnemonic.startswith('strex'):
+            # The first register receives the status
+            registers = registers[1:]
+        base = address.split(',')[0].strip()
+        writeback = post.startswith('!') or bool(post.strip(' ,'))
+    return Instruction(mnemonic, condition, base, writeback, registers)
+
+
+def store_kind(insn):
+    """Return the kind of store an Instruction is (one of STORE_KINDS, or
+    'unprivileged'), or None if it is not a store."""
+    mnemonic = insn.mnemonic
+    if mnemonic == 'push':
+        return 'push'
+    if mnemonic.startswith('stm'):
+        return 'multiple'
+    if not mnemonic.startswith('str'):
+        return None
+    if mnemonic in ('strt', 'strbt', 'strht'):
+        return 'unprivileged'
+    if mnemonic.startswith('strex'):
+        return 'dual' if mnemonic == 'strexd' else 'exclusive'
+    return 'dual' if mnemonic == 'strd' else 'single'
+
+
+def store_target(insn):
+    """Return the region a store may write (one of STORE_TARGETS)."""
+    return 'stack' if insn.base == 'sp' else 'arbitrary'
+
+
+def gadget_stores(text):
+    """Yield the (kind, target) of every store of a gadget given as text."""
+    for part in text.split(' ; '):
+        # Only parse what may be a store
+        if not (part.startswith('st') or part.startswith('push')):
+            continue
+        insn = parse_instruction(part)
+        kind = store_kind(insn)
+        if kind is not None:
+            yield kind, store_target(insn)
+
+
+def count_privileged_stores(text):
+    return sum(1 for kind, _ in gadget_stores(text) if kind != 'unprivileged')
+
+
+class StoreCounter(object):
+    """Counts of the stores of gadgets, updated one gadget at a time.
+
+    If given, symbols is the SymbolIndex used to attribute gadgets to
+    functions.
+    """
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+        self.kinds = Counter()
+        self.targets = Counter()
+        self.functions = Counter()
+        self.unprivileged = 0
+        self.gadgets = 0
+
+    def add(self, addr, text):
+        """Count the stores of the gadget at addr; returns the number of its
+        privileged stores."""
+        count = 0
+        for kind, target in gadget_stores(text):
+            if kind == 'unprivileged':
+                self.unprivileged += 1
+                continue
+            self.kinds[kind] += 1
+            self.targets[target] += 1
+            count += 1
+        if count:
+            self.gadgets += 1
+            if self.symbols is not None:
+                func = self.symbols.lookup(addr)
+                self.functions[self.symbols.name(func) if func >= 0 else '<unknown>'] += count
+        return count
+
+    def total(self):
+        return sum(self.kinds.values())
+
+    def as_dict(self):
+        return {'total': self.total(), 'gadgets': self.gadgets, 'unprivileged': self.unprivileged,
+                'kinds': dict(self.kinds), 'targets': dict(self.targets),
+                'functions': dict(self.functions.most_common())}
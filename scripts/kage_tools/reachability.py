@@ -0,0 +1,78 @@
+"""Filtering of gadgets by their reachability under Kage.
+
+The function starts, post-call return sites and secure API entries of a
+binary are collected once into hash sets, so that each gadget is checked with
+exact address lookups. Gadgets are streamed through the filter as (address,
+text) pairs, e.g. parsed from the output of a running ROPgadget process.
+"""
+
+import subprocess
+
+from .gadget_cache import elf_functions, elf_return_sites, elf_sections
+
+
+class KageReachability(object):
+    """Kage's rules for gadgets reachable under its restricted control flow.
+
+    A gadget is reachable if it starts at a secure API entry, or if it is
+    outside the trusted region and starts at a function entry or at a
+    return site following a call.
+    """
+
+    def __init__(self, binary, secure_apis=(), cache=None):
+        """Collect the entry points of binary, using a GadgetCache if given."""
+        self.functions = set()
+        self.secure_apis = set()
+        for addr, _, name, _ in elf_functions(binary, cache):
+            self.functions.add(addr)
+            if name in secure_apis:
+                self.secure_apis.add(addr)
+
+        self.return_sites = set(elf_return_sites(binary, cache).tolist())
+
+        self.trusted = elf_sections(binary, cache).get('privileged_functions', (0, 0))
+
+    def __contains__(self, addr):
+        if addr in self.secure_apis:
+            return True
+        if self.trusted[0] <= addr < self.trusted[1]:
+            return False
+        return addr in self.functions or addr in self.return_sites
+
+
+def read_secure_apis(path):
+    """Read a file of newline separated secure API function names."""
+    with open(path) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def parse_gadgets(lines):
+    """Parse ROPgadget output lines into (address, text) pairs."""
+    for line in lines:
+        if not line.startswith('0x'):
+            continue
+        addr, _, text = line.rstrip('\n').partition(' : ')
+        yield int(addr, 16), text
+
+
+def run_ropgadget(binary, text_range=None, options=()):
+    """Run ROPgadget on a Thumb binary and yield its gadgets as they are printed.
+
+    If given, only gadgets within the (start, end) address range text_range
+    are found. Further command line options are passed on to ROPgadget. A
+    failing ROPgadget raises CalledProcessError.
+    """
+    command = ['ROPgadget', '--thumb', '--binary', binary] + list(options)
+    if text_range is not None:
+        command += ['--range', '0x{:x}-0x{:x}'.format(*text_range)]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True) as process:
+        yield from parse_gadgets(process.stdout)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def filter_reachable(gadgets, reachable):
+    """Yield the (address, text) gadgets whose address is in reachable."""
+    for gadget in gadgets:
+        if gadget[0] in reachable:
+            yield gadget
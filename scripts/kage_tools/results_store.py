@@ -0,0 +1,175 @@
+"""Persistent store of benchmark results, and detection of regressions.
+
+run-benchmarks.py records every run in an SQLite database: the revisions of
+Kage, of our compiler and of the benchmark workspace, the board cache mode,
+and every measurement with its samples and the board it was taken on.
+
+    python -m kage_tools.results_store runs
+    python -m kage_tools.results_store compare <baseline> [<run>]
+
+compares a run (by default the latest) against a baseline run, given by its
+number or by a prefix of its Kage or compiler revision, and exits with
+status 1 if any result regressed.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from .benchmark_report import HIGHER_IS_BETTER, MetricKey
+from .benchmark_stats import Samples, significantly_different
+
+DEFAULT_RESULTS_DB = os.path.join(os.path.expanduser('~'), '.cache', 'kage', 'results.db')
+
+Run = namedtuple('Run', ['id', 'timestamp', 'revision', 'compiler_revision', 'workspace_revision',
+                         'cache_mode', 'boards'])
+Measurement = namedtuple('Measurement', ['board', 'samples'])
+Change = namedtuple('Change', ['key', 'unit', 'baseline', 'result', 'change', 'significant', 'regression'])
+
+
+def git_revision(path):
+    """Return the commit checked out at path (marked if modified), or None."""
+    try:
+        return subprocess.run(['git', '-C', str(path), 'describe', '--always', '--dirty', '--abbrev=40'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+                              universal_newlines=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ResultsStore(object):
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.__db = sqlite3.connect(path, timeout=60)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, timestamp TEXT, '
+                          'revision TEXT, compiler_revision TEXT, workspace_revision TEXT, '
+                          'cache_mode TEXT, boards TEXT)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS measurements (run INTEGER REFERENCES runs(id), '
+                          'program TEXT, config TEXT, variant TEXT, benchmark TEXT, metric TEXT, unit TEXT, '
+                          'board TEXT, samples TEXT)')
+        self.__db.execute('CREATE INDEX IF NOT EXISTS measurements_run ON measurements (run)')
+
+    def record_run(self, revisions, cache_mode, boards, rows):
+        """Record result rows of benchmark_report as a new run; returns its number.
+
+        revisions are the revisions of Kage, the compiler and the workspace.
+        """
+        with self.__db:
+            run = self.__db.execute('INSERT INTO runs VALUES (NULL, ?, ?, ?, ?, ?, ?)',
+                                    (datetime.now(timezone.utc).isoformat(timespec='seconds'), *revisions,
+                                     cache_mode, ' '.join(str(board) for board in boards))).lastrowid
+            self.__db.executemany('INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  [(run, *row[:len(MetricKey._fields)], row.board, json.dumps(row.samples))
+                                   for row in rows])
+        return run
+
+    def runs(self):
+        return [Run(*row) for row in self.__db.execute('SELECT * FROM runs ORDER BY id')]
+
+    def find_run(self, spec=None):
+        """Return the run numbered spec, or the latest run at the Kage or
+        compiler revision starting with spec, or the latest run if spec is
+        None. Returns None if there is no such run."""
+        if spec is None:
+            row = self.__db.execute('SELECT max(id) FROM runs').fetchone()
+        elif spec.isdigit():
+            row = self.__db.execute('SELECT id FROM runs WHERE id = ?', (int(spec),)).fetchone()
+        else:
+            row = self.__db.execute('SELECT max(id) FROM runs WHERE revision LIKE ?1 OR compiler_revision LIKE ?1',
+                                    (spec + '%',)).fetchone()
+        return None if row is None else row[0]
+
+    def measurements(self, run):
+        """Return the measurements of a run by MetricKey."""
+        return {MetricKey(*row[:-2]): Measurement(row[-2], Samples(json.loads(row[-1])))
+                for row in self.__db.execute('SELECT program, config, variant, benchmark, metric, unit, board, '
+                                             'samples FROM measurements WHERE run = ?', (run,))}
+
+    def close(self):
+        self.__db.close()
+
+
+def compare(baseline, result, threshold=0.01, size_threshold=0.):
+    """Compare the measurements of a run to those of a baseline run.
+
+    A result regressed if it got worse by more than threshold (a fraction of
+    the baseline; size_threshold for code sizes, which do not vary between
+    runs) and, if both runs have several samples of it, the change is
+    statistically significant (Welch's t-test at 95% confidence).
+    Returns the changes of all results measured in both runs.
+    """
+    changes = []
+    for key in sorted(baseline.keys() & result.keys()):
+        old = baseline[key].samples.summary()
+        new = result[key].samples.summary()
+        unit = key.unit
+        change = (new.median - old.median) / old.median if old.median else 0.
+        worse = -change if unit in HIGHER_IS_BETTER else change
+        significant = significantly_different(baseline[key].samples, result[key].samples)
+        limit = size_threshold if unit == 'bytes' else threshold
+        regression = worse > limit and significant is not False
+        changes.append(Change(key, unit, old.median, new.median, change, significant, regression))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect and compare recorded benchmark results')
+    parser.add_argument('--db', type=str, default=DEFAULT_RESULTS_DB,
+                        help='results database written by run-benchmarks.py (default: ' + DEFAULT_RESULTS_DB + ')')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('runs', help='list the recorded runs')
+    compareParser = commands.add_parser('compare', help='report regressions of a run against a baseline run')
+    compareParser.add_argument('baseline', help='number of the baseline run, or a prefix of its Kage or compiler '
+                                                'revision (the latest run at that revision is used)')
+    compareParser.add_argument('run', nargs='?', help='run to compare, like baseline (default: the latest run)')
+    compareParser.add_argument('--threshold', type=float, default=0.01,
+                               help='smallest relative change of a performance result reported as a regression '
+                                    '(default: 0.01)')
+    compareParser.add_argument('--size_threshold', type=float, default=0.,
+                               help='smallest relative change of a code size reported as a regression (default: 0)')
+    compareParser.add_argument('--all', action='store_true', help='print all changes, not only regressions')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.command == 'runs':
+        for run in store.runs():
+            print('{:5d}  {:s}  kage {:s}  compiler {:s}  cache {:s}  boards {:s}'.format(
+                run.id, run.timestamp, (run.revision or '-')[:12], (run.compiler_revision or '-')[:12],
+                run.cache_mode, run.boards))
+        store.close()
+        return
+
+    runs = []
+    for spec in (args.baseline, args.run):
+        run = store.find_run(spec)
+        if run is None:
+            print('Error: no run matches {:s}'.format(spec or 'latest'), file=sys.stderr)
+            exit(2)
+        runs.append(run)
+    changes = compare(store.measurements(runs[0]), store.measurements(runs[1]), args.threshold,
+                      args.size_threshold)
+    store.close()
+
+    regressions = [change for change in changes if change.regression]
+    print('Run {:d} against baseline run {:d}: {:d} results compared, {:d} regressions'.format(
+        runs[1], runs[0], len(changes), len(regressions)))
+    for change in changes if args.all else regressions:
+        significance = {True: '', False: ' (not significant)', None: ' (single samples)'}[change.significant]
+        print('{:s}{:s} {:s}  {:g} -> {:g} {:s} ({:+.2%}){:s}'.format(
+            'REGRESSION ' if change.regression else '', change.key.program,
+            ' '.join((change.key.variant, change.key.benchmark, change.key.metric)).ljust(60),
+            change.baseline, change.result, change.unit, change.change, significance))
+    exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
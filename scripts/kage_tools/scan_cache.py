@@ -0,0 +1,68 @@
+"""On-disk cache of code scanner results, keyed by content hash.
+
+The scanner splits each section at function starts and decodes every piece
+independently. Decoded findings are stored position-independently (relative
+to the start of the piece) under the SHA-256 of the scanner configuration,
+the alignment of the piece and its bytes, so they stay valid when a function
+moves and are shared between binaries that contain the same function. The
+alignment (the address modulo 4) is part of the key because it determines
+which bytes a PC-relative literal load reads.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'kage', 'code-scanner.db')
+
+# Bump when the format of cached findings changes
+CACHE_VERSION = 4
+
+
+class ScanCache(object):
+    def __init__(self, path, config):
+        """Open (or create) the cache database at path.
+
+        config is a JSON-serializable description of every scanner setting
+        that influences the findings.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Several scanner processes may share the database, and the threads
+        # of the daemon this connection, one at a time
+        self.__db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__db.execute('CREATE TABLE IF NOT EXISTS findings (key TEXT PRIMARY KEY, findings TEXT)')
+        self.__config = json.dumps([CACHE_VERSION, config], sort_keys=True).encode()
+
+    def key(self, data, alignment):
+        """Key the findings of the bytes data starting at an address with
+        the given remainder modulo 4."""
+        digest = hashlib.sha256(self.__config)
+        digest.update(bytes([alignment & 3]))
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """Return a dict of the cached findings of all keys found in the cache."""
+        found = {}
+        unique = list(set(keys))
+        # Stay below SQLite's limit on the number of host parameters
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            query = 'SELECT key, findings FROM findings WHERE key IN ({:s})'.format(','.join('?' * len(batch)))
+            for key, findings in self.__db.execute(query, batch):
+                found[key] = [tuple(finding) for finding in json.loads(findings)]
+        return found
+
+    def put(self, key, findings):
+        self.__db.execute('INSERT OR REPLACE INTO findings VALUES (?, ?)', (key, json.dumps(findings)))
+
+    def commit(self):
+        self.__db.commit()
+
+    def close(self):
+        self.__db.commit()
+        self.__db.close()
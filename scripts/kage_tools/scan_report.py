@@ -0,0 +1,143 @@
+"""Violation records of the code scanner and their output formats.
+
+CodeScanner yields a Violation for every offending instruction as it is
+found. The records can be written as text (the "[CS] ..." lines the scanner
+always printed), as JSON lines (one object per violation) or as a SARIF log,
+and tallied into a summary of violations per class and per function.
+"""
+
+import json
+from collections import Counter, namedtuple
+from itertools import groupby
+
+# kind is the class of a violation (a key of CLASSES), instruction the
+# offending instruction and target its decoded operand: the special
+# register, SVC number, called function or stored-to address.
+Violation = namedtuple('Violation', ['binary', 'section', 'address', 'function', 'kind', 'instruction',
+                                     'target', 'message'])
+
+CLASSES = {
+    'CPS': 'Change of the interrupt mask (CPS) in untrusted code',
+    'MSR': 'Write to a protected special register (MSR) in untrusted code',
+    'SVC': 'Supervisor call outside the system call stubs',
+    'BRANCH': 'Direct call or tail call into a trusted function other than a secure API',
+    'INDIRECT': 'Indirect call or jump to a trusted function other than a secure API',
+    'SCS_STORE': 'Store into the System Control Space (including the MPU)',
+}
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+
+
+def format_text(violation):
+    return '[CS] ' + violation.message
+
+
+def format_json(violation):
+    return json.dumps({field: value for field, value in violation._asdict().items() if field != 'message'})
+
+
+def print_reports(results):
+    """Print one text report per binary of a batch scan.
+
+    results are the (binary, violations, error) triples of stream_batch().
+    Yields them on, so they can be tallied as well.
+    """
+    for binary, group in groupby(results, key=lambda result: result[0]):
+        violations = []
+        errors = []
+        for result in group:
+            violations += result[1]
+            if result[2] is not None:
+                errors.append(result[2])
+            yield result
+        if errors:
+            status = 'ERROR: {:s}'.format(errors[0])
+        elif violations:
+            status = '{:d} violation(s)'.format(len(violations))
+        else:
+            status = 'OK'
+        print('[CS] {:s}: {:s}'.format(binary, status))
+        for violation in violations:
+            print('  ' + format_text(violation))
+
+
+class Summary(object):
+    """Counts of violations per class and per function, added one at a time."""
+
+    def __init__(self):
+        self.kinds = Counter()
+        self.functions = Counter()
+        self.binaries = Counter()
+        self.errors = 0
+
+    def add(self, violation):
+        self.kinds[violation.kind] += 1
+        self.functions[violation.function or '<unknown>'] += 1
+        self.binaries[violation.binary] += 1
+
+    def add_error(self):
+        self.errors += 1
+
+    def total(self):
+        return sum(self.kinds.values())
+
+    def as_dict(self):
+        return {'violations': self.total(), 'binaries': len(self.binaries), 'errors': self.errors,
+                'kinds': dict(self.kinds.most_common()), 'functions': dict(self.functions.most_common())}
+
+    def format(self, limit=20):
+        """Tabulate the counts per class and of the limit most offending functions."""
+        lines = ['[CS] {:d} violation(s) in {:d} binary(ies), {:d} error(s)'.format(
+            self.total(), len(self.binaries), self.errors)]
+        for kind, count in self.kinds.most_common():
+            lines.append('  {:12s} {:9d}'.format(kind, count))
+        if self.functions:
+            lines.append('  Most offending functions:')
+            for function, count in self.functions.most_common(limit):
+                lines.append('    {:40s} {:9d}'.format(function, count))
+        return '\n'.join(lines)
+
+
+class SarifWriter(object):
+    """Collect violations into a SARIF 2.1.0 log of a single run."""
+
+    def __init__(self):
+        self.results = []
+        self.notifications = []
+
+    def add(self, violation):
+        result = {
+            'ruleId': violation.kind,
+            'level': 'error',
+            'message': {'text': violation.message},
+            'locations': [{
+                'physicalLocation': {
+                    'artifactLocation': {'uri': violation.binary},
+                    'address': {'absoluteAddress': violation.address},
+                },
+            }],
+            'properties': {'section': violation.section, 'instruction': violation.instruction,
+                           'target': violation.target},
+        }
+        if violation.function is not None:
+            result['locations'][0]['logicalLocations'] = [{'name': violation.function, 'kind': 'function'}]
+        self.results.append(result)
+
+    def add_error(self, binary, error):
+        self.notifications.append({'level': 'error', 'message': {'text': error},
+                                   'locations': [{'physicalLocation': {'artifactLocation': {'uri': binary}}}]})
+
+    def write(self, file, summary=None):
+        run = {
+            'tool': {'driver': {
+                'name': 'Kage Code Scanner',
+                'rules': [{'id': kind, 'shortDescription': {'text': text}} for kind, text in CLASSES.items()],
+            }},
+            'invocations': [{'executionSuccessful': not self.notifications,
+                             'toolExecutionNotifications': self.notifications}],
+            'results': self.results,
+        }
+        if summary is not None:
+            run['properties'] = {'summary': summary.as_dict()}
+        json.dump({'$schema': SARIF_SCHEMA, 'version': '2.1.0', 'runs': [run]}, file, indent=2)
+        file.write('\n')
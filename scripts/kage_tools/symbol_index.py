@@ -0,0 +1,98 @@
+"""Array-backed index of symbol address intervals.
+
+Answers "which function contains address X" with a binary search over the
+sorted start addresses, either for one address or for a whole NumPy array
+of addresses at once.
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+
+
+class SymbolIndex(object):
+    def __init__(self, symbols):
+        """Build an index from (start, size, name, section) tuples.
+
+        A size of None or 0 lets the symbol extend up to the start of the
+        next symbol (or indefinitely for the last one). Of several symbols
+        with the same start address, the last one wins.
+        """
+        by_start = {}
+        for start, size, name, section in symbols:
+            by_start[start] = (size, name, section)
+        ordered = sorted(by_start.items())
+
+        self.names = [name for _, (_, name, _) in ordered]
+        self.section_names = []
+        section_ids = {}
+        sections = []
+        for _, (_, _, section) in ordered:
+            if section not in section_ids:
+                section_ids[section] = len(self.section_names)
+                self.section_names.append(section)
+            sections.append(section_ids[section])
+
+        self.starts = np.array([start for start, _ in ordered], dtype=np.int64)
+        self.sizes = np.array([size or 0 for _, (size, _, _) in ordered], dtype=np.int64)
+        self.sections = np.array(sections, dtype=np.int32)
+
+        # Unsized symbols extend up to the next symbol
+        unsized = self.sizes == 0
+        next_starts = np.append(self.starts[1:], np.iinfo(np.int64).max)
+        self.sizes[unsized] = next_starts[unsized] - self.starts[unsized]
+        self.ends = self.starts + self.sizes
+
+        self.__starts = self.starts.tolist()
+        self.__ends = self.ends.tolist()
+
+    @classmethod
+    def from_elf(cls, elf):
+        """Index the function symbols of a MappedELF."""
+        section_names = {}
+        symbols = []
+        for addr, size, name, shndx in elf.functions():
+            if shndx not in section_names:
+                section_names[shndx] = elf.section_name(shndx)
+            symbols.append((addr, size, name, section_names[shndx]))
+        return cls(symbols)
+
+    def __len__(self):
+        return len(self.__starts)
+
+    def lookup(self, addr):
+        """Index of the symbol containing addr, or -1."""
+        i = bisect_right(self.__starts, addr) - 1
+        if i >= 0 and addr < self.__ends[i]:
+            return i
+        return -1
+
+    def find(self, addr):
+        """Index of the symbol starting exactly at addr, or -1."""
+        i = bisect_right(self.__starts, addr) - 1
+        if i >= 0 and self.__starts[i] == addr:
+            return i
+        return -1
+
+    def lookup_many(self, addrs):
+        """Indices of the symbols containing each address of an array (-1 if none)."""
+        addrs = np.asarray(addrs, dtype=np.int64)
+        indices = np.searchsorted(self.starts, addrs, side='right') - 1
+        valid = indices >= 0
+        valid[valid] = addrs[valid] < self.ends[indices[valid]]
+        return np.where(valid, indices, -1)
+
+    def start(self, i):
+        return self.__starts[i]
+
+    def name(self, i):
+        return self.names[i]
+
+    def section(self, i):
+        return self.section_names[self.sections[i]]
+
+    def in_section(self, section):
+        """Start addresses of all symbols of a section, in increasing order."""
+        if section not in self.section_names:
+            return []
+        return self.starts[self.sections == self.section_names.index(section)].tolist()
@@ -0,0 +1,442 @@
+"""Vectorized Thumb/Thumb-2 decoding of whole code sections.
+
+Instead of walking a section one halfword at a time, the functions in this
+module view the section as a NumPy array of halfwords and locate instruction
+boundaries and encodings with array-wide mask/compare operations.
+"""
+
+import numpy as np
+
+# Halfwords at or above this value start a 32-bit Thumb-2 instruction
+# (top five bits 0b11101, 0b11110 or 0b11111)
+THUMB2_PREFIX = 0xe800
+
+# Our CFI label, which is skipped by the scanner
+CFI_LABEL = 0xf871f870
+
+CPS_OPCODE = 0xb660
+CPS_OPCODE_MASK = 0xffec
+
+MSR_OPCODE = 0xf3808000
+MSR_OPCODE_MASK = 0xfff0f300
+
+BL_OPCODE = 0xf000d000
+BL_OPCODE_MASK = 0xf800d000
+B_OPCODE = 0xf0009000
+B_OPCODE_MASK = 0xf800d000
+BLX_IMM_OPCODE = 0xf000c000
+BLX_IMM_OPCODE_MASK = 0xf800d000
+BLX_REG_OPCODE = 0x4780
+BLX_REG_OPCODE_MASK = 0xff87
+
+# System Control Space, which includes the MPU registers
+SCS_START = 0xe000e000
+SCS_END = 0xe000f000
+
+# Number of instructions after a literal load within which a store through,
+# or a BX/BLX to, the loaded register is attributed the literal value
+LITERAL_WINDOW = 8
+
+
+
+class TruncatedInstruction(ValueError):
+    """Code ends in the first halfword of a 32-bit instruction."""
+    pass
+
+
+# Instruction classes found by DecodedSection
+KINDS = ('CPS', 'SVC', 'BX', 'BLX', 'LDR_LIT', 'STORE', 'MSR', 'BL', 'B')
+CPS, SVC, BX, BLX, LDR_LIT, STORE, MSR, BL, B = range(1, len(KINDS) + 1)
+
+# Encodings of the instruction classes as (class, opcode, mask, register)
+# rows, where the first matching row wins. register is the (shift, mask) of
+# the register field: the destination of a literal load, the target of
+# BX/BLX and the base register of a store.
+NARROW_ENCODINGS = [
+    (CPS, CPS_OPCODE, CPS_OPCODE_MASK, None),
+    (SVC, 0xdf00, 0xff00, None),
+    (BX, 0x4700, 0xff87, (3, 0xf)),
+    (BLX, BLX_REG_OPCODE, BLX_REG_OPCODE_MASK, (3, 0xf)),
+    (LDR_LIT, 0x4800, 0xf800, (8, 0x7)),
+    (STORE, 0x5000, 0xfe00, (3, 0x7)),      # STR (register)
+    (STORE, 0x5200, 0xfe00, (3, 0x7)),      # STRH (register)
+    (STORE, 0x5400, 0xfe00, (3, 0x7)),      # STRB (register)
+    (STORE, 0x6000, 0xf800, (3, 0x7)),      # STR (immediate)
+    (STORE, 0x7000, 0xf800, (3, 0x7)),      # STRB (immediate)
+    (STORE, 0x8000, 0xf800, (3, 0x7)),      # STRH (immediate)
+    (STORE, 0xc000, 0xf800, (8, 0x7)),      # STM
+]
+WIDE_ENCODINGS = [
+    (MSR, MSR_OPCODE, MSR_OPCODE_MASK, None),
+    (BL, BL_OPCODE, BL_OPCODE_MASK, None),
+    (B, B_OPCODE, B_OPCODE_MASK, None),
+    (LDR_LIT, 0xf85f0000, 0xff7f0000, (12, 0xf)),
+    (STORE, 0xf8800000, 0xfff00000, (16, 0xf)),     # STRB.W (imm12)
+    (STORE, 0xf8a00000, 0xfff00000, (16, 0xf)),     # STRH.W (imm12)
+    (STORE, 0xf8c00000, 0xfff00000, (16, 0xf)),     # STR.W (imm12)
+    (STORE, 0xf8000800, 0xfff00800, (16, 0xf)),     # STRB (imm8)
+    (STORE, 0xf8200800, 0xfff00800, (16, 0xf)),     # STRH (imm8)
+    (STORE, 0xf8400800, 0xfff00800, (16, 0xf)),     # STR (imm8)
+    (STORE, 0xf8000000, 0xfff00fc0, (16, 0xf)),     # STRB.W (register)
+    (STORE, 0xf8200000, 0xfff00fc0, (16, 0xf)),     # STRH.W (register)
+    (STORE, 0xf8400000, 0xfff00fc0, (16, 0xf)),     # STR.W (register)
+    (STORE, 0xe8400000, 0xfe500000, (16, 0xf)),     # STRD, STREX
+    (STORE, 0xe8800000, 0xffd00000, (16, 0xf)),     # STM.W
+    (STORE, 0xe9000000, 0xffd00000, (16, 0xf)),     # STMDB
+]
+
+
+# Registers written by instructions, as bit masks of r0-r15. Calls write
+# the registers a callee may change (r0-r3, r12, lr). Instructions that do
+# not continue with the next one (unconditional branches, writes to pc) and
+# encodings whose destination is not decoded clobber all registers.
+CALL_WRITES = 0x500f
+CLOBBERS = 0xffff
+
+
+def _select_writes(codes, rows):
+    """Select the written registers of codes from (condition, writes) rows,
+    where the first matching row wins and codes matching none clobber all
+    registers. A write to pc clobbers all registers as well."""
+    conditions, choices = zip(*rows)
+    writes = np.select(conditions, [np.broadcast_to(np.uint32(choice), codes.shape) for choice in choices],
+                       np.uint32(CLOBBERS)).astype(np.uint32)
+    writes[(writes & 0x8000) != 0] = CLOBBERS
+    return writes
+
+
+def _narrow_writes():
+    """Return the registers written by every 16-bit instruction."""
+    codes = np.arange(1 << 16, dtype=np.uint32)
+
+    def match(opcode, mask):
+        return (codes & mask) == opcode
+
+    one = np.uint32(1)
+    rd0 = one << (codes & 0x7)
+    rd8 = one << ((codes >> 8) & 0x7)
+    # ADD and MOV of high registers: Rdn is D:Rdn
+    rdn = one << (((codes >> 4) & 0x8) | (codes & 0x7))
+    stores = match(0x5000, 0xfe00) | match(0x5200, 0xfe00) | match(0x5400, 0xfe00) | \
+        match(0x6000, 0xf800) | match(0x7000, 0xf800) | match(0x8000, 0xf800) | match(0x9000, 0xf800)
+    return _select_writes(codes, [
+        (match(0x0000, 0xe000), rd0),                               # shifts, ADD/SUB (register, imm3)
+        (match(0x2800, 0xf800), 0),                                 # CMP (imm8)
+        (match(0x2000, 0xe000), rd8),                               # MOV/ADD/SUB (imm8)
+        (match(0x4200, 0xffc0) | match(0x4280, 0xff80), 0),         # TST, CMP, CMN
+        (match(0x4000, 0xfc00), rd0),                               # data processing
+        (match(0x4500, 0xff00), 0),                                 # CMP (high registers)
+        (match(0x4400, 0xfd00), rdn),                               # ADD, MOV (high registers)
+        (match(0x4780, 0xff80), CALL_WRITES),                       # BLX
+        (match(0x4800, 0xf800), rd8),                               # LDR (literal)
+        (stores, 0),                                                # STR, STRH, STRB
+        (match(0x5000, 0xf000) | match(0x6000, 0xe000) | match(0x8800, 0xf800), rd0),  # loads
+        (match(0x9800, 0xf800) | match(0xa000, 0xf000), rd8),       # LDR (SP), ADR, ADD (SP)
+        (match(0xb000, 0xff00) | match(0xb400, 0xfe00), 1 << 13),   # ADD/SUB SP, PUSH
+        (match(0xb200, 0xff00) | match(0xba00, 0xff00), rd0),       # extends, REV
+        (match(0xbc00, 0xfe00), (codes & 0xff) | ((codes & 0x100) << 7) | (1 << 13)),  # POP
+        (match(0xb000, 0xf000), 0),                                 # CBZ, CPS, BKPT, IT, hints
+        (match(0xc000, 0xf800), rd8),                               # STM, with writeback
+        (match(0xc800, 0xf800), (codes & 0xff) | rd8),              # LDM
+        (match(0xdf00, 0xff00), CALL_WRITES),                       # SVC
+        (match(0xd000, 0xf000) & ~match(0xde00, 0xff00), 0),        # B<cond>
+    ])
+
+
+def wide_writes(words):
+    """Return the registers written by 32-bit instruction words."""
+    words = words.astype(np.uint32)
+
+    def match(opcode, mask):
+        return (words & np.uint32(mask)) == np.uint32(opcode)
+
+    def register(shift):
+        # A field of 15 means no destination (e.g. TST, CMP), or pc
+        field = (words >> shift) & 0xf
+        return np.where(field == 15, np.uint32(0), np.uint32(1) << field)
+
+    rt = np.uint32(1) << ((words >> 12) & 0xf)
+    rn = np.uint32(1) << ((words >> 16) & 0xf)
+    writeback = np.where(match(0x00200000, 0x00200000), rn, np.uint32(0))
+    # Loads and stores of a single register with an 8-bit offset may write
+    # back the base register
+    single_writeback = np.where(match(0x00000900, 0x00800900) & ~match(0x000f0000, 0x000f0000), rn, np.uint32(0))
+    loads = match(0xf8100000, 0xfe100000)
+    return _select_writes(words, [
+        (match(0xf000d000, 0xf800d000) | match(0xf000c000, 0xf800d000), CALL_WRITES),  # BL, BLX
+        (match(0xf0009000, 0xf800d000), CLOBBERS),                  # B.W
+        (match(0xf3e08000, 0xffe0d000), register(8)),               # MRS
+        (match(0xf0008000, 0xf8008000), 0),                         # B<cond>.W, MSR, hints, barriers
+        (match(0xf0000000, 0xf8008000), register(8)),               # data processing (immediate)
+        (match(0xe8800000, 0xffd00000) | match(0xe9000000, 0xffd00000), writeback),  # STM
+        (match(0xe8900000, 0xffd00000) | match(0xe9100000, 0xffd00000), (words & 0xffff) | writeback),  # LDM
+        (match(0xea000000, 0xfe000000), register(8)),               # data processing (shifted register)
+        (match(0xf8000000, 0xff100000), single_writeback),          # stores
+        (loads & match(0x0000f000, 0x0000f000) & ~match(0x00400000, 0x00600000), single_writeback),  # PLD, PLI
+        (loads, rt | single_writeback),                             # loads
+        (match(0xfa00f000, 0xff00f000) | match(0xfb000000, 0xff800000), register(8)),  # data processing, MUL
+        (match(0xfb800000, 0xff800000), register(8) | register(12)),  # long multiply, divide
+    ])
+
+
+def _compile_narrow(encodings):
+    """Compile 16-bit encodings into tables of the class (0 for none) and the
+    register field (-1 for none) of every halfword value."""
+    codes = np.arange(1 << 16, dtype=np.uint32)
+    classes = np.zeros(1 << 16, dtype=np.uint8)
+    registers = np.full(1 << 16, -1, dtype=np.int8)
+    for kind, opcode, mask, register in reversed(encodings):
+        match = (codes & mask) == opcode
+        classes[match] = kind
+        registers[match] = -1 if register is None else (codes[match] >> register[0]) & register[1]
+    return classes, registers
+
+
+def _compile_wide(encodings):
+    """Compile 32-bit encodings into a table of the set of encodings (as a
+    bit mask of their rows) every first halfword value may begin."""
+    codes = np.arange(1 << 16, dtype=np.uint32)
+    candidates = np.zeros(1 << 16, dtype=np.uint32)
+    for i, (_, opcode, mask, _) in enumerate(encodings):
+        candidates[(codes & (mask >> 16)) == opcode >> 16] |= np.uint32(1 << i)
+    return candidates
+
+
+NARROW_CLASSES, NARROW_REGISTERS = _compile_narrow(NARROW_ENCODINGS)
+WIDE_CANDIDATES = _compile_wide(WIDE_ENCODINGS)
+NARROW_WRITES = _narrow_writes()
+
+
+def halfwords(data):
+    """View a little-endian code buffer as halfwords without copying it."""
+    return np.frombuffer(data, dtype='<u2')
+
+
+def decode(hw):
+    """Split a halfword array into 16-bit and 32-bit instructions.
+
+    Returns a pair of index arrays: the halfword indices of all 16-bit
+    instructions and of the first halfword of all 32-bit instructions.
+    Raises TruncatedInstruction if the last 32-bit instruction is incomplete.
+    """
+    n = len(hw)
+    is_wide = hw >= THUMB2_PREFIX
+    # A run of consecutive Thumb-2 prefixes always begins on an instruction
+    # boundary; from there on every other halfword of the run is a prefix.
+    run_begin = is_wide.copy()
+    run_begin[1:] &= ~is_wide[:-1]
+    index = np.arange(n)
+    run_start = np.maximum.accumulate(np.where(run_begin, index, 0))
+    wide = is_wide & ((index - run_start) & 1 == 0)
+    if n and wide[-1]:
+        raise TruncatedInstruction('Truncated Thumb-2 instruction')
+
+    second = np.zeros(n, dtype=bool)
+    second[1:] = wide[:-1]
+    return np.flatnonzero(~(wide | second)), np.flatnonzero(wide)
+
+
+def instruction_boundary(hw, pos):
+    """Return the first instruction boundary at or after halfword index pos.
+
+    Only the run of Thumb-2 prefixes immediately before pos is inspected, so
+    a section can be split into independently decodable chunks cheaply.
+    """
+    run = pos
+    while run > 0 and hw[run - 1] >= THUMB2_PREFIX:
+        run -= 1
+    # The run starts on a boundary and every other halfword of it is a prefix,
+    # so pos is the second half of an instruction if the run length is odd
+    return pos + ((pos - run) & 1)
+
+
+def wide_words(hw, wide):
+    """Assemble the 32-bit words of the instructions starting at wide."""
+    return (hw[wide].astype(np.uint32) << 16) | hw[wide + 1]
+
+
+def instruction_sizes(hw):
+    """Size in halfwords of the instruction that would start at each halfword."""
+    return np.where(hw >= THUMB2_PREFIX, 2, 1)
+
+
+def return_sites(data, base):
+    """Addresses of the instructions following a call (BL, BLX) in a section."""
+    hw = halfwords(data)
+    narrow, wide = decode(hw)
+    words = wide_words(hw, wide)
+    call = (((words & BL_OPCODE_MASK) == BL_OPCODE) |
+            ((words & BLX_IMM_OPCODE_MASK) == BLX_IMM_OPCODE))
+    sites = np.concatenate((wide[call] + 2,
+                            narrow[(hw[narrow] & BLX_REG_OPCODE_MASK) == BLX_REG_OPCODE] + 1))
+    return base + 2 * sites.astype(np.int64)
+
+
+def classify_wide(words):
+    """Return the classes and register fields of 32-bit instruction words.
+
+    Only the encodings the first halfword of a word may begin are matched
+    against the whole word.
+    """
+    classes = np.zeros(len(words), dtype=np.uint8)
+    registers = np.full(len(words), -1, dtype=np.int8)
+    todo = np.flatnonzero(WIDE_CANDIDATES[words >> 16])
+    words = words[todo]
+    candidates = WIDE_CANDIDATES[words >> 16]
+    for i, (kind, opcode, mask, register) in enumerate(WIDE_ENCODINGS):
+        match = np.flatnonzero((candidates & np.uint32(1 << i)).astype(bool) & ((words & mask) == opcode))
+        if not len(match):
+            continue
+        candidates[match] = 0
+        classes[todo[match]] = kind
+        if register is not None:
+            registers[todo[match]] = (words[match] >> register[0]) & register[1]
+    return classes, registers
+
+
+def branch_targets(words, addrs):
+    """Compute the destinations of BL/B.W instructions at addrs."""
+    words = words.astype(np.int64)
+    imm11 = words & 0x7ff
+    imm10 = (words >> 16) & 0x3ff
+    j2 = (words >> 11) & 0x1
+    j1 = (words >> 13) & 0x1
+    s = (words >> 26) & 0x1
+
+    i1 = 1 - (j1 ^ s)
+    i2 = 1 - (j2 ^ s)
+    offset = (s << 24) | (i1 << 23) | (i2 << 22) | (imm10 << 12) | (imm11 << 1)
+    # Sign extend with sign bit 25
+    offset = (offset & ((1 << 24) - 1)) - (offset & (1 << 24))
+    return addrs + 4 + offset
+
+
+class DecodedSection(object):
+    """Instruction classes of one code section found in a single pass.
+
+    Registers loaded from a literal pool are followed for LITERAL_WINDOW
+    instructions of the same function, until they are written again, to
+    find stores into the SCS and BX/BLX to literal addresses.
+
+    Literals are read from pool, a (data, base) pair, which defaults to
+    the decoded data itself. functions is the sorted array of function
+    start addresses; by default, data is a single function.
+    """
+
+    def __init__(self, data, base, unaligned, pool=None, functions=None):
+        hw = halfwords(data)
+        narrow, wide = decode(hw)
+        words = wide_words(hw, wide)
+
+        # Skip our CFI label
+        keep = words != CFI_LABEL
+        wide = wide[keep]
+        words = words[keep]
+
+        narrow_classes = NARROW_CLASSES[hw[narrow]]
+        wide_classes, wide_registers = classify_wide(words)
+
+        # Scan for CPS and SVC, also in the second halfword of Thumb-2
+        # instructions if unaligned instructions are scanned as well
+        cps = narrow[narrow_classes == CPS]
+        svc = narrow[narrow_classes == SVC]
+        if unaligned:
+            inner = wide + 1
+            inner_classes = NARROW_CLASSES[hw[inner]]
+            cps = np.concatenate((cps, inner[inner_classes == CPS]))
+            svc = np.concatenate((svc, inner[inner_classes == SVC]))
+        self.cps = base + 2 * cps.astype(np.int64)
+        self.svc = base + 2 * svc.astype(np.int64)
+        self.svc_imm = hw[svc] & 0xff
+
+        addrs = base + 2 * wide.astype(np.int64)
+
+        # Scan for MSR
+        msr = wide_classes == MSR
+        self.msr = addrs[msr]
+        self.msr_sysm = words[msr] & 0xff
+
+        # Scan for BL (normal call) and B (tail call)
+        bl = wide_classes == BL
+        branch = bl | (wide_classes == B)
+        self.branch = addrs[branch]
+        self.branch_link = bl[branch]
+        self.branch_dest = branch_targets(words[branch], self.branch)
+
+        # Scan for stores and BX/BLX through registers loaded from literals,
+        # in instruction order
+        starts = np.zeros(len(hw), dtype=bool)
+        starts[narrow] = True
+        starts[wide] = True
+        insts = np.flatnonzero(starts)
+        classes = np.zeros(len(hw), dtype=np.uint8)
+        classes[narrow] = narrow_classes
+        classes[wide] = wide_classes
+        classes = classes[insts]
+        registers = np.full(len(hw), -1, dtype=np.int8)
+        registers[narrow] = NARROW_REGISTERS[hw[narrow]]
+        registers[wide] = wide_registers
+        registers = registers[insts]
+        inst_addrs = base + 2 * insts.astype(np.int64)
+        if functions is None:
+            owners = np.zeros(len(insts), dtype=np.int64)
+        else:
+            owners = np.searchsorted(functions, inst_addrs, side='right')
+        values = self.__literals(hw, insts, classes, inst_addrs, owners,
+                                 (data, base) if pool is None else pool, functions)
+        writes = np.zeros(len(hw), dtype=np.uint32)
+        writes[narrow] = NARROW_WRITES[hw[narrow]]
+        writes[wide] = wide_writes(words)
+        writes = writes[insts]
+
+        # Only instructions shortly after a literal load can use its value
+        index = np.arange(len(insts))
+        last_load = np.maximum.accumulate(np.where(classes == LDR_LIT, index, -LITERAL_WINDOW - 1))
+        last_load = np.concatenate(([-LITERAL_WINDOW - 1], last_load[:-1]))
+        users = np.flatnonzero(((classes == STORE) | (classes == BX) | (classes == BLX)) &
+                               (index - last_load <= LITERAL_WINDOW))
+        used = np.full(len(users), -1, dtype=np.int64)
+        pending = np.ones(len(users), dtype=bool)
+        user_registers = np.uint32(1) << registers[users].astype(np.uint32)
+        for distance in range(1, LITERAL_WINDOW + 1):
+            load = users - distance
+            pending &= load >= 0
+            load = np.where(pending, load, 0)
+            pending &= owners[load] == owners[users]
+            # The nearest literal load of the register defines its value,
+            # unless another instruction writes the register in between
+            found = pending & (classes[load] == LDR_LIT) & (registers[load] == registers[users])
+            used[found] = values[load[found]]
+            pending &= ~found & ((writes[load] & user_registers) == 0)
+
+        user_classes = classes[users]
+        scs = (user_classes == STORE) & (used >= SCS_START) & (used < SCS_END)
+        self.scs_store = inst_addrs[users[scs]]
+        self.scs_store_dest = used[scs]
+        indirect = (user_classes != STORE) & (used >= 0)
+        self.indirect = inst_addrs[users[indirect]]
+        self.indirect_link = user_classes[indirect] == BLX
+        self.indirect_dest = used[indirect] & ~1
+
+    @staticmethod
+    def __literals(hw, insts, classes, inst_addrs, owners, pool, functions):
+        """Return the value loaded by every literal load (-1 for others and
+        for literals outside the pool or the function of the load)."""
+        values = np.full(len(insts), -1, dtype=np.int64)
+        loads = np.flatnonzero(classes == LDR_LIT)
+        first = hw[insts[loads]].astype(np.int64)
+        wide = first >= THUMB2_PREFIX
+        second = hw[np.where(wide, insts[loads] + 1, insts[loads])].astype(np.int64)
+        # LDR (literal) T1 has a word offset; T2 a byte offset and an add bit
+        offset = np.where(wide, np.where(first & 0x80, 1, -1) * (second & 0xfff), (first & 0xff) << 2)
+        literal = ((inst_addrs[loads] + 4) & ~3) + offset
+
+        pool_data, pool_base = pool
+        pool_hw = halfwords(pool_data)
+        position = (literal - pool_base) // 2
+        valid = (literal >= pool_base) & (position + 1 < len(pool_hw)) & ((literal & 1) == 0)
+        if functions is not None:
+            valid &= np.searchsorted(functions, literal, side='right') == owners[loads]
+        position = position[valid]
+        values[loads[valid]] = pool_hw[position].astype(np.int64) | (pool_hw[position + 1].astype(np.int64) << 16)
+        return values
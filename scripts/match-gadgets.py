@@ -4,41 +4,62 @@ import argparse
 from pathlib import Path
 import subprocess
 
+import numpy as np
+
+from kage_tools.gadget_cache import DEFAULT_GADGET_CACHE, GadgetCache
+from kage_tools.gadget_finder import find_gadgets
+from kage_tools.symbol_index import SymbolIndex
+
 PROJECTS = {'baseline':'freertos_microbenchmarks_clang', 
                    'baseline_mpu':'freertos_mpu_microbenchmarks_clang',
                    'kage':'microbenchmarks'}
 DEVICE = 'demos/st/stm32l475_discovery/ac6'
 OCD_CMD = 'program $PATH$ reset exit'
 
-def findGadgetSource(gadgetList, objResult):
-    # Generate Objdump dataset
-    objLineList = objResult.split('\n')
+# Parse lines of objdump -d output into (address, size, function, section)
+# tuples of its function labels, as the lines arrive
+def parseObjdump(objLines):
     currentSection = ''
-    # int(addr):'section:function' 
-    funcTable = {}
-    # 'section:function' : count
-    result = {}
-    # Build funcTable
-    for line in objLineList:
+    for line in objLines:
         if 'Disassembly of' in line:
-            currentSection = line.split(' ')[-1].replace(':', '')
+            currentSection = line.rstrip('\n').split(' ')[-1].replace(':', '')
         elif '>:' in line:
             address = int(line.split(' ')[0], 16)
             function = line.split('<')[1].split('>')[0]
-            funcTable[address] = currentSection + ':' + function
-    # Query all the gadgets
-    for gadget in gadgetList:
-        prevFunc = ''
-        for addr in funcTable:
-            if gadget < addr:
-                # We found the function
-                if not prevFunc in result:
-                    result[prevFunc] = 1
-                else:
-                    result[prevFunc] += 1
-                break
-            else:
-                prevFunc = funcTable[addr]
+            yield (address, None, function, currentSection)
+
+# Run objdump on a binary and yield its function labels while it runs, so
+# its output is never held in memory as a whole. A failing objdump raises
+# CalledProcessError with its error output.
+def objdumpFunctions(binPath):
+    command = ['arm-none-eabi-objdump', '-d', binPath.as_posix()]
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True) as objProc:
+        yield from parseObjdump(objProc.stdout)
+        errors = objProc.stderr.read()
+    if objProc.returncode != 0:
+        raise subprocess.CalledProcessError(objProc.returncode, command,
+                                            stderr=errors)
+
+# Count the gadgets at the addresses of gadgetAddrs per function of
+# funcList; both may be iterators, e.g. over the output of running tools
+def findGadgetSource(gadgetAddrs, funcList):
+    # 'section:function' : count
+    result = {}
+    # Build an interval index of the functions
+    funcIndex = SymbolIndex(funcList)
+    # Query all the gadgets at once
+    funcs = funcIndex.lookup_many(np.fromiter(gadgetAddrs, dtype=np.int64))
+    # Count per function, in the order the functions are first seen
+    funcs, first, counts = np.unique(funcs, return_index=True, return_counts=True)
+    for i in np.argsort(first):
+        func = funcs[i]
+        if func < 0:
+            # Not inside any function
+            entry = ''
+        else:
+            entry = funcIndex.section(func) + ':' + funcIndex.name(func)
+        result[entry] = int(counts[i])
     return result
 
 # Main routine
@@ -47,6 +68,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     # Optional custom workspace path
     parser.add_argument('--bin', type=Path, required=True)
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_GADGET_CACHE,
+        help="Reuse the gadgets and functions of identical binaries from a "
+             "cache directory (default: " + DEFAULT_GADGET_CACHE + ")")
     # Get arguments
     args = parser.parse_args()
 
@@ -54,24 +78,27 @@ if __name__ == "__main__":
     if not args.bin.is_file():
         print('ERROR: Expect a binary file')
         exit()
-    # Run ROPgadget
-    ropProc = subprocess.run(['ROPgadget', '--thumb', '--bin',\
-        args.bin.as_posix()], capture_output=True)
-    ropResult = ropProc.stdout.decode()
+    cache = None
+    if args.cache:
+        cache = GadgetCache(args.bin.as_posix(), args.cache)
+
+    try:
+        # Run ROPgadget and objdump. Without a cache, their output is parsed
+        # while they run.
+        ropGadgetAddrs = (address for address, _ in
+                          find_gadgets(args.bin.as_posix(), 'ropgadget', cache=cache))
+        if cache is None:
+            funcList = objdumpFunctions(args.bin)
+        else:
+            funcList = cache.symbols('objdump-functions',
+                                     lambda: objdumpFunctions(args.bin))
 
-    # Run objdump
-    objProc = subprocess.run(['arm-none-eabi-objdump', '-d',\
-        args.bin.as_posix()], capture_output=True)
-    objResult = objProc.stdout.decode()
-    
-    # Process ROPgadget result
-    ropGadgetAddrList = []
-    ropGadgetList = ropResult.split('\n')
-    for gadget in ropGadgetList:
-        if ' : ' in gadget:
-            ropGadgetAddrList.append(int(gadget.split(' : ')[0], 16))
-    
-    # Find source of each gadget
-    result = findGadgetSource(ropGadgetAddrList, objResult)
+        # Find source of each gadget
+        result = findGadgetSource(ropGadgetAddrs, funcList)
+    except subprocess.CalledProcessError as e:
+        print('ERROR: {:s} failed with exit code {:d}'.format(e.cmd[0], e.returncode))
+        if e.stderr:
+            print(e.stderr, end='')
+        exit(1)
     for entry in result:
-        print(entry, ': ', result[entry])
\ No newline at end of file
+        print(entry, ': ', result[entry])
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import io
+import queue
 import subprocess
+import tempfile
+import threading
+from collections import Counter
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from os import path
 from pathlib import Path
-from time import sleep
+from time import monotonic, sleep
 
-import serial
 from colorama import Fore, Style
-from elftools.elf.elffile import ELFFile
+
+from kage_tools.benchmark_parsers import ResultParser
+from kage_tools.benchmark_report import ResultKey, geometric_means, overheads, result_rows, write_csv, write_json
+from kage_tools.benchmark_stats import Samples
+from kage_tools.boards import BenchmarkError, ReplayBoard, SerialBoard
+from kage_tools.code_size import analyze, format_growth, growth
+from kage_tools.build_cache import DEFAULT_BUILD_CACHE, BuildCache, fingerprint_toolchain, hash_file, hash_sources
+from kage_tools.results_store import DEFAULT_RESULTS_DB, ResultsStore, git_revision
 
 PROJECTS = {'microbenchmark': {'baseline': 'freertos_microbenchmarks_clang',
                                'baseline_mpu': 'freertos_mpu_microbenchmarks_clang',
@@ -22,10 +36,18 @@ CONFIG_TERMS = {'mpu': 'FreeRTOS with MPU enabled',
                 'kage-os-only': 'Kage\'s OS mechanisms',
                 'kage': 'Kage', }
 DEVICE = 'demos/st/stm32l475_discovery/ac6'
-OCD_CMD = 'program $PATH$ reset exit'
+# Our LLVM toolchain and runtime libraries, as installed by the build scripts
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TOOLCHAIN = [ROOT_DIR.joinpath('build/llvm/bin'),
+             ROOT_DIR.joinpath('build/newlib-cygwin/install'),
+             ROOT_DIR.joinpath('build/compiler-rt/install')]
+PORT = '/dev/ttyACM0'
+OCDCFG = '/usr/share/openocd/scripts/board/st_b-l475e-iot01a.cfg'
 BUILD_CMD = \
     '-nosplash --launcher.suppressErrors -application org.eclipse.cdt.managedbuilder.core.headlessbuild' \
     + ' -data $WORKSPACE$ -import $PROJPATH$ -cleanBuild $PROJECT$'
+# Seconds without serial output after which a benchmark run is given up
+SERIAL_TIMEOUT = 120
 
 NUM_FREERTOS_MICROBENCHMARK_TESTS = 4
 NUM_KAGE_MICROBENCHMARK_TESTS = 10
@@ -47,6 +69,417 @@ def translateConfigName(name):
     return translated_name
 
 
+# Split a build configuration name into the variant (a key of CONFIG_TERMS)
+# and the benchmark, e.g. kage-no-silhouette-queue into kage-no-silhouette
+# and queue
+def splitConfigName(dirName):
+    variant = next((configuration for configuration in CONFIG_TERMS if configuration in dirName), '')
+    benchmark = dirName.replace(variant + '-', '', 1) if variant else dirName
+    return variant, benchmark
+
+
+# Stable keys of all results a binary may report, by result name. Unlike the
+# names, which are made for humans, the keys do not change with CONFIG_TERMS.
+def resultKeys(dirName):
+    variant, benchmark = splitConfigName(dirName)
+    metrics, sizes = ResultParser(dirName, translateConfigName(dirName), None).result_names()
+    # Code sizes are reported under the name of a result if there is only one
+    keys = {name: ResultKey(variant, benchmark, None) for name in sizes}
+    keys.update((name, ResultKey(variant, benchmark, metric)) for name, metric in metrics.items())
+    return keys
+
+
+# Serialize output of concurrently running boards
+printLock = threading.Lock()
+
+
+def report(*args, **kwargs):
+    with printLock:
+        print(*args, **kwargs)
+
+
+# Run a command and wait for it to finish, printing its output if verbose.
+# Returns the status code of the command.
+def runCommand(command, verbose, shell=False):
+    # Set destinations of stdout and stderr according to argument
+    if verbose:
+        std_dst = subprocess.PIPE
+        std_err = subprocess.STDOUT
+    else:
+        std_dst = subprocess.DEVNULL
+        std_err = subprocess.DEVNULL
+
+    with subprocess.Popen(command, stdout=std_dst, stderr=std_err,
+                          bufsize=1, shell=shell, text=True) as p:
+        while p.poll() is None:
+            if verbose:
+                for line in p.stdout:
+                    report(f'{Style.DIM}', line, end='')
+            sleep(.01)
+        report(f'{Style.RESET_ALL}', end='')
+        return p.returncode
+
+
+# Import the project to System Workbench's workspace and build the binaries.
+# dataDir is the workspace directory System Workbench keeps its metadata in.
+# Returns whether the build succeeded.
+def buildProject(args, program, config, projectPath, dataDir):
+    report('Compiling ', program, ' for ', config, '...')
+    ac6Arg = BUILD_CMD.replace('$WORKSPACE$',
+                               dataDir.as_posix())
+    ac6Arg = ac6Arg.replace('$PROJPATH$', projectPath.as_posix())
+    ac6Arg = ac6Arg.replace('$PROJECT$', PROJECTS[program][config])
+    ac6Arg = args.ac6.as_posix() + ' ' + ac6Arg
+
+    # Run the build process
+    for i in range(args.tries):
+        returncode = runCommand(ac6Arg, args.verbose, shell=True)
+        if returncode != 0:
+            # Building failed
+            if i < args.tries - 1:
+                report(f'{Fore.MAGENTA}WARNING{Style.RESET_ALL}: Command \'{ac6Arg}\' '
+                       f'returned status code {returncode}. Retrying...')
+            else:
+                report(f'{Fore.RED}ERROR{Style.RESET_ALL}: Command \'{ac6Arg}\' '
+                       f'returned status code {returncode}. Terminating benchmarks...')
+        else:
+            # Success
+            return True
+    return False
+
+
+# Hash everything a build of a project depends on: its sources, linker
+# scripts and project files (but not its build output) and the toolchain
+def hashProject(projectPath, projectRoot, toolchainHash):
+    buildDirs = []
+    if projectPath.is_dir():
+        buildDirs = [d for d in projectPath.iterdir() if d.is_dir() and d.name[0] != '.']
+    return hash_sources(projectRoot, buildDirs) + toolchainHash
+
+
+# Get the build directories of the binaries of a project
+def findBuildDirectories(args, program, config, projectPath):
+    # Get the build directories for the binaries and also removes hidden directories
+    if not projectPath.is_dir():
+        raise BenchmarkError(f'Binary folders at {projectPath} '
+                             f'do not exist. Run the script with the \'--build\' flag')
+    build_directories = [d for d in projectPath.iterdir() if d.is_dir() and d.name[0] != '.']
+
+    # Check to make sure that the correct number of directories exist
+    # WARNING, THESE VALUES ARE HARDCODED
+    if program == 'microbenchmark':
+        if config == 'kage':
+            if len(build_directories) != NUM_KAGE_MICROBENCHMARK_TESTS:
+                raise BenchmarkError(f'Binary folders at {projectPath} '
+                                     f'do not exist. Run the script with the \'--build\' flag')
+        elif len(build_directories) != NUM_FREERTOS_MICROBENCHMARK_TESTS:
+            raise BenchmarkError(f'Binary folders at {projectPath} '
+                                 f'do not exist. Run the script with the \'--build\' flag')
+
+    if program == 'coremark':
+        # If the flag has been specified not to use cache, remove those directories from list
+        if args.disable_cache:
+            build_directories = [d for d in build_directories if 'no-cache' in d.name]
+        else:
+            build_directories = [d for d in build_directories if 'no-cache' not in d.name]
+
+        if config == 'kage':
+            if args.disable_cache:
+                if len(build_directories) != NUM_COREMARK_TESTS:
+                    report(f'{Fore.RED}ERROR{Style.RESET_ALL}: Unexpected number of folders')
+            elif len(build_directories) != NUM_COREMARK_KAGE_NO_CACHE_TESTS:
+                report(f'{Fore.RED}ERROR{Style.RESET_ALL}: Unexpected number of folders')
+        elif len(build_directories) != NUM_COREMARK_TESTS:
+            raise BenchmarkError(f'Binary folders at {projectPath} '
+                                 f'do not exist. Run the script with the \'--build\' flag')
+
+    return build_directories
+
+
+# Read the results of a benchmark run from the serial output of a board.
+# Returns the performance and code size results by benchmark name, and the
+# number of lines read.
+async def readResults(args, board, reader, name, confName, size):
+    # Each benchmark has a different output format, handled by its parser
+    parser = ResultParser(name, confName, size)
+    while True:
+        # Give up once no output arrived for SERIAL_TIMEOUT seconds
+        try:
+            rawLine = await asyncio.wait_for(reader.readline(), SERIAL_TIMEOUT)
+        except asyncio.TimeoutError:
+            rawLine = b''
+        if len(rawLine) == 0:
+            report(f'\b{Style.RESET_ALL}{Fore.YELLOW}TIMEOUT REACHED{Style.RESET_ALL}: ', end='')
+            break
+        try:
+            line = rawLine.decode()
+            if args.verbose:
+                report(f'{Style.DIM}', line, end='')
+        except UnicodeDecodeError as ude:
+            report(
+                f'{Style.RESET_ALL}{Fore.YELLOW}WARNING{Style.RESET_ALL}: '
+                f'Decoding error, skipping line')
+            report(ude)
+            continue
+        if parser.feed(line):
+            break
+    report(f'{Style.RESET_ALL}{Fore.GREEN}All results read{Style.RESET_ALL}', '(' + str(board) + ')')
+    return parser.perf, parser.sizes, parser.lines
+
+
+# Flash and run one benchmark binary on a board, whose trusted and untrusted
+# code size is size. Returns the results as readResults does.
+async def runBenchmark(args, board, program, config, configDir, size):
+    report(f'Flashing and running {Fore.GREEN}', program, ' ',
+           translateConfigName(configDir.name), f'{Style.RESET_ALL}on', board)
+    # Execute OpenOCD on binary found in each build config
+    binPath = configDir.joinpath(configDir.name + '.elf')
+
+    # Check to make sure the binary exists
+    if not path.isfile(binPath):
+        raise BenchmarkError(f'Binary {binPath} '
+                             f'does not exist. Run the script with the \'--build\' flag')
+
+    # Determine the human-readable configuration name
+    confName = translateConfigName(configDir.name)
+
+    # The binary starts running once flashed, so the serial port must already
+    # be open by then to receive all of its output
+    reader = await board.connect()
+    try:
+        await board.flash(binPath, report if args.verbose else None)
+        return await readResults(args, board, reader, configDir.name, confName, size)
+    finally:
+        board.disconnect()
+
+
+# Check if the samples of a binary's metrics are enough: every metric needs
+# --repetitions samples, and with --target_ci a 95% confidence interval of
+# at most that fraction of the mean
+def enoughSamples(args, samples):
+    if not samples or min(len(s) for s in samples.values()) < args.repetitions:
+        return False
+    if args.target_ci is not None:
+        return all(s.relative_ci() <= args.target_ci for s in samples.values())
+    return True
+
+
+# Run one benchmark binary on a board until enough samples of its metrics
+# are collected, or --max_repetitions runs were made. Outlying samples are
+# discarded and replaced by further runs. The runs and the lines read are
+# counted in stats.
+# Returns the samples and the code size results by benchmark name.
+async def measureBenchmark(args, board, program, config, configDir, size, stats):
+    samples = {}
+    sizes = {}
+    for _ in range(max(args.max_repetitions, args.repetitions)):
+        perf, runSizes, lines = await runBenchmark(args, board, program, config, configDir, size)
+        stats['runs'] += 1
+        stats['lines'] += lines
+        if not perf:
+            # Nothing to gain from running a binary that reports nothing
+            break
+        sizes.update(runSizes)
+        for name, value in perf.items():
+            samples.setdefault(name, Samples()).append(value)
+        for name, metric in samples.items():
+            rejected = metric.reject_outliers()
+            if rejected:
+                report(f'{Fore.YELLOW}Outlier{Style.RESET_ALL}: discarding ', rejected, ' sample(s) of ', name,
+                       ', running again')
+        if enoughSamples(args, samples):
+            break
+    return samples, sizes
+
+
+# Run the benchmarks of all projects as a pipeline: projects are built (if
+# requested) by a pool of builders, and as soon as a project is built, its
+# binaries are queued for the boards. Each board takes the next binary from
+# the queue once it is done with the previous one, so boards flash and
+# measure while later projects are still being built. The results are merged
+# into perf_dict and size_dict, the board each result was measured on into
+# board_dict and the stable keys of the results (see resultKeys) into
+# key_dict, if given.
+#
+# The boards are driven by coroutines of one event loop, which wait on all
+# serial ports at once. Builders block on the IDE, so they remain threads.
+# The code size of each binary is analyzed by a pool of processes as soon as
+# it is built, independently of flashing. If analyses is given, all binaries
+# are analyzed, including those whose results are reused, and their CodeSize
+# is stored in analyses by build configuration name.
+#
+# With a build cache, projects whose sources did not change since their last
+# successful build are not rebuilt, and binaries whose hash did not change
+# since they were last measured are not run again; their recorded results
+# are used instead.
+def runBenchmarks(args, boards, projects, perf_dict, size_dict, cache=None, board_dict=None, key_dict=None,
+                  analyses=None):
+    resultLock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+
+    # System Workbench locks its workspace metadata while building, so every
+    # additional builder gets a separate metadata directory
+    dataDirs = queue.Queue()
+    dataDirs.put(args.workspace)
+    tempDirs = [tempfile.TemporaryDirectory(prefix='kage-build-') for _ in range(args.build_jobs - 1)]
+    for tempDir in tempDirs:
+        dataDirs.put(Path(tempDir.name))
+
+    if cache is not None and args.build:
+        toolchainHash = fingerprint_toolchain(args.toolchain)
+    stats = Counter()
+    start = monotonic()
+    sizePool = ProcessPoolExecutor(max_workers=args.size_jobs)
+    sizeFutures = {}
+
+    async def pipeline():
+        loop = asyncio.get_running_loop()
+        # Binaries to run, as (program, config, build directory), followed by
+        # None once all projects are built
+        pending = asyncio.Queue()
+
+        def enqueue(job):
+            # Builders run in other threads than the event loop
+            loop.call_soon_threadsafe(pending.put_nowait, job)
+
+        def fail(error):
+            # Stop the other boards and builders after their current task
+            errors.append(error)
+            stop.set()
+            enqueue(None)
+
+        def reportAnalysis(name, analysis):
+            # Runs in a thread of the size pool once the analysis is done
+            if not analysis.cancelled() and analysis.exception() is not None:
+                report(f'{Fore.RED}ERROR{Style.RESET_ALL}: Code size analysis of {name} failed, '
+                       f'its code size is missing: {analysis.exception()!r}')
+
+        def merge(program, config, configDir, perf, sizes, board=None):
+            with resultLock:
+                perf_dict[program][config].update(perf)
+                size_dict[program][config].update(sizes)
+                if board_dict is not None and board is not None:
+                    board_dict[program][config].update((name, str(board)) for name in [*perf, *sizes])
+                if key_dict is not None:
+                    key_dict[program][config].update(resultKeys(configDir.name))
+
+        def builder(program, config, projectPath):
+            if stop.is_set():
+                return
+            try:
+                if args.build:
+                    projectRoot = Path(args.workspace).joinpath(PROJECTS[program][config])
+                    sourceHash = None
+                    if cache is not None:
+                        sourceHash = hashProject(projectPath, projectRoot, toolchainHash)
+                    # The binaries of an up to date project must still exist
+                    if sourceHash is not None and cache.is_built(projectRoot.as_posix(), sourceHash) \
+                            and any(projectPath.glob('*/*.elf')):
+                        report(f'{Fore.CYAN}Up to date{Style.RESET_ALL}: ', program, ' for ', config)
+                    else:
+                        dataDir = dataDirs.get()
+                        try:
+                            built = buildProject(args, program, config, projectPath, dataDir)
+                        finally:
+                            dataDirs.put(dataDir)
+                        if built and sourceHash is not None:
+                            cache.record_build(projectRoot.as_posix(), sourceHash)
+                for configDir in findBuildDirectories(args, program, config, projectPath):
+                    binPath = configDir.joinpath(configDir.name + '.elf')
+                    analysis = None
+                    if binPath.is_file():
+                        analysis = sizePool.submit(analyze, binPath)
+                        analysis.add_done_callback(partial(reportAnalysis, configDir.name))
+                        sizeFutures[configDir.name] = analysis
+                    cached = None
+                    if cache is not None and binPath.is_file():
+                        cached = cache.results(binPath.as_posix(), hash_file(binPath))
+                    if cached is not None:
+                        # Results of older versions of this script are single samples
+                        perf = {name: Samples(value if isinstance(value, list) else [value])
+                                for name, value in cached[0].items()}
+                        sizes = cached[1]
+                    if cached is None or not enoughSamples(args, perf):
+                        enqueue((program, config, configDir, analysis))
+                        continue
+                    if analyses is None:
+                        analysis.cancel()
+                    report(f'Reusing results of {Fore.GREEN}', program, ' ',
+                           translateConfigName(configDir.name), f'{Style.RESET_ALL}(binary unchanged)')
+                    merge(program, config, configDir, perf, sizes)
+            except (BenchmarkError, OSError) as e:
+                fail(e)
+
+        async def worker(board):
+            while not stop.is_set():
+                job = await pending.get()
+                if job is None:
+                    # Let the other boards see the end of the queue too
+                    pending.put_nowait(None)
+                    return
+                program, config, configDir, analysis = job
+                try:
+                    size = None
+                    if analysis is not None:
+                        # A failed analysis (reported by reportAnalysis) only
+                        # leaves the code size of this binary missing
+                        try:
+                            size = (await asyncio.wrap_future(analysis)).split('baseline' in config)
+                        except Exception:
+                            pass
+                    perf, sizes = await measureBenchmark(args, board, program, config, configDir, size, stats)
+                except (BenchmarkError, OSError) as e:
+                    fail(e)
+                    return
+                merge(program, config, configDir, perf, sizes, board)
+                # Only record complete runs, which always report the code size
+                if cache is not None and sizes:
+                    binPath = configDir.joinpath(configDir.name + '.elf')
+                    cache.record_results(binPath.as_posix(), hash_file(binPath),
+                                         {name: list(samples) for name, samples in perf.items()}, sizes)
+
+        workers = [asyncio.ensure_future(worker(board)) for board in boards]
+        with ThreadPoolExecutor(max_workers=args.build_jobs) as builders:
+            await asyncio.gather(*[loop.run_in_executor(builders, builder, program, config, projectPath)
+                                   for program, config, projectPath in projects])
+        pending.put_nowait(None)
+        await asyncio.gather(*workers)
+
+    try:
+        asyncio.run(pipeline())
+        if analyses is not None and not errors:
+            for name, future in sizeFutures.items():
+                if future.exception() is None:
+                    analyses[name] = future.result()
+    finally:
+        for future in sizeFutures.values():
+            future.cancel()
+        sizePool.shutdown()
+    for tempDir in tempDirs:
+        tempDir.cleanup()
+    elapsed = monotonic() - start
+    if stats['runs']:
+        report(f'{stats["runs"]} runs on {len(boards)} board(s) in {elapsed:.1f}s, '
+               f'{stats["lines"]} lines read ({stats["lines"] / elapsed:.0f} lines/s)')
+
+    if errors:
+        print(f'{Fore.RED}ERROR{Style.RESET_ALL}: {errors[0]}')
+        exit(1)
+
+
+# Format the result of a benchmark, with its statistics if it was run repeatedly
+def formatSamples(samples, unit):
+    if len(samples) == 1:
+        return str(samples[0]) + unit
+    summary = samples.summary()
+    result = f'{summary.median:g}{unit} (mean {summary.mean:.2f}, std {summary.std:.2f}, ' \
+             f'95% CI ±{summary.ci:.2f}, n={summary.count}'
+    if samples.rejected:
+        result += f', {len(samples.rejected)} outlier(s) discarded'
+    return result + ')'
+
+
 # Main routine
 if __name__ == "__main__":
     # Argparse
@@ -59,8 +492,25 @@ if __name__ == "__main__":
                         help="Specify custom path of OpenOCD")
     # Optional OpenOCD configuration path
     parser.add_argument('--ocdcfg', type=Path,
-                        default='/usr/share/openocd/scripts/board/st_b-l475e-iot01a.cfg',
+                        default=OCDCFG,
                         help="Specify custom OpenOCD configuration path")
+    # Optional serial port of the board
+    parser.add_argument('--port', type=str, default=PORT,
+                        help="Specify the serial port of the board")
+    # Optional list of boards to run the benchmarks on concurrently
+    parser.add_argument('--board', type=str, nargs=2, action='append', metavar=('PORT', 'OCDCFG'),
+                        help="Run benchmarks on the board with the given serial port and OpenOCD configuration. "
+                             "Repeat to spread the benchmarks across several boards (overrides --port and --ocdcfg)")
+    # Optional simulated boards
+    parser.add_argument('--replay', type=int, metavar='BOARDS',
+                        help="Run the benchmarks on this many simulated boards replaying recorded serial output, "
+                             "instead of real boards (for testing this script)")
+    parser.add_argument('--transcripts', type=Path,
+                        help="Directory of <benchmark>.txt transcripts replacing the built-in ones of --replay")
+    parser.add_argument('--replay_speed', type=float, default=1.,
+                        help="Speed up the replay by this factor; 0 replays without delays. Default: 1")
+    parser.add_argument('--replay_jitter', type=float, default=0.,
+                        help="Relative standard deviation of the replayed results between runs. Default: 0")
     # Optional System Workbench installation path
     parser.add_argument('--ac6', type=Path,
                         default='~/Ac6/SystemWorkbench/eclipse',
@@ -88,22 +538,74 @@ if __name__ == "__main__":
                         help="Write the results to a file")
     parser.add_argument('--build', action='store_true', default=False,
                         help='Runs make clean and build on all of the binaries. Needed for the first run.')
+    parser.add_argument('--build_jobs', type=int, default=1,
+                        help="Number of projects to build in parallel while boards run already built binaries. "
+                             "Default: 1")
+    # Optional build cache
+    parser.add_argument('--build_cache', type=str,
+                        help="Path of the cache of builds and results. Default: " + DEFAULT_BUILD_CACHE +
+                             ", or none with --replay")
+    parser.add_argument('--no_build_cache', action='store_true', default=False,
+                        help="Always rebuild all projects (with --build) and run all binaries")
+    parser.add_argument('--toolchain', type=Path, nargs='+', default=TOOLCHAIN,
+                        help="Files or directories of the toolchain, whose changes make all projects stale. "
+                             "Default: the LLVM, newlib and compiler-rt installations under build/")
     parser.add_argument('--tries', type=int, default=3,
                         help="Number of tries when building a program. A value > 1 is recommended because the System Workbench's CMD interface is not very stable. Default: 3")
+    # Optional repeated runs of every binary
+    parser.add_argument('--repetitions', type=int, default=1,
+                        help="Run every binary at least this many times and report the median, mean, standard "
+                             "deviation and 95%% confidence interval of each result. Outliers are discarded and "
+                             "run again. Default: 1")
+    parser.add_argument('--target_ci', type=float,
+                        help="Keep running a binary until the 95%% confidence interval of each result is at most "
+                             "this fraction of its mean (e.g. 0.01), up to --max_repetitions runs")
+    parser.add_argument('--max_repetitions', type=int, default=30,
+                        help="Maximum number of runs of a binary, including reruns of outliers. Default: 30")
+    # Optional results database
+    parser.add_argument('--results_db', type=str,
+                        help="Path of the database recording the results of every run, for comparisons with "
+                             "python -m kage_tools.results_store. Default: " + DEFAULT_RESULTS_DB +
+                             ", or none with --replay")
+    parser.add_argument('--no_results_db', action='store_true', default=False,
+                        help="Do not record the results of this run")
+    # Optional code size analysis
+    parser.add_argument('--size_jobs', type=int,
+                        help="Number of processes analyzing the code size of binaries. Default: number of CPUs")
+    parser.add_argument('--function_sizes', type=int, metavar='N',
+                        help="Report the N functions of each Kage binary that grew most over FreeRTOS, and how "
+                             "much of their growth are CFI labels")
+    # Optional output format
+    parser.add_argument('--format', type=str, default='text', choices=['text', 'json', 'csv'],
+                        help="Format of the results printed and written to --outfile. json and csv identify "
+                             "results by program, config, variant, benchmark, metric and unit. Default: text")
     # Get arguments
     args = parser.parse_args()
+    # Simulated results must not be reused or compared as measurements of
+    # the binaries, unless they are kept apart explicitly
+    if args.build_cache is None:
+        args.no_build_cache |= bool(args.replay)
+        args.build_cache = DEFAULT_BUILD_CACHE
+    if args.results_db is None:
+        args.no_results_db |= bool(args.replay)
+        args.results_db = DEFAULT_RESULTS_DB
 
-    # Set destinations of stdout and stderr according to argument
-    if args.verbose:
-        std_dst = subprocess.PIPE
-        std_err = subprocess.STDOUT
+    # Determine the boards to use
+    if args.replay:
+        boards = [ReplayBoard(f'replay{i}', args.transcripts, args.replay_speed, args.replay_jitter)
+                  for i in range(args.replay)]
+    elif args.board:
+        boards = [SerialBoard(port, ocdcfg, args.openocd) for port, ocdcfg in args.board]
     else:
-        std_dst = subprocess.DEVNULL
-        std_err = subprocess.DEVNULL
+        boards = [SerialBoard(args.port, args.ocdcfg, args.openocd)]
 
     # Initialize dict to store results
     perf_dict = {}
     size_dict = {}
+    board_dict = {}
+    key_dict = {}
+    # Projects to run, as (program, config, project path)
+    projects = []
 
     # Generate project paths
     for program in args.programs:
@@ -117,6 +619,8 @@ if __name__ == "__main__":
         # Initialize dict to store results
         perf_dict[program] = {}
         size_dict[program] = {}
+        board_dict[program] = {}
+        key_dict[program] = {}
 
         projProgram = PROJECTS[program]
         for config in args.configs:
@@ -130,228 +634,24 @@ if __name__ == "__main__":
             # Initialize dict to store results
             perf_dict[program][config] = {}
             size_dict[program][config] = {}
+            board_dict[program][config] = {}
+            key_dict[program][config] = {}
 
-            # Import the project to System Workbench's workspace and build the binaries
-            if args.build:
-                print('Compiling ', program, ' for ', config, '...')
-                ac6Arg = BUILD_CMD.replace('$WORKSPACE$',
-                                           args.workspace.as_posix())
-                ac6Arg = ac6Arg.replace('$PROJPATH$', projectPath.as_posix())
-                ac6Arg = ac6Arg.replace('$PROJECT$', projProgram[config])
-                ac6Arg = args.ac6.as_posix() + ' ' + ac6Arg
-
-                # Run the build process
-                for i in range(args.tries):
-                    with subprocess.Popen(ac6Arg, stdout=std_dst, stderr=std_err,
-                                        bufsize=1, shell=True, text=True) as p:
-                        while p.poll() is None:
-                            if args.verbose:
-                                for line in p.stdout:
-                                    print(f'{Style.DIM}', line, end='')
-                            sleep(.01)
-                        print(f'{Style.RESET_ALL}', end='')
-                        if p.returncode != 0:
-                            # Building failed
-                            if i < args.tries - 1:
-                                print(f'{Fore.MAGENTA}WARNING{Style.RESET_ALL}: Command \'{ac6Arg}\' '
-                                    f'returned status code {p.returncode}. Retrying...')
-                            else:
-                                print(f'{Fore.RED}ERROR{Style.RESET_ALL}: Command \'{ac6Arg}\' '
-                                    f'returned status code {p.returncode}. Terminating benchmarks...')
-                        else:
-                            # Success
-                            break
-
-            # Get the build directories for the binaries and also removes hidden directories
-            build_directories = [d for d in projectPath.iterdir() if d.is_dir() and d.name[0] != '.']
-
-            # Check to make sure that the correct number of directories exist
-            # WARNING, THESE VALUES ARE HARDCODED
-            if program == 'microbenchmark':
-                if config == 'kage':
-                    if len(build_directories) != NUM_KAGE_MICROBENCHMARK_TESTS:
-                        print(
-                            f'{Fore.RED}ERROR{Style.RESET_ALL}: Binary folders at {projectPath} '
-                            f'do not exist. Run the script with the \'--build\' flag')
-                        exit(1)
-                elif len(build_directories) != NUM_FREERTOS_MICROBENCHMARK_TESTS:
-                    print(
-                        f'{Fore.RED}ERROR{Style.RESET_ALL}: Binary folders at {projectPath} '
-                        f'do not exist. Run the script with the \'--build\' flag')
-                    exit(1)
-
-            if program == 'coremark':
-                # If the flag has been specified not to use cache, remove those directories from list
-                if args.disable_cache:
-                    build_directories = [d for d in build_directories if 'no-cache' in d.name]
-                else:
-                    build_directories = [d for d in build_directories if 'no-cache' not in d.name]
-
-                if config == 'kage':
-                    if args.disable_cache:
-                        if len(build_directories) != NUM_COREMARK_TESTS:
-                            print(f'{Fore.RED}ERROR{Style.RESET_ALL}: Unexpected number of folders')
-                    elif len(build_directories) != NUM_COREMARK_KAGE_NO_CACHE_TESTS:
-                        print(f'{Fore.RED}ERROR{Style.RESET_ALL}: Unexpected number of folders')
-                elif len(build_directories) != NUM_COREMARK_TESTS:
-                    print(
-                        f'{Fore.RED}ERROR{Style.RESET_ALL}: Binary folders at {projectPath} '
-                        f'do not exist. Run the script with the \'--build\' flag')
-                    exit(1)
-
-            for configDir in build_directories:
-                print(f'Flashing and running {Fore.GREEN}', program, ' ',
-                      translateConfigName(configDir.name), f'{Style.RESET_ALL}')
-                # Execute OpenOCD on binary found in each build config
-                binPath = configDir.joinpath(configDir.name + '.elf')
-
-                # Check to make sure the binary exists
-                if not path.isfile(binPath):
-                    print(
-                        f'{Fore.RED}ERROR{Style.RESET_ALL}: Binary {binPath} '
-                        f'does not exist. Run the script with the \'--build\' flag')
-                    exit(1)
-
-                ocdArg = OCD_CMD.replace('$PATH$', binPath.as_posix())
-
-                # Flash the binary asynchronously to immediately receive serial output
-                with subprocess.Popen([args.openocd, '-f', args.ocdcfg.as_posix(), '-c', ocdArg],
-                                      stdout=std_dst, stderr=std_err, bufsize=1, text=True) as p:
-                    while p.poll() is None:
-                        if args.verbose:
-                            for line in p.stdout:
-                                print(f'{Style.DIM}', line, end='')
-                        sleep(.01)
-                    print(f'{Style.RESET_ALL}', end='')
-                    if p.returncode != 0:
-                        print(
-                            f'{Fore.RED}ERROR{Style.RESET_ALL}: Command \'{args.openocd} -f {args.ocdcfg.as_posix()} '
-                            f'-c \"{ocdArg}\"\' returned status code {p.returncode}. Terminating benchmarks...')
-                        exit(1)
-
-                # Determine the human-readable configuration name
-                confName = translateConfigName(configDir.name)
-                # Compute code size
-                with binPath.open('rb') as f:
-                    elffile = ELFFile(f)
-                    section = elffile.get_section_by_name('privileged_functions')
-                    if section is None:
-                        privileged_size = 0
-                    else:
-                        privileged_size = section.data_size
+            projects.append((program, config, projectPath))
 
-                    section = elffile.get_section_by_name('freertos_system_calls')
-                    if section is None:
-                        syscallSize = 0
-                    else:
-                        syscallSize = section.data_size
-                    textSize = elffile.get_section_by_name('.text').data_size
-                    # Calculate total trusted and untrusted size
-                    if 'baseline' in config:
-                        # Everything is trusted in FreeRTOS and FreeRTOS with MPU
-                        trusted = privileged_size + syscallSize + textSize
-                        untrusted = 0
-                    else:
-                        trusted = privileged_size
-                        untrusted = syscallSize + textSize
-
-                    # Open serial port with 2 minute timeout. This loop ends when the timeout is reached.
-                    # or when the last line is read
-                    with serial.Serial('/dev/ttyACM0', 115200, timeout=120) as ser:
-                        while True:
-                            # Sleep for just a millisecond to give a slight buffer
-                            sleep(.001)
-
-                            try:
-                                line = ser.readline().decode()
-                                if args.verbose:
-                                    print(f'{Style.DIM}', line, end='')
-                            except UnicodeDecodeError as ude:
-                                print(
-                                    f'{Style.RESET_ALL}{Fore.YELLOW}WARNING{Style.RESET_ALL}: '
-                                    f'Decoding error, skipping line')
-                                print(ude)
-                                continue
-
-                            if len(line) == 0:
-                                # timeout
-                                print(f'\b{Style.RESET_ALL}{Fore.YELLOW}TIMEOUT REACHED{Style.RESET_ALL}: ', end='')
-                                break
-
-                            # Each benchmark has different output format, so do a manual matching here.
-                            if 'stream-buffer' in configDir.name:
-                                # Stream buffer microbenchmark
-                                if 'Creating stream buffer' in line:
-                                    # Stream buffer creation
-                                    t = int(line.split(': ')[1].replace('\n', '').replace('\r', ''))
-                                    perf_dict[program][config][confName + ': create'] = t
-                                if 'Received unsigned 9 from stream buffer' in line:
-                                    # Stream buffer send and receive
-                                    t = int(line.split(': ')[1].replace('\n', '').replace('\r', ''))
-                                    perf_dict[program][config][confName + ': send and receive'] = t
-                                    size_dict[program][config][confName] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                if 'Started Microbenchmark Low Priority Task' in line:
-                                    break
-                            if 'queue' in configDir.name:
-                                # Queue microbenchmark
-                                if 'Creating queue' in line:
-                                    # Queue creation
-                                    t = int(line.split(': ')[1].replace('\n', '').replace('\r', ''))
-                                    perf_dict[program][config][confName + ': create'] = t
-                                if 'Received unsigned 9 from queue' in line:
-                                    # Queue send and receive
-                                    t = int(line.split(': ')[1].replace('\n', '').replace('\r', ''))
-                                    perf_dict[program][config][confName + ': send and receive'] = t
-                                    size_dict[program][config][confName] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                if 'Started Microbenchmark Low Priority Task' in line:
-                                    break
-                            if 'exception-dispatcher' in configDir.name:
-                                # Exception microbenchmark
-                                if 'DIV_BY_0' in line:
-                                    t = int(line.split(': 0 ')[1].split(' cycles')[0])
-                                    perf_dict[program][config][confName.replace('dispatcher', '')] = t
-                                    size_dict[program][config][confName.replace('dispatcher', '')] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                if 'Started Microbenchmark Low Priority Task' in line:
-                                    break
-                            if 'context-switch' in configDir.name:
-                                # Context switch microbenchmark
-                                if 'Context Switch cycle' in line:
-                                    t = int(line.split(': ')[1].split(' cycles')[0])
-                                    perf_dict[program][config][confName] = t
-                                    size_dict[program][config][confName] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                    break
-                            if 'secure-api' in configDir.name:
-                                # Secure API microbenchmark
-                                if 'MPU checks' in line:
-                                    t = int(line.split(': ')[1].split(' cycles')[0])
-                                    perf_dict[program][config][confName + ': MPU region configuration'] = t
-                                if 'xVerifyTCB' in line:
-                                    t = int(line.split(': ')[1].replace('\r', '').replace('\n', ''))
-                                    perf_dict[program][config][confName + ': task control block'] = t
-                                if 'xVerifyUntrustedData' in line:
-                                    t = int(line.split(': ')[1].replace('\r', '').replace('\n', ''))
-                                    perf_dict[program][config][confName + ': other pointers'] = t
-                                if 'Exception priority' in line:
-                                    t = int(line.split(': ')[1].replace('\r', '').replace('\n', ''))
-                                    perf_dict[program][config][confName + ': exception priority'] = t
-                                    size_dict[program][config][confName] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                    break
-                            if 'coremark' in configDir.name:
-                                # CoreMark
-                                if 'Iterations/Sec' in line:
-                                    t = float(line.split(': ')[1].replace('\n', ''))
-                                    perf_dict[program][config][confName] = t
-                                    size_dict[program][config][confName] = \
-                                        {'trusted': trusted, 'untrusted': untrusted}
-                                if 'CoreMark 1.0' in line:
-                                    break
-                        # While loop exited
-                        print(f'{Style.RESET_ALL}{Fore.GREEN}All results read{Style.RESET_ALL}')
+    cache = None
+    if not args.no_build_cache:
+        cache = BuildCache(args.build_cache)
+
+    # Build the projects, and flash and run all binaries spread across the boards
+    analyses = {} if args.function_sizes else None
+    runBenchmarks(args, boards, projects, perf_dict, size_dict, cache, board_dict, key_dict, analyses)
+    if cache is not None:
+        cache.close()
+
+    rows = result_rows(perf_dict, size_dict, key_dict, board_dict)
+    overheadList = overheads(rows)
+    means = geometric_means(overheadList)
 
     # Generate result string
     resultStr = "Performance results:\n"
@@ -362,11 +662,9 @@ if __name__ == "__main__":
             # Sort the order of benchmarks to print
             benchList = sorted(list(perfDictPart.keys()))
             for bench in benchList:
-                resultStr += (bench.ljust(65) + str(perfDictPart[bench]))
-                if program == 'coremark':
-                    resultStr += ' iter/sec\n'
-                else:
-                    resultStr += ' cycles\n'
+                resultStr += (bench.ljust(65) + formatSamples(perfDictPart[bench],
+                                                              ' iter/sec' if program == 'coremark' else ' cycles'))
+                resultStr += '\n'
     resultStr += '\nCode size results (bytes)\n'
     for program in size_dict:
         resultStr += (program + ':\n')
@@ -376,9 +674,48 @@ if __name__ == "__main__":
             benchList = sorted(list(sizeDictPart.keys()))
             for bench in benchList:
                 resultStr += (bench.ljust(60) + str(sizeDictPart[bench]) + '\n')
+    if overheadList:
+        resultStr += '\nOverhead (relative cost over FreeRTOS, > 1 is slower)\n'
+        for program in perf_dict:
+            programOverheads = [overhead for overhead in overheadList if overhead.program == program]
+            if not programOverheads:
+                continue
+            resultStr += (program + ':\n')
+            for overhead in programOverheads:
+                resultStr += (f'{CONFIG_TERMS[overhead.variant]} / {CONFIG_TERMS[overhead.reference]}: '
+                              f'{overhead.benchmark} {overhead.metric}'.ljust(80) + f' {overhead.ratio:.3f}\n')
+            for mean in means:
+                if mean.program == program:
+                    resultStr += (f'{CONFIG_TERMS[mean.variant]} / {CONFIG_TERMS[mean.reference]}: '
+                                  f'geometric mean of {mean.count}'.ljust(80) + f' {mean.ratio:.3f}\n')
+    if analyses:
+        resultStr += '\nCode size growth over FreeRTOS by function (bytes)\n'
+        baselines = {splitConfigName(name)[1]: analysis for name, analysis in analyses.items()
+                     if splitConfigName(name)[0] == 'baseline'}
+        for name in sorted(analyses):
+            variant, benchmark = splitConfigName(name)
+            if not variant.startswith('kage') or benchmark not in baselines:
+                continue
+            analysis = analyses[name]
+            baseline = baselines[benchmark]
+            resultStr += (f'{translateConfigName(name)}: {analysis.total() - baseline.total():+d} bytes, '
+                          f'{analysis.cfi_bytes() - baseline.cfi_bytes():+d} of them CFI labels\n')
+            resultStr += format_growth(growth(baseline, analysis), args.function_sizes) + '\n'
+    if args.format != 'text':
+        output = io.StringIO()
+        (write_json if args.format == 'json' else write_csv)(output, rows, overheadList, means)
+        resultStr = output.getvalue()
     print(resultStr)
 
     if args.outfile is not None:
         with args.outfile.open('w') as file:
             file.write(resultStr)
             print("Results stored to ", args.outfile.as_posix())
+
+    if not args.no_results_db:
+        store = ResultsStore(args.results_db)
+        revisions = (git_revision(ROOT_DIR), git_revision(ROOT_DIR.joinpath('llvm-project')),
+                     git_revision(args.workspace))
+        run = store.record_run(revisions, 'disabled' if args.disable_cache else 'enabled', boards, rows)
+        store.close()
+        print(f'Results recorded as run {run} in {args.results_db}')
@@ -1,13 +1,79 @@
 #!/usr/bin/env python3
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import re
-import subprocess
+
+from kage_tools.gadget_analysis import AnalysisError, analyze_binary
+from kage_tools.gadget_cache import DEFAULT_GADGET_CACHE, file_digest
+from kage_tools.gadget_model import STORE_KINDS, STORE_TARGETS
+
+# List of secure API functions, next to this script
+SECURE_API = Path(__file__).resolve().parent / 'secure_api.conf'
 
 PRESET = {'kage':Path('/home/artifact/Kage/workspace/coremark/demos/st/stm32l475_discovery/ac6/kage-coremark-3-threads/kage-coremark-3-threads.elf'),
           'freertos':Path('/home/artifact/Kage/workspace/freertos_coremark_clang/demos/st/stm32l475_discovery/ac6/baseline-coremark-3-threads/baseline-coremark-3-threads.elf')}
 
+# Read a manifest of binaries to compare. Each line names a build, its mode
+# (kage or freertos) and the path of its binary, separated by whitespace;
+# empty lines and lines starting with # are skipped. Relative paths are
+# relative to the manifest.
+def readManifest(path):
+    builds = []
+    for lineNo, line in enumerate(path.read_text().splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 2)
+        if len(fields) != 3 or fields[1] not in ('kage', 'freertos'):
+            raise AnalysisError(f'{path}:{lineNo}: expected "<name> <kage|freertos> <binary>"')
+        name, mode, binary = fields
+        builds.append((name, mode, path.parent / binary))
+    return builds
+
+
+# Exit with an error unless the list of secure API functions, which kage
+# mode reads, exists
+def checkSecureApis(path):
+    if not path.is_file():
+        print(f"ERROR: Cannot find the list of secure API functions {path}")
+        exit(1)
+
+
+# Analyze the builds of a manifest in parallel and print one table comparing
+# them. Identical binaries analyzed in the same mode are only analyzed once.
+# The reachable gadgets of each build are compared to those of the reference
+# build (by default the first one).
+def compareBuilds(builds, secureApiPath, engine, jobs, reference=None, cacheDir=None):
+    reference = reference or builds[0][0]
+    if reference not in [name for name, _, _ in builds]:
+        raise AnalysisError(f'Unknown reference build {reference}')
+    keys = {name: (file_digest(binary), mode) for name, mode, binary in builds}
+    unique = {}
+    for name, mode, binary in builds:
+        unique.setdefault(keys[name], binary)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {key: executor.submit(analyze_binary, binary.as_posix(), key[1], secureApiPath, engine,
+                                        collect_texts=True, cache_dir=cacheDir)
+                   for key, binary in unique.items()}
+        analyses = {key: future.result() for key, future in futures.items()}
+
+    refTexts = analyses[keys[reference]].texts
+    print('{:24s} {:8s} {:>9s} {:>9s} {:>11s} {:>9s} {:>9s}'.format(
+        'build', 'mode', 'total', 'reachable', 'priv stores', '+gadgets', '-gadgets'))
+    for name, mode, _ in builds:
+        analysis = analyses[keys[name]]
+        print('{:24s} {:8s} {:9d} {:9d} {:11d} {:9d} {:9d}'.format(
+            name, mode, analysis.total, analysis.reachable, analysis.stores.total(),
+            len(analysis.texts - refTexts), len(refTexts - analysis.texts)))
+    print('+gadgets/-gadgets: reachable gadgets only in the build/only in {:s}'.format(reference))
+    shared = [[name for name, _, _ in builds if keys[name] == key] for key in unique]
+    for names in shared:
+        if len(names) > 1:
+            print('NOTE: {:s} are identical and were analyzed once.'.format(', '.join(names)))
+
+
 # Main routine
 if __name__ == "__main__":
     # Argparse
@@ -21,18 +87,44 @@ if __name__ == "__main__":
         default='kage',
         help="Choose the mode (kage or freertos)")
     parser.add_argument('--secure_api', type=Path,
-        default=Path('secure_api.conf'),
-        help="Specify path to the list of secure API functions")
+        default=SECURE_API,
+        help="Specify path to the list of secure API functions (default: "
+             "secure_api.conf next to this script)")
     parser.add_argument('--out_total', type=Path, required=False,
         help="Write the list of all gadgets to a file")
     parser.add_argument('--out_reachable', type=Path, required=False,
         help="Write the list of reachable gadgets to a file")
-    parser.add_argument('--sh_script', type=Path,
-        default=Path('find_filter_gadgets.sh'),
-        help="Manually specify the location of the find_filter_gadgets.sh script")
+    parser.add_argument('--engine', type=str,
+        choices=['native','ropgadget'],
+        default='native',
+        help="Find gadgets in-process (native) or with ROPgadget")
+    parser.add_argument('--store_functions', type=int, default=10,
+        help="Number of functions with the most privileged stores to list")
+    parser.add_argument('--manifest', type=Path,
+        help="Compare the builds listed in a manifest file (lines of "
+             "\"<name> <kage|freertos> <binary>\") instead of analyzing one binary")
+    parser.add_argument('--reference', type=str,
+        help="Build of the manifest the others are compared to (default: the first one)")
+    parser.add_argument('-j', '--jobs', type=int,
+        help="Number of binaries analyzed in parallel (default: one per CPU)")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_GADGET_CACHE,
+        help="Reuse the gadgets and symbols of identical binaries from a cache "
+             "directory (default: " + DEFAULT_GADGET_CACHE + ")")
     # Get arguments
     args = parser.parse_args()
 
+    if not args.manifest is None:
+        try:
+            builds = readManifest(args.manifest)
+            if any(mode == 'kage' for _, mode, _ in builds):
+                checkSecureApis(args.secure_api)
+            compareBuilds(builds, args.secure_api, args.engine, args.jobs,
+                          args.reference, args.cache)
+        except AnalysisError as e:
+            print("ERROR: " + str(e))
+            exit(1)
+        exit(0)
+
     # Determine the binary file
     if (not args.f is None) == args.preset:
         print("ERROR: If using the preset, then no custom binary file is allowed.")
@@ -43,74 +135,39 @@ if __name__ == "__main__":
     else:
         binPath = args.f
 
-    # In kage mode, first find the range of untrusted code and store the string
-    # to rangeStr.
     if args.mode == 'kage':
-        objdumpStr = subprocess.run(['arm-none-eabi-objdump', '-h',
-                                     binPath.as_posix()],
-                                    capture_output=True).stdout
-        objdumpStr = objdumpStr.decode('utf-8')
-        # We only care about the boundaries of .text, the untrusted code
-        p = re.compile('(?<= )[0-9a-f]+') # Match hex values separated by space
-        rangeStr = None
-        for line in objdumpStr.split('\n'):
-            if '.text' in line:
-                values = p.findall(line)
-                # Should never reach here, but we should have a sanity check
-                if len(values) < 3:
-                    continue
-                start = int(values[2], 16)
-                end = start + int(values[1], 16)
-                rangeStr = hex(start) + '-' + hex(end)
-                break
-        # A sanity check to ensure that we find the range successfully
-        if rangeStr is None:
-            print("ERROR: Could not find the range of untrusted code section.")
-            exit(1)
-    
-    # Find all gadgets, regardless if they're reachable
-    totalStr = subprocess.run(['sh', args.sh_script.as_posix(), '-f',
-                               binPath.as_posix(), '-a', '-b'],
-                              capture_output=True).stdout
-    totalStr = totalStr.decode('utf-8')
-    # Count number
-    numTotal = totalStr.count('\n')
-    # If requested, save the list of gadgets to file
+        checkSecureApis(args.secure_api)
+
+    totalFile = None
     if not args.out_total is None:
-        with args.out_total.open('w') as file:
-            file.write(totalStr)
-    print('Total gadgets found: ', numTotal)
-
-    # Find reachable gadgets
-    reachStr = ''
-    # For freertos, all gadgets are reachable since there is no protection
-    # at all.
+        totalFile = args.out_total.open('w')
+    reachFile = None
+    if not args.out_reachable is None:
+        reachFile = args.out_reachable.open('w')
+
+    try:
+        analysis = analyze_binary(binPath.as_posix(), args.mode, args.secure_api, args.engine, totalFile,
+                                  reachFile, cache_dir=args.cache)
+    except AnalysisError as e:
+        print("ERROR: " + str(e))
+        exit(1)
+    stores = analysis.stores
+
+    if totalFile:
+        totalFile.close()
+    if reachFile:
+        reachFile.close()
+    print('Total gadgets found: ', analysis.total)
     if args.mode == 'freertos':
         print('NOTE: All gadgets are reachable in FreeRTOS.')
-        reachStr = totalStr
-    else:
-        reachStr = subprocess.run(['sh', args.sh_script.as_posix(), '-f',
-                                   binPath.as_posix(), '-b', '-r', rangeStr],
-                                  capture_output=True).stdout
-        reachStr = reachStr.decode('utf-8')
-    # Count number
-    numReachable = reachStr.count('\n')
-    # If requested, save the list of gadgets to file
-    if not args.out_reachable is None:
-        with args.out_reachable.open('w') as file:
-            file.write(reachStr)
-    print('Reachable gadgets: ', numReachable)
-
-    # Count number of privileged stores in reachable gadgets
-
-    # STR instructions (lt and gt are conditional suffixes that may appear
-    # for stores inside an IT block)
-    pPrivStore = re.compile(' (str[a-su-z]*(lt|gt)?) ')
-    numPrivStore = len(pPrivStore.findall(reachStr))
-    # STM/STMIA/STMEA/STMDB/STMFD instructions
-    pPrivStoreMultiple = re.compile(' stm[a-z]* ')
-    numPrivStore += len(pPrivStoreMultiple.findall(reachStr))
-    # PUSH instructions
-    pPrivPush = re.compile(' push[a-z]* ')
-    numPrivStore += len(pPrivPush.findall(reachStr))
-    print('Privileged stores in reachable gadgets: ', numPrivStore)
\ No newline at end of file
+    print('Reachable gadgets: ', analysis.reachable)
+    print('Privileged stores in reachable gadgets: ', stores.total())
+    print('  by kind: ', ', '.join('{:s} {:d}'.format(kind, stores.kinds[kind]) for kind in STORE_KINDS))
+    print('  by target: ', ', '.join('{:s} {:d}'.format(target, stores.targets[target])
+                                     for target in STORE_TARGETS))
+    print('Reachable gadgets with privileged stores: ', stores.gadgets)
+    print('Unprivileged stores (STRT) in reachable gadgets: ', stores.unprivileged)
+    if args.store_functions:
+        print('Functions with the most privileged stores:')
+        for function, count in stores.functions.most_common(args.store_functions):
+            print('  {:40s} {:d}'.format(function, count))
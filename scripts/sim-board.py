@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Simulated benchmark boards for running run-benchmarks.py without hardware.
+
+Each simulated board is a pseudo-terminal standing in for the serial port of
+a board, plus an OpenOCD configuration file for sim-openocd.py. When
+sim-openocd.py "flashes" a binary, it tells the board through a control FIFO,
+and the board replays the serial output of the benchmark in that binary.
+
+Output is replayed from the timed transcripts of boards.py, like the
+--replay boards of run-benchmarks.py do in-process; unlike those, these
+boards exercise the serial port and OpenOCD code of run-benchmarks.py. With
+--jitter, the values of the built-in transcripts vary between runs like
+measurements on real boards.
+"""
+
+import argparse
+import os
+import pty
+import signal
+import termios
+import threading
+import tty
+from pathlib import Path
+from time import sleep
+
+from kage_tools.boards import load_transcript
+
+
+class SimulatedBoard(object):
+    def __init__(self, link, transcripts=None, flash_time=0., jitter=0.):
+        self.link = Path(link)
+        self.transcripts = transcripts
+        self.jitter = jitter
+        self.control = Path(str(link) + '.ctl')
+        self.ocdcfg = Path(str(link) + '.cfg')
+
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        for file in (self.link, self.control):
+            if file.is_symlink() or file.exists():
+                file.unlink()
+        self.link.symlink_to(os.ttyname(self.__slave))
+        os.mkfifo(self.control)
+        self.ocdcfg.write_text('# Simulated board {:s}\n'
+                               'sim_control {:s}\n'
+                               'sim_flash_time {:f}\n'.format(str(self.link), str(self.control), flash_time))
+        # Incremented on every flash, so an old replay stops
+        self.__generation = 0
+
+    def close(self):
+        for file in (self.link, self.control, self.ocdcfg):
+            if file.is_symlink() or file.exists():
+                file.unlink()
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def __replay(self, generation, lines):
+        for line in lines:
+            delay, _, text = line.partition(' ')
+            sleep(float(delay))
+            if generation != self.__generation:
+                return
+            os.write(self.__master, (text + '\r\n').encode())
+
+    def serve(self):
+        """Replay a transcript for every binary flashed, forever."""
+        # Keep the FIFO open for writing, so reading never hits end of file
+        with open(os.open(self.control, os.O_RDWR)) as control:
+            for binary in control:
+                binary = binary.strip()
+                self.__generation += 1
+                # Discard output not read since the last flash
+                termios.tcflush(self.__slave, termios.TCIFLUSH)
+                lines = load_transcript(self.transcripts, Path(binary).stem, self.jitter)
+                threading.Thread(target=self.__replay, args=(self.__generation, lines), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulate benchmark boards with pseudo-terminals for run-benchmarks.py')
+    parser.add_argument('--link', type=str, default='/tmp/kage-board',
+                        help='path prefix of the serial port links, numbered per board (default: /tmp/kage-board)')
+    parser.add_argument('-n', '--count', type=int, default=1,
+                        help='number of boards to simulate (default: 1)')
+    parser.add_argument('--transcripts', type=Path,
+                        help='directory of <benchmark>.txt transcripts overriding the built-in ones')
+    parser.add_argument('--flash_time', type=float, default=0.,
+                        help='seconds sim-openocd.py takes to flash a binary (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.,
+                        help='relative standard deviation of the built-in values between runs (default: 0)')
+    args = parser.parse_args()
+
+    boards = [SimulatedBoard(args.link + str(i), args.transcripts, args.flash_time, args.jitter)
+              for i in range(args.count)]
+    print('Run the benchmarks with: --openocd ./sim-openocd.py ' +
+          ' '.join('--board {:s} {:s}'.format(str(board.link), str(board.ocdcfg)) for board in boards), flush=True)
+    # Remove the boards also when terminated
+    signal.signal(signal.SIGTERM, lambda *_: exit(0))
+    threads = [threading.Thread(target=board.serve, daemon=True) for board in boards]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for board in boards:
+            board.close()
+
+
+if __name__ == '__main__':
+    main()
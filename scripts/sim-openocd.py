@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Stand-in for OpenOCD that flashes binaries to boards of sim-board.py.
+
+Accepts the arguments run-benchmarks.py passes to OpenOCD:
+-f <board configuration> -c "program <binary> reset exit"
+"""
+
+import argparse
+import os
+import sys
+from time import sleep
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flash a binary to a simulated board')
+    parser.add_argument('-f', dest='config', required=True,
+                        help='configuration file of a board written by sim-board.py')
+    parser.add_argument('-c', dest='commands', action='append', default=[],
+                        help='OpenOCD command; only "program <binary> ..." is supported')
+    args = parser.parse_args()
+
+    settings = {}
+    with open(args.config) as f:
+        for line in f:
+            if line.startswith('sim_'):
+                key, value = line.split(None, 1)
+                settings[key] = value.strip()
+    if 'sim_control' not in settings:
+        print('Error: {:s} is not a simulated board configuration'.format(args.config), file=sys.stderr)
+        exit(1)
+
+    for command in args.commands:
+        words = command.split()
+        if not words or words[0] != 'program':
+            continue
+        binary = words[1]
+        if not os.path.isfile(binary):
+            print('Error: couldn\'t open {:s}'.format(binary), file=sys.stderr)
+            exit(1)
+        print('** Programming Started **')
+        sleep(float(settings.get('sim_flash_time', 0)))
+        print('** Programming Finished **')
+        print('** Resetting Target **')
+        with open(settings['sim_control'], 'w') as control:
+            control.write(os.path.abspath(binary) + '\n')
+    print('shutdown command invoked')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Minimal 32-bit little-endian ARM ELF files for the tests.
+
+Each code section is given as its name, address, halfwords and function
+symbols; the file gets one loadable segment per section and a symbol table
+of the functions, which is all the scanner and the gadget tools read.
+"""
+
+import struct
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHF_ALLOC_EXECINSTR = 0x6
+STT_FUNC_GLOBAL = (1 << 4) | 2
+
+
+def branch(addr, dest, link=True):
+    """Encode a BL (or B.W) at addr to dest as two halfwords."""
+    offset = dest - (addr + 4)
+    assert offset % 2 == 0 and -(1 << 24) <= offset < (1 << 24)
+    offset &= (1 << 25) - 1
+    s = (offset >> 24) & 1
+    j1 = (1 - ((offset >> 23) & 1)) ^ s
+    j2 = (1 - ((offset >> 22) & 1)) ^ s
+    return [0xf000 | (s << 10) | ((offset >> 12) & 0x3ff),
+            (0xd000 if link else 0x9000) | (j1 << 13) | (j2 << 11) | ((offset >> 1) & 0x7ff)]
+
+
+def word(value):
+    """Split a 32-bit literal into halfwords in memory order."""
+    return [value & 0xffff, value >> 16]
+
+
+def write_elf(path, sections):
+    """Write an ELF file of sections, a list of (name, address, halfwords,
+    functions) tuples where functions are (name, address, size) tuples."""
+    names = [section[0] for section in sections] + ['.symtab', '.strtab', '.shstrtab']
+    shstrtab = b'\0'
+    name_offsets = {}
+    for name in names:
+        name_offsets[name] = len(shstrtab)
+        shstrtab += name.encode() + b'\0'
+
+    headers_size = 52 + 32 * len(sections)
+    data = b''
+    layout = []
+    for name, addr, hws, _ in sections:
+        blob = struct.pack('<{:d}H'.format(len(hws)), *hws)
+        layout.append((name, addr, headers_size + len(data), len(blob)))
+        data += blob + b'\0' * (-len(blob) % 4)
+
+    strtab = b'\0'
+    symbols = [struct.pack('<IIIBBH', 0, 0, 0, 0, 0, 0)]
+    for index, (_, _, _, functions) in enumerate(sections, 1):
+        for name, addr, size in functions:
+            symbols.append(struct.pack('<IIIBBH', len(strtab), addr | 1, size, STT_FUNC_GLOBAL, 0, index))
+            strtab += name.encode() + b'\0'
+    symtab = b''.join(symbols)
+    symtab_offset = headers_size + len(data)
+    data += symtab
+    strtab_offset = headers_size + len(data)
+    data += strtab
+    shstrtab_offset = headers_size + len(data)
+    data += shstrtab + b'\0' * (-(len(data) + len(shstrtab)) % 4)
+
+    section_headers = [b'\0' * 40]
+    for name, addr, offset, size in layout:
+        section_headers.append(struct.pack('<10I', name_offsets[name], SHT_PROGBITS, SHF_ALLOC_EXECINSTR, addr,
+                                           offset, size, 0, 0, 2, 0))
+    section_headers.append(struct.pack('<10I', name_offsets['.symtab'], SHT_SYMTAB, 0, 0, symtab_offset,
+                                       len(symtab), len(sections) + 2, 1, 4, 16))
+    section_headers.append(struct.pack('<10I', name_offsets['.strtab'], SHT_STRTAB, 0, 0, strtab_offset,
+                                       len(strtab), 0, 0, 1, 0))
+    section_headers.append(struct.pack('<10I', name_offsets['.shstrtab'], SHT_STRTAB, 0, 0, shstrtab_offset,
+                                       len(shstrtab), 0, 0, 1, 0))
+
+    entry = sections[0][1] | 1
+    elf_header = b'\x7fELF' + bytes([1, 1, 1, 0]) + b'\0' * 8
+    elf_header += struct.pack('<HHIIIIIHHHHHH', 2, 40, 1, entry, 52, headers_size + len(data), 0x05000200, 52,
+                              32, len(sections), 40, len(section_headers), len(section_headers) - 1)
+    program_headers = b''.join(struct.pack('<8I', 1, offset, addr, addr, size, size, 5, 2)
+                               for _, addr, offset, size in layout)
+    with open(path, 'wb') as f:
+        f.write(elf_header + program_headers + data + b''.join(section_headers))
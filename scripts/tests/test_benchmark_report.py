@@ -0,0 +1,102 @@
+import csv
+import io
+import json
+
+import pytest
+
+from kage_tools.benchmark_report import (GeometricMean, Overhead, ResultKey, geometric_means, overheads, result_rows,
+                                         write_csv, write_json)
+from kage_tools.benchmark_stats import Samples
+
+# (program, config, name) -> (ResultKey, samples)
+RESULTS = {
+    ('microbenchmark', 'baseline', 'FreeRTOS: create'): (ResultKey('baseline', 'queue', 'create'), [100]),
+    ('microbenchmark', 'baseline', 'FreeRTOS: send'): (ResultKey('baseline', 'queue', 'send'), [100, 100, 100]),
+    ('microbenchmark', 'baseline_mpu', 'FreeRTOS MPU: create'): (ResultKey('mpu', 'queue', 'create'), [200]),
+    ('microbenchmark', 'kage', 'Kage: create'): (ResultKey('kage', 'queue', 'create'), [200, 190, 210]),
+    ('microbenchmark', 'kage', 'Kage: send'): (ResultKey('kage', 'queue', 'send'), [800]),
+    ('microbenchmark', 'kage', 'Kage no silhouette: create'):
+        (ResultKey('kage-no-silhouette', 'queue', 'create'), [150]),
+    ('coremark', 'baseline', 'FreeRTOS: coremark'): (ResultKey('baseline', 'coremark', 'coremark'), [50.]),
+    ('coremark', 'kage', 'Kage: coremark'): (ResultKey('kage', 'coremark', 'coremark'), [40.]),
+}
+SIZES = {('microbenchmark', 'kage', 'Kage: create'): {'trusted': 1000, 'untrusted': 500}}
+
+
+@pytest.fixture
+def rows():
+    perf_dict, size_dict, key_dict, board_dict = {}, {}, {}, {}
+    for (program, config, name), (key, samples) in RESULTS.items():
+        perf_dict.setdefault(program, {}).setdefault(config, {})[name] = Samples(samples)
+        key_dict.setdefault(program, {}).setdefault(config, {})[name] = key
+        board_dict.setdefault(program, {}).setdefault(config, {})[name] = 'board0'
+    for (program, config, name), sizes in SIZES.items():
+        size_dict.setdefault(program, {}).setdefault(config, {})[name] = sizes
+    return result_rows(perf_dict, size_dict, key_dict, board_dict)
+
+
+def test_result_rows(rows):
+    assert len(rows) == len(RESULTS) + 2
+    create = next(row for row in rows if row.variant == 'kage' and row.metric == 'create')
+    assert (create.unit, create.board, create.count, create.median, create.mean) == ('cycles', 'board0', 3, 200, 200)
+    assert create.ci95 is not None
+    coremark = next(row for row in rows if row.variant == 'kage' and row.program == 'coremark')
+    assert (coremark.unit, coremark.count, coremark.ci95) == ('iter/sec', 1, None)
+    sizes = [(row.metric, row.unit, row.median) for row in rows if row.unit == 'bytes']
+    assert sizes == [('trusted-code-size', 'bytes', 1000), ('untrusted-code-size', 'bytes', 500)]
+
+
+def test_overheads_and_geometric_means(rows):
+    result = overheads(rows)
+    assert result == [
+        Overhead('coremark', 'kage', 'baseline', 'coremark', 'coremark', 'iter/sec', 1.25),
+        Overhead('microbenchmark', 'kage', 'baseline', 'queue', 'create', 'cycles', 2.),
+        Overhead('microbenchmark', 'kage', 'mpu', 'queue', 'create', 'cycles', 1.),
+        Overhead('microbenchmark', 'kage', 'baseline', 'queue', 'send', 'cycles', 8.),
+        Overhead('microbenchmark', 'kage-no-silhouette', 'baseline', 'queue', 'create', 'cycles', 1.5),
+        Overhead('microbenchmark', 'kage-no-silhouette', 'mpu', 'queue', 'create', 'cycles', .75),
+    ]
+    means = geometric_means(result)
+    assert [mean[:4] for mean in means] == [
+        ('coremark', 'kage', 'baseline', 1),
+        ('microbenchmark', 'kage', 'baseline', 2),
+        ('microbenchmark', 'kage', 'mpu', 1),
+        ('microbenchmark', 'kage-no-silhouette', 'baseline', 1),
+        ('microbenchmark', 'kage-no-silhouette', 'mpu', 1),
+    ]
+    assert [mean.ratio for mean in means] == pytest.approx([1.25, 4., 1., 1.5, .75])
+
+
+def test_missing_or_zero_reference():
+    perf_dict = {'microbenchmark': {'kage': {'k': Samples([200])}, 'baseline': {'b': Samples([0])}}}
+    key_dict = {'microbenchmark': {'kage': {'k': ResultKey('kage', 'queue', 'create')},
+                                   'baseline': {'b': ResultKey('baseline', 'queue', 'create')}}}
+    rows = result_rows(perf_dict, {}, key_dict, {'microbenchmark': {'kage': {}, 'baseline': {}}})
+    # No ratio to a zero result, and none to the missing MPU result
+    assert overheads(rows) == []
+    assert geometric_means([]) == []
+
+
+def test_write_json(rows):
+    result = overheads(rows)
+    means = geometric_means(result)
+    file = io.StringIO()
+    write_json(file, rows, result, means)
+    data = json.loads(file.getvalue())
+    assert len(data['results']) == len(rows)
+    assert data['results'][0]['samples'] == list(rows[0].samples)
+    assert [Overhead(**overhead) for overhead in data['overheads']] == result
+    assert [GeometricMean(**mean) for mean in data['geometric_means']] == means
+
+
+def test_write_csv(rows):
+    result = overheads(rows)
+    means = geometric_means(result)
+    file = io.StringIO()
+    write_csv(file, rows, result, means)
+    table = list(csv.DictReader(io.StringIO(file.getvalue())))
+    assert [line['table'] for line in table] == (['result'] * len(rows) + ['overhead'] * len(result) +
+                                                 ['geometric mean'] * len(means))
+    mean = table[-4]
+    assert (mean['variant'], mean['reference'], mean['benchmark'], mean['count']) == ('kage', 'baseline', '*', '2')
+    assert float(mean['ratio']) == pytest.approx(4.)
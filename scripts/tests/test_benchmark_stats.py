@@ -0,0 +1,104 @@
+import math
+
+import pytest
+
+from kage_tools.benchmark_report import MetricKey
+from kage_tools.benchmark_stats import Samples, significantly_different
+from kage_tools.results_store import Measurement, compare
+
+
+def test_summary():
+    samples = Samples([10, 12, 14])
+    summary = samples.summary()
+    assert (summary.count, summary.median, summary.mean, summary.std) == (3, 12., 12., 2.)
+    # t(0.975, 2) * 2 / sqrt(3)
+    assert summary.ci == pytest.approx(4.303 * 2 / 3 ** .5)
+    assert Samples([7]).summary().ci == math.inf
+    assert Samples().summary().count == 0
+
+
+def test_integers_turn_into_doubles():
+    samples = Samples([1, 2])
+    samples.append(2.5)
+    assert list(samples) == [1., 2., 2.5]
+    assert samples.array().dtype.kind == 'f'
+
+
+def test_reject_outliers():
+    samples = Samples([100, 101, 99, 100, 102, 98, 500])
+    assert samples.reject_outliers() == 1
+    assert sorted(samples) == [98, 99, 100, 100, 101, 102]
+    assert samples.rejected == [500]
+    # The rejected sample still counts, so nothing more is trimmed
+    assert samples.reject_outliers() == 0
+    assert len(samples) == 6
+
+
+def test_too_few_samples_for_outliers():
+    samples = Samples([100, 101, 99, 500])
+    assert samples.reject_outliers() == 0
+    assert len(samples) == 4
+
+
+def test_outliers_among_equal_samples():
+    # The median absolute deviation is 0; the mean absolute deviation is not
+    samples = Samples([100] * 6 + [300])
+    assert samples.reject_outliers() == 1
+    assert list(samples) == [100] * 6
+
+    samples = Samples([100] * 7)
+    assert samples.reject_outliers() == 0
+    assert len(samples) == 7
+
+
+def test_rejected_samples_return_once_typical():
+    samples = Samples([10] * 5 + [20])
+    assert samples.reject_outliers() == 1
+    samples.extend([20] * 5)
+    assert samples.reject_outliers() == 0
+    assert samples.rejected == []
+    assert sorted(samples) == [10] * 5 + [20] * 6
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    # Too few samples for a t-test
+    ([100], [200, 201], None),
+    ([100, 101], [], None),
+    # Without variance, any difference is significant
+    ([100, 100, 100], [100, 100], False),
+    ([100, 100, 100], [101, 101], True),
+    # Clearly separated
+    ([100, 102, 98, 101, 99], [110, 112, 108, 111, 109], True),
+    # Within the noise
+    ([100, 105, 95, 103, 97], [101, 106, 96, 99, 98], False),
+    # A small difference, but many precise samples of it
+    ([100, 101] * 20, [101, 102] * 20, True),
+    # The same difference with few samples
+    ([100, 101], [101, 102], False),
+])
+def test_significantly_different(a, b, expected):
+    assert significantly_different(Samples(a), Samples(b)) is expected
+    assert significantly_different(Samples(b), Samples(a)) is expected
+
+
+def test_compare_reports_significant_regressions():
+    def key(metric, unit):
+        return MetricKey('freertos', 'kage', 'kage', 'queue', metric, unit)
+
+    def measurements(cycles, rate, size):
+        return {key('create', 'cycles'): Measurement('board', Samples(cycles)),
+                key('coremark', 'iter/sec'): Measurement('board', Samples(rate)),
+                key('size', 'bytes'): Measurement('board', Samples([size]))}
+
+    baseline = measurements([100, 101, 99, 100], [50., 50.5, 49.5], 1000)
+    # Slower and more code, but the rate only dropped within the noise
+    changes = compare(baseline, measurements([110, 111, 109, 110], [49.5, 50.5, 50.], 1004))
+    assert {change.key.metric: (change.significant, change.regression) for change in changes} == {
+        'create': (True, True),
+        'coremark': (False, False),
+        'size': (None, True),
+    }
+    # A lower rate is worse, a higher one is not
+    for rate, regression in [([40., 41., 40.5], True), ([60., 61., 60.5], False)]:
+        changes = compare(baseline, measurements([100], rate, 1000))
+        assert [change.regression for change in changes if change.key.metric == 'coremark'] == [regression]
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from kage_tools.benchmark_parsers import ResultParser
+from kage_tools.boards import TRANSCRIPTS, BenchmarkError, ReplayBoard, load_transcript
+
+
+def texts(lines):
+    return [line.partition(' ')[2] for line in lines]
+
+
+@pytest.mark.parametrize('benchmark', sorted(TRANSCRIPTS))
+def test_transcripts_are_parsed(benchmark):
+    name = 'kage-' + benchmark
+    parser = ResultParser(name, 'Kage: ' + benchmark, 1234)
+    done = [parser.feed(text + '\r\n') for text in texts(load_transcript(None, name))]
+    # The run is complete with the last line, not earlier
+    assert done == [False] * (len(done) - 1) + [True]
+    metrics, sizes = parser.result_names()
+    assert set(parser.perf) == set(metrics)
+    assert parser.sizes == dict.fromkeys(sizes, 1234)
+
+
+def test_transcript_values():
+    lines = load_transcript(None, 'kage-queue')
+    assert load_transcript(None, 'kage-queue') == lines
+    assert load_transcript(None, 'baseline-queue') != lines
+    assert all(line.startswith('0.1 ') for line in lines)
+
+    jittered = [load_transcript(None, 'kage-queue', 0.1) for _ in range(5)]
+    assert all(len(other) == len(lines) for other in jittered)
+    assert len(set(map(tuple, jittered))) > 1
+
+    assert load_transcript(None, 'kage-unknown') == []
+
+
+def test_transcript_directory_overrides(tmp_path):
+    (tmp_path / 'queue.txt').write_text('0 Creating queue: 7\n0 Received unsigned 9 from queue: 8\n')
+    assert texts(load_transcript(tmp_path, 'kage-queue')) == ['Creating queue: 7', 'Received unsigned 9 from queue: 8']
+    # Other benchmarks keep their built-in transcripts
+    assert load_transcript(tmp_path, 'kage-coremark') == load_transcript(None, 'kage-coremark')
+
+
+async def replay(board, binary):
+    reader = await board.connect()
+    try:
+        log = []
+        await board.flash(binary, lambda text, end: log.append(text))
+        lines = []
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            if not line:
+                return lines, log
+            lines.append(line.decode())
+    finally:
+        board.disconnect()
+
+
+@pytest.mark.parametrize('speed', [0, 100.])
+def test_replay_board(tmp_path, speed):
+    binary = tmp_path / 'kage-secure-api.elf'
+    binary.write_bytes(b'')
+    lines, log = asyncio.run(replay(ReplayBoard('replay0', speed=speed), binary))
+    assert lines == [text + '\r\n' for text in texts(load_transcript(None, 'kage-secure-api'))]
+    assert log == ['Replaying kage-secure-api on replay0\n']
+
+
+def test_replay_board_ends_with_an_incomplete_transcript(tmp_path):
+    # The parser is not done, but the output ends instead of timing out
+    (tmp_path / 'queue.txt').write_text('0 Creating queue: 7\n')
+    binary = tmp_path / 'kage-queue.elf'
+    binary.write_bytes(b'')
+    lines, _ = asyncio.run(replay(ReplayBoard('replay0', tmp_path, speed=0), binary))
+    parser = ResultParser(binary.stem, 'Kage: queue', None)
+    assert [parser.feed(line) for line in lines] == [False]
+
+
+def test_replay_board_needs_the_binary(tmp_path):
+    with pytest.raises(BenchmarkError):
+        asyncio.run(replay(ReplayBoard('replay0', speed=0), tmp_path / 'kage-queue.elf'))
+
+
+def test_missing_code_size_is_not_recorded():
+    parser = ResultParser('kage-queue', 'Kage: queue', None)
+    for text in texts(load_transcript(None, 'kage-queue')):
+        parser.feed(text)
+    assert parser.perf and parser.done
+    assert parser.sizes == {}
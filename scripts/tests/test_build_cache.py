@@ -0,0 +1,74 @@
+import os
+
+from kage_tools.build_cache import BuildCache, fingerprint_toolchain, hash_file, hash_sources
+
+PERF = {'Kage: queue create': [1234.]}
+SIZES = {'Kage: queue': {'trusted': 1000, 'untrusted': 500}}
+
+
+def test_results_are_reused_until_the_binary_changes(tmp_path):
+    binary = tmp_path / 'kage-queue.elf'
+    binary.write_bytes(b'\x7fELF one')
+    cache = BuildCache(str(tmp_path / 'cache' / 'benchmarks.db'))
+    assert cache.results(str(binary), hash_file(binary)) is None
+
+    cache.record_results(str(binary), hash_file(binary), PERF, SIZES)
+    assert cache.results(str(binary), hash_file(binary)) == (PERF, SIZES)
+    # Another binary with the same contents was not measured
+    assert cache.results(str(tmp_path / 'kage-copy.elf'), hash_file(binary)) is None
+    cache.close()
+
+    # The results persist, but only for the binary they were measured on
+    cache = BuildCache(str(tmp_path / 'cache' / 'benchmarks.db'))
+    assert cache.results(str(binary), hash_file(binary)) == (PERF, SIZES)
+    binary.write_bytes(b'\x7fELF two')
+    assert cache.results(str(binary), hash_file(binary)) is None
+    cache.record_results(str(binary), hash_file(binary), {}, {})
+    assert cache.results(str(binary), hash_file(binary)) == ({}, {})
+    cache.close()
+
+
+def test_builds_are_reused_until_the_sources_change(tmp_path):
+    project = tmp_path / 'project'
+    (project / 'src').mkdir(parents=True)
+    (project / 'Debug').mkdir()
+    (project / 'src' / 'main.c').write_text('int main(void) { return 0; }\n')
+    (project / 'STM32L475.ld').write_text('MEMORY {}\n')
+    (project / '.cproject').write_text('<cproject/>\n')
+    cache = BuildCache(str(tmp_path / 'benchmarks.db'))
+    source_hash = hash_sources(project, [project / 'Debug'])
+    assert not cache.is_built(str(project), source_hash)
+    cache.record_build(str(project), source_hash)
+    assert cache.is_built(str(project), source_hash)
+
+    # Build outputs, excluded directories and other files do not matter
+    (project / 'Debug' / 'main.c').write_text('generated\n')
+    (project / 'src' / 'main.o').write_bytes(b'\0')
+    (project / 'notes.txt').write_text('notes\n')
+    assert hash_sources(project, [project / 'Debug']) == source_hash
+
+    for name in ['src/main.c', 'STM32L475.ld', '.cproject']:
+        path = project / name
+        original = path.read_text()
+        path.write_text(original + ' ')
+        assert not cache.is_built(str(project), hash_sources(project, [project / 'Debug']))
+        path.write_text(original)
+        assert cache.is_built(str(project), hash_sources(project, [project / 'Debug']))
+    # A renamed source file changes the hash as well
+    os.rename(project / 'src' / 'main.c', project / 'src' / 'app.c')
+    assert hash_sources(project, [project / 'Debug']) != source_hash
+    cache.close()
+
+
+def test_toolchain_fingerprint(tmp_path):
+    toolchain = tmp_path / 'llvm'
+    (toolchain / 'bin').mkdir(parents=True)
+    clang = toolchain / 'bin' / 'clang'
+    clang.write_bytes(b'clang')
+    fingerprint = fingerprint_toolchain([toolchain])
+    assert fingerprint_toolchain([str(toolchain)]) == fingerprint
+    assert fingerprint_toolchain([toolchain, tmp_path / 'missing']) != fingerprint
+
+    clang.write_bytes(b'clang, rebuilt')
+    assert fingerprint_toolchain([toolchain]) != fingerprint
+    assert fingerprint_toolchain([clang]) != fingerprint_toolchain([toolchain])
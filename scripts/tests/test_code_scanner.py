@@ -0,0 +1,185 @@
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from kage_tools.code_scanner import CodeScanner, ScanError, scan_batch
+from kage_tools.scan_report import format_text
+
+from .elf_builder import branch, word, write_elf
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+
+PRIV = 0x08000000
+SYSCALLS = 0x08008000
+TEXT = 0x08010000
+
+PRIVILEGED_FUNCTIONS = ['vTaskDelay', 'vPortEnterCritical', 'prvSecret', 'xPortRaisePrivilege', 'prvHidden']
+
+# Special registers the scanner reported before it learned about BASEPRI
+BASELINE_SYSM = {0x8: 'MSP', 0x9: 'PSP', 0x10: 'PRIMASK', 0x13: 'FAULTMASK', 0x14: 'CONTROL'}
+
+
+def random_binary(path, seed, size=6000):
+    """Write a binary of random code with CPS, MSR, CFI labels and calls into
+    privileged functions mixed in."""
+    rnd = random.Random(seed)
+    priv = []
+    priv_functions = []
+    for name in PRIVILEGED_FUNCTIONS:
+        body = [rnd.randrange(0, 0xe800) for _ in range(rnd.randrange(8, 40))] + [0x4770]
+        priv_functions.append((name, PRIV + 2 * len(priv), 2 * len(body)))
+        priv += body
+
+    text = []
+    functions = []
+    while len(text) < size:
+        start = TEXT + 2 * len(text)
+        body = []
+        for _ in range(rnd.randrange(10, 200)):
+            addr = start + 2 * len(body)
+            r = rnd.random()
+            if r < 0.25:
+                body += [rnd.randrange(0xe800, 0x10000), 0xb672 if rnd.random() < .05 else rnd.randrange(0, 0x10000)]
+            elif r < 0.27:
+                body += branch(addr, rnd.choice(priv_functions)[1], rnd.random() < .7)
+            elif r < 0.28:
+                body += [0xb672 if rnd.random() < .5 else 0xb662]
+            elif r < 0.29:
+                body += [0xf380, 0x8800 | rnd.choice([0x3, 0x8, 0x9, 0x10, 0x13, 0x14])]
+            elif r < 0.30:
+                body += [0xf871, 0xf870]
+            elif r < 0.32 and functions:
+                body += branch(addr, rnd.choice(functions)[1])
+            else:
+                body += [rnd.randrange(0, 0xe800)]
+        body.append(0x4770)
+        functions.append(('func{:d}'.format(len(functions)), start, 2 * len(body)))
+        text += body
+
+    write_elf(path, [('.text', TEXT, text, functions),
+                     ('privileged_functions', PRIV, priv, priv_functions),
+                     ('freertos_system_calls', SYSCALLS, [0xb500, 0xdf02, 0xbd00, 0x4770],
+                      [('MPU_xTaskCreate', SYSCALLS, 8)])])
+    return text, priv_functions
+
+
+def baseline_findings(text, priv_functions, unaligned):
+    """The findings of the original scanner, which walked the section one
+    halfword at a time."""
+    priv_start = PRIV
+    priv_end = max(addr + size for _, addr, size in priv_functions)
+    names = {addr: name for name, addr, _ in priv_functions}
+    lines = []
+
+    def scan_narrow(inst, addr):
+        if (inst & 0xffec) == 0xb660:
+            lines.append('[CS] CPS at 0x{:x}'.format(addr))
+
+    i = 0
+    while i < len(text):
+        inst = text[i]
+        addr = TEXT + 2 * i
+        if inst >> 11 not in (0b11101, 0b11110, 0b11111):
+            scan_narrow(inst, addr)
+            i += 1
+            continue
+        inst2 = text[i + 1]
+        inst = (inst << 16) | inst2
+        i += 2
+        if inst == 0xf871f870:
+            continue
+        if (inst & 0xfff0f300) == 0xf3808000 and inst & 0xff in BASELINE_SYSM:
+            lines.append('[CS] MSR {:s} at 0x{:x}'.format(BASELINE_SYSM[inst & 0xff], addr))
+        elif (inst & 0xf800d000) in (0xf000d000, 0xf0009000):
+            s = (inst >> 26) & 1
+            offset = ((s << 24) | ((1 - (((inst >> 13) & 1) ^ s)) << 23) | ((1 - (((inst >> 11) & 1) ^ s)) << 22) |
+                      (((inst >> 16) & 0x3ff) << 12) | ((inst & 0x7ff) << 1))
+            dest = addr + 4 + (offset & ((1 << 24) - 1)) - (offset & (1 << 24))
+            if priv_start <= dest < priv_end and names[dest] not in CodeScanner.SECURE_APIS:
+                opcode = 'BL' if (inst & 0xf800d000) == 0xf000d000 else 'B'
+                lines.append('[CS] {:s} {:s} at 0x{:x}'.format(opcode, names[dest], addr))
+        if unaligned:
+            scan_narrow(inst2, addr + 2)
+    return lines
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('unaligned', [False, True])
+def test_same_findings_as_baseline(tmp_path, seed, unaligned):
+    binary = tmp_path / 'random.elf'
+    text, priv_functions = random_binary(binary, seed)
+    scanner = CodeScanner(str(binary), {'.text'}, unaligned)
+    # Compare the classes the original scanner knew about
+    findings = [format_text(violation) for violation in scanner.violations()
+                if violation.kind in ('CPS', 'MSR', 'BRANCH') and violation.target not in ('BASEPRI', 'BASEPRI_MAX')]
+    expected = baseline_findings(text, priv_functions, unaligned)
+    assert len(expected) > 10
+    assert findings == expected
+
+
+def test_violation_records(tmp_path):
+    binary = tmp_path / 'small.elf'
+    text = [0xbf00, 0xb672] + branch(TEXT + 4, PRIV) + branch(TEXT + 8, PRIV + 4) + [0x4770]
+    write_elf(binary, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))]),
+                       ('privileged_functions', PRIV, [0xbf00, 0x4770, 0xbf00, 0x4770],
+                        [('prvSecret', PRIV, 4), ('vTaskDelay', PRIV + 4, 4)])])
+    violations = list(CodeScanner(str(binary), {'.text'}, False).violations())
+    assert [(v.address, v.function, v.kind, v.instruction, v.target) for v in violations] == [
+        (TEXT + 2, 'main', 'CPS', 'CPS', None),
+        (TEXT + 4, 'main', 'BRANCH', 'BL', 'prvSecret'),
+    ]
+
+
+def test_unscannable_binaries_raise_scan_error(tmp_path):
+    binary = tmp_path / 'unprivileged.elf'
+    write_elf(binary, [('.text', TEXT, [0xbf00, 0x4770], [('main', TEXT, 4)])])
+    with pytest.raises(ScanError, match='privileged_functions'):
+        CodeScanner(str(binary), {'.text'}, False)
+
+    # A 32-bit instruction prefix at the end of the section
+    binary = tmp_path / 'truncated.elf'
+    write_elf(binary, [('.text', TEXT, [0xbf00, 0xf000], [('main', TEXT, 4)]),
+                       ('privileged_functions', PRIV, [0x4770], [('prvSecret', PRIV, 2)])])
+    with pytest.raises(ScanError, match='Truncated.*: .text'):
+        list(CodeScanner(str(binary), {'.text'}, False).violations())
+
+
+def test_code_scanner_reports_unreadable_binaries(tmp_path):
+    empty = tmp_path / 'empty.elf'
+    empty.write_bytes(b'')
+    truncated = tmp_path / 'truncated.elf'
+    write_elf(truncated, [('.text', TEXT, [0xbf00, 0xf000], [('main', TEXT, 4)]),
+                          ('privileged_functions', PRIV, [0x4770], [('prvSecret', PRIV, 2)])])
+    for binary in [empty, tmp_path / 'missing.elf', truncated]:
+        # Without asserts, too
+        process = subprocess.run([sys.executable, '-O', str(SCRIPTS / 'code-scanner.py'), str(binary)],
+                                 capture_output=True, universal_newlines=True)
+        assert process.returncode == 1
+        assert process.stdout == ''
+        assert process.stderr.startswith('[CS] ERROR: ')
+
+    process = subprocess.run([sys.executable, '-O', str(SCRIPTS / 'code-scanner.py'), '-j', '2', str(truncated)],
+                             capture_output=True, universal_newlines=True)
+    assert process.returncode == 1
+    assert 'ERROR: Truncated Thumb-2 instruction: .text' in process.stdout
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_literal_loads_do_not_straddle_chunks(tmp_path, cache):
+    # ldr r0, [pc, #4]; str r1, [r0]; bx lr; nop; .word MPU_RBAR, twice
+    function = [0x4801, 0x6001, 0x4770, 0xbf00] + word(0xe000ed9c)
+    text = [0xbf00, 0x4770] + function + function
+    binary = tmp_path / 'literal.elf'
+    write_elf(binary, [('.text', TEXT, text, [('main', TEXT, 4), ('first', TEXT + 4, 12), ('second', TEXT + 16, 12)]),
+                       ('privileged_functions', PRIV, [0x4770], [('prvSecret', PRIV, 2)])])
+    expected = list(CodeScanner(str(binary), {'.text'}, False).violations())
+    assert [(v.address, v.kind) for v in expected] == [(TEXT + 6, 'SCS_STORE'), (TEXT + 18, 'SCS_STORE')]
+
+    cache = str(tmp_path / 'cache.db') if cache else None
+    for chunk_size in [2, 4, 12, 1 << 20]:
+        violations, error = scan_batch([str(binary)], {'.text'}, False, cache, 2, chunk_size)[str(binary)]
+        assert error is None
+        assert violations == expected
@@ -0,0 +1,78 @@
+from kage_tools.code_size import FunctionSize, Growth, analyze, analyze_all, format_growth, growth
+
+from .elf_builder import write_elf
+
+TEXT = 0x08010000
+
+
+def test_section_ending_in_a_prefix(tmp_path):
+    # A literal whose upper halfword looks like the start of a BL
+    label = [0xf871, 0xf870]
+    text = label + [0xbf00, 0x4770, 0xbf00, 0xf7ff]
+    binary = tmp_path / 'truncated.elf'
+    write_elf(binary, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))])])
+    size = analyze(binary)
+    assert size.sections == {'.text': 12}
+    assert size.cfi_bytes() == 4
+
+
+PRIV = 0x08000000
+SYSCALLS = 0x08008000
+LABEL = [0xf871, 0xf870]
+NOP = 0xbf00
+BX_LR = 0x4770
+
+
+def kage_binary(path):
+    main = LABEL + [NOP, BX_LR]
+    helper = LABEL + LABEL + [BX_LR, NOP]
+    local = LABEL + [BX_LR]
+    other_local = [BX_LR, NOP]
+    # A label outside of all functions
+    text = main + helper + local + other_local + LABEL
+    functions = [('main', TEXT, 8), ('helper', TEXT + 8, 12), ('local', TEXT + 20, 6), ('local', TEXT + 26, 4)]
+    write_elf(path, [('privileged_functions', PRIV, [NOP, BX_LR], [('vTaskDelay', PRIV, 4)]),
+                     ('freertos_system_calls', SYSCALLS, [0xdf00, BX_LR], [('MPU_xTaskCreate', SYSCALLS, 4)]),
+                     ('.text', TEXT, text, functions)])
+
+
+def baseline_binary(path):
+    text = [NOP, BX_LR] + [NOP, NOP, BX_LR, NOP] + [NOP, BX_LR]
+    write_elf(path, [('.text', TEXT, text, [('main', TEXT, 4), ('helper', TEXT + 4, 8),
+                                            ('vTaskDelay', TEXT + 12, 4)])])
+
+
+def test_sections_and_functions(tmp_path):
+    kage_binary(tmp_path / 'kage.elf')
+    size = analyze(tmp_path / 'kage.elf')
+    assert size.sections == {'privileged_functions': 4, 'freertos_system_calls': 4, '.text': 34}
+    assert size.functions == {
+        'vTaskDelay': FunctionSize('privileged_functions', 4, 0),
+        'MPU_xTaskCreate': FunctionSize('freertos_system_calls', 4, 0),
+        'main': FunctionSize('.text', 8, 4),
+        'helper': FunctionSize('.text', 12, 8),
+        # Local functions of the same name add up
+        'local': FunctionSize('.text', 10, 4),
+    }
+    assert size.total() == 42
+    assert size.cfi_bytes() == 16
+    assert size.unattributed() == {'privileged_functions': 0, 'freertos_system_calls': 0, '.text': 4}
+    assert size.split(False) == {'trusted': 4, 'untrusted': 38}
+    assert size.split(True) == {'trusted': 42, 'untrusted': 0}
+
+
+def test_growth(tmp_path):
+    kage_binary(tmp_path / 'kage.elf')
+    baseline_binary(tmp_path / 'baseline.elf')
+    sizes = analyze_all([tmp_path / 'kage.elf', tmp_path / 'baseline.elf'], 2)
+    changes = growth(sizes[tmp_path / 'baseline.elf'], sizes[tmp_path / 'kage.elf'])
+    assert changes == [
+        Growth('local', '.text', 0, 10, 10, 4),
+        Growth('MPU_xTaskCreate', 'freertos_system_calls', 0, 4, 4, 0),
+        Growth('helper', '.text', 8, 12, 4, 8),
+        Growth('main', '.text', 4, 8, 4, 4),
+        Growth('vTaskDelay', 'privileged_functions', 4, 4, 0, 0),
+    ]
+    lines = format_growth(changes, 2).splitlines()
+    assert len(lines) == 3
+    assert lines[1].split() == ['local', '.text', '0', '10', '+10', '+4']
@@ -0,0 +1,82 @@
+import json
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from kage_tools.client import DaemonClient, DaemonError
+from kage_tools.daemon import AnalysisDaemon
+
+from .test_code_scanner import SCRIPTS, random_binary
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """Serve requests on a socket in tmp_path from a thread; yields the daemon."""
+    daemon = AnalysisDaemon(str(tmp_path / 'daemon.sock'))
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+        yield daemon
+    finally:
+        daemon.shutdown()
+        thread.join()
+        daemon.server_close()
+
+
+def request(path, command, **args):
+    """Send a single request on a connection of its own, failing instead of
+    waiting for a daemon that does not answer."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(10)
+        connection.connect(path)
+        with connection.makefile('rw') as file:
+            file.write(json.dumps(dict(args, command=command)) + '\n')
+            file.flush()
+            return json.loads(file.readline())
+
+
+def test_idle_connection_does_not_block_others(daemon, tmp_path):
+    binary = tmp_path / 'random.elf'
+    random_binary(binary, 1)
+    with DaemonClient(daemon.server_address) as idle:
+        assert idle.ping()
+        response = request(daemon.server_address, 'scan', paths=[str(binary)])
+        assert response['result'][0]['error'] is None
+        assert response['result'][0]['violations']
+        # The scanner is reused by the other connection
+        [(_, violations, error)] = idle.scan([str(binary)])
+        assert error is None and len(violations) == len(response['result'][0]['violations'])
+
+
+def test_failing_request_is_answered(daemon, tmp_path, monkeypatch, capsys):
+    def fail(*args):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(daemon.state, 'scan', fail)
+    with DaemonClient(daemon.server_address) as client:
+        with pytest.raises(DaemonError, match='RuntimeError: broken'):
+            client.scan([str(tmp_path)])
+        # The connection is still served
+        assert client.ping()
+    assert 'RuntimeError: broken' in capsys.readouterr().err
+
+    assert request(daemon.server_address, 'unknown') == {'error': 'ValueError: Unknown command: unknown'}
+
+
+def test_shutdown_request(tmp_path):
+    path = tmp_path / 'daemon.sock'
+    process = subprocess.Popen([sys.executable, '-m', 'kage_tools.daemon', '--socket', str(path)],
+                               cwd=str(SCRIPTS), stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        assert process.stdout.readline() == 'Listening on {:s}\n'.format(str(path))
+        with DaemonClient(str(path)) as idle:
+            idle.ping()
+            assert request(str(path), 'shutdown') == {'result': None}
+            assert process.wait(10) == 0
+    finally:
+        process.kill()
+        process.wait()
+    assert not path.exists()
@@ -0,0 +1,47 @@
+import pytest
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+
+from kage_tools.elf_access import MappedELF
+
+from .elf_builder import branch, write_elf
+from .test_code_scanner import PRIV, TEXT, random_binary
+
+
+def test_section_data_matches_pyelftools(tmp_path):
+    path = tmp_path / 'random.elf'
+    random_binary(path, 1)
+    with open(path, 'rb') as file, MappedELF(str(path)) as elf:
+        reference = ELFFile(file)
+        for section in reference.iter_sections():
+            if not section.name:
+                continue
+            assert bytes(elf.section_data(section.name)) == section.data(), section.name
+            assert elf.section_size(section.name) == section.data_size
+        assert elf.section_data('.data') is None
+        assert elf.section_size('.data') == 0
+        assert elf.executable_sections() == [section.name for section in reference.iter_sections()
+                                             if section.header['sh_flags'] & 0x4]
+
+
+def test_functions_and_segments(tmp_path):
+    path = tmp_path / 'small.elf'
+    text = [0xbf00] + branch(TEXT + 2, PRIV) + [0x4770]
+    write_elf(path, [('.text', TEXT, text, [('main', TEXT, 8)]),
+                     ('privileged_functions', PRIV, [0xbf00, 0x4770], [('prvSecret', PRIV, 4)])])
+    with MappedELF(str(path)) as elf:
+        # The Thumb bit is cleared
+        assert list(elf.functions()) == [(TEXT, 8, 'main', 1), (PRIV, 4, 'prvSecret', 2)]
+        assert elf.section_name(1) == '.text'
+        assert elf.section_name(0) is None
+        assert elf.section_bounds('.text') == (TEXT, TEXT + 8)
+        assert elf.section_bounds('.data') is None
+        assert [(addr, bytes(data)) for addr, data in elf.executable_segments()] == [
+            (TEXT, bytes(elf.section_data('.text'))), (PRIV, bytes(elf.section_data('privileged_functions')))]
+
+
+def test_empty_binary(tmp_path):
+    path = tmp_path / 'empty.elf'
+    path.write_bytes(b'')
+    with pytest.raises(ELFError):
+        MappedELF(str(path))
@@ -0,0 +1,66 @@
+import pytest
+
+from find_stitchable_gadgets import (BRANCH, OTHER, STITCHABLE, StitchabilityAnalysis, classify, classify_lines,
+                                     main)
+
+# b.w chains ending in a stitchable gadget, in a gadget that is not, outside
+# the gadgets, and running into a cycle
+GADGETS = [
+    '0x1000 : mov r0, r1 ; b.w #0x1010',
+    '0x1010 : adds r0, #1 ; b.w #0x1020',
+    '0x1020 : pop {r4, pc}',
+    '0x2000 : b.w #0x2010',
+    '0x2010 : movs r0, #0 ; nop',
+    '0x3000 : b.w #0x3f00',
+    '0x4000 : b.w #0x4010',
+    '0x4010 : mov r1, r2 ; b.w #0x4020',
+    '0x4020 : b.w #0x4010',
+]
+STITCHABLE_GADGETS = {0x1000, 0x1010, 0x1020}
+
+
+@pytest.mark.parametrize('gadget, expected', [
+    ('mov r0, r1 ; bx lr', (STITCHABLE, None)),
+    ('blx r3', (STITCHABLE, None)),
+    ('pop {r4, pc} ; movs r0, r0 ; b #0x4', (STITCHABLE, None)),
+    ('ldr pc, [sp], #4 ; nop', (STITCHABLE, None)),
+    ('ldmia r0!, {r1, pc} ; nop', (STITCHABLE, None)),
+    ('adds r0, #1 ; b.w #0x8010abc', (BRANCH, 0x8010abc)),
+    ('adds r0, #1 ; b #0x8010abc', (OTHER, None)),
+    ('movs r0, #0 ; nop', (OTHER, None)),
+])
+def test_classify(gadget, expected):
+    assert classify(gadget) == expected
+
+
+def test_classify_lines_skips_headers_and_normalizes():
+    lines = ['Gadgets information\n', '=====\n', '0x08000010 :  pop {r4, pc}\n', '0x08000020 : movs r0, #0;nop\n']
+    assert classify_lines(lines) == [(0x08000010, 'pop {r4, pc}', STITCHABLE, None),
+                                     (0x08000020, 'movs r0, #0 ; nop', OTHER, None)]
+
+
+def test_branch_chains():
+    analysis = StitchabilityAnalysis(classify_lines(GADGETS))
+    assert {addr for addr in analysis.gadgets if analysis.stitchable(addr)} == STITCHABLE_GADGETS
+
+
+@pytest.mark.parametrize('order', [[0x1000, 0x1010], [0x1010, 0x1000], [0x4020, 0x4000], [0x4000, 0x4020]])
+def test_results_do_not_depend_on_query_order(order):
+    # Results of earlier queries are reused by the later ones
+    analysis = StitchabilityAnalysis(classify_lines(GADGETS))
+    assert [analysis.stitchable(addr) for addr in order] == [addr in STITCHABLE_GADGETS for addr in order]
+
+
+def test_self_loop():
+    analysis = StitchabilityAnalysis(classify_lines(['0x5000 : b.w #0x5000']))
+    assert not analysis.stitchable(0x5000)
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+@pytest.mark.parametrize('inverse', [False, True])
+def test_main(tmp_path, capsys, jobs, inverse):
+    gadget_file = tmp_path / 'gadgets.txt'
+    gadget_file.write_text(''.join(line + '\n' for line in GADGETS))
+    main(['-f', str(gadget_file), '-j', jobs] + (['-i'] if inverse else []))
+    assert capsys.readouterr().out.splitlines() == [line for line in GADGETS
+                                                    if (int(line.split(' ')[0], 16) in STITCHABLE_GADGETS) != inverse]
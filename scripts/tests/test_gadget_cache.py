@@ -0,0 +1,103 @@
+import os
+
+from kage_tools import gadget_cache
+from kage_tools.gadget_cache import GadgetCache, elf_functions, elf_return_sites, elf_sections
+
+from .elf_builder import branch, write_elf
+
+TEXT = 0x08010000
+PRIV = 0x08000000
+GADGETS = [(TEXT + 4, 'pop {r4, pc}'), (TEXT + 8, 'mov r0, r1 ; bx lr'), (TEXT + 10, 'bx lr')]
+
+
+def write_binary(path, target):
+    text = [0xbf00] + branch(TEXT + 2, target) + [0x4770]
+    write_elf(path, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))]),
+                     ('privileged_functions', PRIV, [0xbf00, 0x4770], [('prvSecret', PRIV, 4)])])
+
+
+class Computed(object):
+    """Wraps a compute function and counts its calls."""
+
+    def __init__(self, compute):
+        self.compute = compute
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.compute()
+
+
+def test_entries_are_reused(tmp_path):
+    binary = tmp_path / 'kage.elf'
+    write_binary(binary, PRIV)
+    cache = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    compute = Computed(lambda: GADGETS)
+    assert cache.gadgets('gadgets', compute) == GADGETS
+    assert GadgetCache(str(binary), str(tmp_path / 'cache')).gadgets('gadgets', compute) == GADGETS
+    assert compute.calls == 1
+
+    # Cached contents are the same as computed ones
+    cached = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    for _ in range(2):
+        assert elf_functions(str(binary), cached) == elf_functions(str(binary)) == [
+            (TEXT, 8, 'main', '.text'), (PRIV, 4, 'prvSecret', 'privileged_functions')]
+        assert elf_sections(str(binary), cached) == elf_sections(str(binary)) == {
+            '.text': (TEXT, TEXT + 8), 'privileged_functions': (PRIV, PRIV + 4)}
+        assert elf_return_sites(str(binary), cached).tolist() == [TEXT + 6]
+
+
+def test_changed_binary_invalidates_entries(tmp_path):
+    binary = tmp_path / 'kage.elf'
+    write_binary(binary, PRIV)
+    cache = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    assert elf_functions(str(binary), cache)[1][2] == 'prvSecret'
+    compute = Computed(lambda: [TEXT + 6])
+    assert cache.addresses('return-sites', compute).tolist() == [TEXT + 6]
+
+    # Rebuilt in place with other contents, the binary gets a new entry
+    write_elf(binary, [('.text', TEXT, [0xbf00, 0x4770], [('start', TEXT, 4)])])
+    rebuilt = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    assert rebuilt.path != cache.path
+    assert elf_functions(str(binary), rebuilt) == [(TEXT, 4, 'start', '.text')]
+    assert rebuilt.addresses('return-sites', Computed(lambda: [])).tolist() == []
+
+    # The entry of the old contents is still there for a copy of them
+    write_binary(tmp_path / 'copy.elf', PRIV)
+    assert GadgetCache(str(tmp_path / 'copy.elf'), str(tmp_path / 'cache')).path == cache.path
+    assert cache.addresses('return-sites', compute).tolist() == [TEXT + 6]
+    assert compute.calls == 1
+
+
+def test_cache_version_invalidates_entries(tmp_path, monkeypatch):
+    binary = tmp_path / 'kage.elf'
+    write_binary(binary, PRIV)
+    compute = Computed(lambda: GADGETS)
+    GadgetCache(str(binary), str(tmp_path / 'cache')).gadgets('gadgets', compute)
+
+    monkeypatch.setattr(gadget_cache, 'CACHE_VERSION', gadget_cache.CACHE_VERSION + 1)
+    cache = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    assert cache.gadgets('gadgets', Computed(lambda: GADGETS[:1])) == GADGETS[:1]
+    assert cache.gadgets('gadgets', compute) == GADGETS[:1]
+    assert compute.calls == 1
+
+
+def test_unreadable_entries_are_recomputed(tmp_path):
+    binary = tmp_path / 'kage.elf'
+    write_binary(binary, PRIV)
+    cache = GadgetCache(str(binary), str(tmp_path / 'cache'))
+    cache.gadgets('gadgets', lambda: GADGETS)
+    with open(os.path.join(cache.path, 'gadgets.npz'), 'wb') as f:
+        f.write(b'truncated')
+    compute = Computed(lambda: GADGETS)
+    assert cache.gadgets('gadgets', compute) == GADGETS
+    assert compute.calls == 1
+    assert cache.gadgets('gadgets', compute) == GADGETS
+    assert compute.calls == 1
+
+
+def test_return_sites_of_section_ending_in_a_prefix(tmp_path):
+    text = branch(TEXT, TEXT + 0x100) + [0x4798, 0xbf00, 0x4770, 0xf7ff]
+    binary = tmp_path / 'truncated.elf'
+    write_elf(binary, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))])])
+    assert elf_return_sites(str(binary)).tolist() == [TEXT + 4, TEXT + 6]
@@ -0,0 +1,64 @@
+import shutil
+import subprocess
+
+import pytest
+
+from kage_tools import gadget_finder
+from kage_tools.gadget_analysis import analyze_binary
+from kage_tools.gadget_cache import GadgetCache, elf_sections
+from kage_tools.gadget_finder import find_gadgets, find_gadgets_within
+from kage_tools.reachability import run_ropgadget
+
+from .test_code_scanner import random_binary
+
+ENGINES = ['native', pytest.param('ropgadget', marks=pytest.mark.skipif(shutil.which('ROPgadget') is None,
+                                                                         reason='ROPgadget is not installed'))]
+
+
+@pytest.fixture
+def binary(tmp_path):
+    path = tmp_path / 'random.elf'
+    random_binary(path, 1)
+    return str(path)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_gadgets_within_match_range_search(binary, engine):
+    text_range = elf_sections(binary)['.text']
+    gadgets, within = find_gadgets_within(binary, text_range, engine)
+    assert gadgets == list(find_gadgets(binary, engine))
+    assert within == list(find_gadgets(binary, engine, text_range))
+    assert 0 < len(within) < len(gadgets)
+
+
+def test_gadgets_within_are_cached(binary, tmp_path):
+    text_range = elf_sections(binary)['.text']
+    expected = find_gadgets_within(binary, text_range)
+    cache = GadgetCache(binary, str(tmp_path / 'cache'))
+    assert find_gadgets_within(binary, text_range, cache=cache) == expected
+    assert find_gadgets(binary, cache=cache) == expected[0]
+    assert find_gadgets(binary, text_range=text_range, cache=cache) == expected[1]
+
+
+def test_kage_analysis_searches_once(binary, tmp_path, monkeypatch):
+    searches = []
+    search = gadget_finder.GadgetFinder.search
+
+    def counting_search(self, *args):
+        searches.append(args)
+        return search(self, *args)
+
+    monkeypatch.setattr(gadget_finder.GadgetFinder, 'search', counting_search)
+    secure_apis = tmp_path / 'secure_api.conf'
+    secure_apis.write_text('MPU_xTaskCreate\n')
+    analysis = analyze_binary(binary, 'kage', str(secure_apis))
+    assert searches == [()]
+    assert 0 < analysis.reachable < analysis.total
+
+
+@pytest.mark.skipif(shutil.which('ROPgadget') is None, reason='ROPgadget is not installed')
+def test_failing_ropgadget_raises(tmp_path):
+    junk = tmp_path / 'junk.bin'
+    junk.write_bytes(b'not an ELF file\n')
+    with pytest.raises(subprocess.CalledProcessError):
+        list(run_ropgadget(str(junk)))
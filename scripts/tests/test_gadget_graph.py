@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from kage_tools.gadget_graph import BRANCH, CALL, FALLTHROUGH, STITCH, GadgetGraph, transfer
+
+from .elf_builder import branch, write_elf
+
+TEXT = 0x08010000
+
+# (address, end, instructions) in ascending order of address
+GADGETS = [
+    (0x100, 0x104, [('beq', '#0x200'), ('bx', 'lr')]),            # A: branch, stitch
+    (0x104, 0x108, [('b', '#0x200'), ('bx', 'lr')]),              # B: branch only
+    (0x108, 0x10c, [('bl', '#0x300'), ('bx', 'lr')]),             # C: call, stitch
+    (0x10c, 0x110, [('blx', '#0x300'), ('movs', 'r0, #1')]),      # D: call, fallthrough to E
+    (0x110, 0x112, [('pop', '{r4, pc}')]),                        # E: stitch
+    (0x200, 0x202, [('movs', 'r0, #0')]),                         # F: fallthrough to nothing
+    (0x300, 0x302, [('blx', 'r3')]),                              # G: stitch, fallthrough to H
+    (0x302, 0x306, [('str', 'r0, [r1]'), ('bx', 'lr')]),          # H: privileged store, stitch
+]
+A, B, C, D, E, F, G, H = range(len(GADGETS))
+
+
+def graph(entries):
+    texts = [' ; '.join('{:s} {:s}'.format(*insn) for insn in insns) for _, _, insns in GADGETS]
+    return GadgetGraph([gadget[0] for gadget in GADGETS], [gadget[1] for gadget in GADGETS], texts,
+                       [gadget[2] for gadget in GADGETS], [i in entries for i in range(len(GADGETS))])
+
+
+def edges(graph, node):
+    kinds = graph.kinds[graph.indptr[node]:graph.indptr[node + 1]]
+    return sorted(zip(graph.successors(node).tolist(), kinds.tolist()))
+
+
+@pytest.mark.parametrize('mnemonic, op_str, expected', [
+    ('b', '#0x200', (BRANCH, 0x200, False)),
+    ('b.w', '#0x200', (BRANCH, 0x200, False)),
+    ('beq', '#0x200', (BRANCH, 0x200, True)),
+    ('bne.w', '#0x200', (BRANCH, 0x200, True)),
+    ('cbz', 'r0, #0x200', (BRANCH, 0x200, True)),
+    ('bl', '#0x300', (CALL, 0x300, True)),
+    ('blx', '#0x300', (CALL, 0x300, True)),
+    ('bx', 'lr', (STITCH, None, False)),
+    ('bxeq', 'lr', (STITCH, None, True)),
+    ('blx', 'r3', (STITCH, None, True)),
+    ('pop', '{r4, pc}', (STITCH, None, False)),
+    ('ldr', 'pc, [sp], #4', (STITCH, None, False)),
+    ('movs', 'r0, #1', (None, None, True)),
+])
+def test_transfer(mnemonic, op_str, expected):
+    assert transfer(mnemonic, op_str) == expected
+
+
+def test_edges():
+    g = graph({C})
+    assert edges(g, A) == [(F, BRANCH), (g.stitch, STITCH)]
+    # An unconditional branch neither falls through nor reaches the bx lr
+    assert edges(g, B) == [(F, BRANCH)]
+    assert edges(g, C) == [(G, CALL), (g.stitch, STITCH)]
+    assert edges(g, D) == [(E, FALLTHROUGH), (G, CALL)]
+    assert edges(g, F) == []
+    assert edges(g, G) == [(H, FALLTHROUGH), (g.stitch, STITCH)]
+    assert edges(g, g.stitch) == [(C, STITCH)]
+    # Stitch edges: five gadgets into the stitch node, one entry out of it
+    assert g.edge_counts().tolist() == [2, 2, 2, 6]
+    assert g.stores.tolist() == [0, 0, 0, 0, 0, 0, 0, 1]
+
+
+def test_reachability():
+    g = graph({C})
+    hops, parents = g.bfs([C])
+    assert hops[:g.stitch].tolist() == [-1, -1, 0, -1, -1, -1, 1, 2]
+    # The stitch node is passed without taking a hop
+    assert hops[g.stitch] == 0
+    assert g.reachable().tolist() == [C, G, H]
+    assert g.reachable(1).tolist() == [C, G]
+    assert list(g.store_chains()) == [[C, G, H]]
+    assert list(g.store_chains(1)) == []
+    # Depth-first, the stitch node is first reached from H
+    assert list(g.dfs(C)) == [(C, 0), (G, 1), (H, 2), (g.stitch, 2)]
+    assert list(g.dfs(C, max_hops=1)) == [(C, 0), (G, 1), (g.stitch, 0)]
+
+
+def test_conditional_branch_continues():
+    # From the beq, the bx lr reaches the entry E through the stitch node;
+    # from the b, only its target is reached
+    g = graph({E})
+    assert np.flatnonzero(g.bfs([A])[0][:g.stitch] >= 0).tolist() == [A, E, F]
+    assert np.flatnonzero(g.bfs([B])[0][:g.stitch] >= 0).tolist() == [B, F]
+    assert g.reachable().tolist() == [E]
+
+
+def test_from_binary(tmp_path):
+    # beq; bx lr; nop; bx r3; bl; pop {r4, pc}
+    text = [0xd001, 0x4770, 0xbf00, 0x4718] + branch(TEXT + 8, TEXT + 6) + [0xbd10]
+    binary = tmp_path / 'graph.elf'
+    write_elf(binary, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))])])
+    g = GadgetGraph.from_binary(str(binary), kage=False, depth=3)
+    assert [(addr - TEXT, end - TEXT) for addr, end in zip(g.addrs.tolist(), g.ends.tolist())] == [
+        (0, 4), (2, 4), (2, 8), (4, 8), (6, 8), (8, 14), (10, 14), (12, 14)]
+    assert g.texts[0] == 'beq #0x8010006 ; bx lr'
+    assert g.texts[5] == 'bl #0x8010006 ; pop {r4, pc}'
+    # The conditional branch and the call reach the bx r3 and continue
+    assert edges(g, 0) == [(4, BRANCH), (g.stitch, STITCH)]
+    assert edges(g, 5) == [(4, CALL), (g.stitch, STITCH)]
+    # bx lr ; nop ; bx r3 leaves at its first instruction
+    assert edges(g, 2) == [(g.stitch, STITCH)]
+    # The second half of the bl decodes into a 32-bit instruction without
+    # transfers; nothing starts at its end
+    assert edges(g, 6) == []
+    # Every gadget is an entry in FreeRTOS mode: 7 stitchers, 8 entries
+    assert g.edge_counts().tolist() == [1, 1, 0, 15]
+    assert g.reachable().tolist() == list(range(8))
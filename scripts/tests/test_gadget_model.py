@@ -0,0 +1,97 @@
+import re
+
+import pytest
+
+from kage_tools.gadget_model import Instruction, StoreCounter, parse_instruction
+from kage_tools.symbol_index import SymbolIndex
+
+# The regexes run-gadgets.py counted privileged stores with before
+# StoreCounter, applied to ROPgadget's output lines
+BASELINE_STORE = re.compile(' (str[a-su-z]*(lt|gt)?) ')
+BASELINE_STORE_MULTIPLE = re.compile(' stm[a-z]* ')
+BASELINE_PUSH = re.compile(' push[a-z]* ')
+
+
+def baseline_count(text):
+    line = '0x08010000 : {:s}'.format(text)
+    return (len(BASELINE_STORE.findall(line)) + len(BASELINE_STORE_MULTIPLE.findall(line)) +
+            len(BASELINE_PUSH.findall(line)))
+
+
+# Gadgets, and the kinds and targets of their privileged stores
+GADGETS = [
+    ('mov r0, r1 ; bx lr', []),
+    ('str r0, [r1] ; bx lr', [('single', 'arbitrary')]),
+    ('strb r0, [r1, #4] ; strh r2, [sp, #8] ; pop {r4, pc}', [('single', 'arbitrary'), ('single', 'stack')]),
+    ('str r0, [sp, #-4]! ; bx r3', [('single', 'stack')]),
+    ('strd r0, r1, [r2] ; bx lr', [('dual', 'arbitrary')]),
+    ('strex r0, r1, [r2] ; strexd r0, r2, r3, [sp] ; bx lr', [('exclusive', 'arbitrary'), ('dual', 'stack')]),
+    ('stm r0!, {r1, r2} ; stmdb sp!, {r4, lr} ; bx lr', [('multiple', 'arbitrary'), ('multiple', 'stack')]),
+    ('stmia r3, {r0, r1} ; stmea r3, {r0} ; stmfd sp!, {r1} ; bx lr',
+     [('multiple', 'arbitrary'), ('multiple', 'arbitrary'), ('multiple', 'stack')]),
+    ('push {r4, lr} ; blx r3', [('push', 'stack')]),
+    # Conditional stores in IT blocks
+    ('it lt ; strlt r0, [r1] ; bx lr', [('single', 'arbitrary')]),
+    ('ite gt ; strgt r0, [r1] ; strle r0, [sp] ; bx lr', [('single', 'arbitrary'), ('single', 'stack')]),
+    ('it eq ; strheq r0, [r1] ; bx lr', [('single', 'arbitrary')]),
+    # Unprivileged stores, loads and coprocessor stores are not counted
+    ('strt r0, [r1] ; strbt r0, [r1] ; strht r0, [r1] ; bx lr', []),
+    ('ldr r0, [r1] ; ldm r0!, {r1, pc}', []),
+    ('vstr d0, [r1] ; vpush {d8} ; stc p14, c5, [r1] ; bx lr', []),
+]
+
+# 32-bit forms, which the baseline missed
+WIDE_GADGETS = [
+    ('str.w r0, [r1, #0x100] ; bx lr', [('single', 'arbitrary')]),
+    ('strb.w r0, [sp, #0x100] ; bx lr', [('single', 'stack')]),
+    ('stm.w r0, {r1, r2, r3} ; bx lr', [('multiple', 'arbitrary')]),
+    ('push.w {r4, r5, r6, lr} ; bx lr', [('push', 'stack')]),
+]
+
+
+@pytest.mark.parametrize('text, stores', GADGETS)
+def test_counts_match_baseline(text, stores):
+    counter = StoreCounter()
+    assert counter.add(0x08010000, text) == len(stores) == baseline_count(text)
+
+
+@pytest.mark.parametrize('text, stores', GADGETS + WIDE_GADGETS)
+def test_store_kinds_and_targets(text, stores):
+    counter = StoreCounter()
+    counter.add(0x08010000, text)
+    assert sorted(counter.kinds.elements()) == sorted(kind for kind, _ in stores)
+    assert sorted(counter.targets.elements()) == sorted(target for _, target in stores)
+
+
+@pytest.mark.parametrize('text, stores', WIDE_GADGETS)
+def test_wide_stores_are_counted(text, stores):
+    assert baseline_count(text) == 0
+    assert StoreCounter().add(0x08010000, text) == len(stores) == 1
+
+
+def test_totals():
+    symbols = SymbolIndex([(0x08010000, 0x100, 'main', '.text'), (0x08010100, 0x100, 'helper', '.text')])
+    counter = StoreCounter(symbols)
+    for i, (text, _) in enumerate(GADGETS + WIDE_GADGETS):
+        counter.add(0x08010000 + 0x20 * i, text)
+    gadgets = GADGETS + WIDE_GADGETS
+    assert counter.total() == sum(len(stores) for _, stores in gadgets)
+    assert counter.gadgets == sum(1 for _, stores in gadgets if stores)
+    assert counter.unprivileged == 3
+    # Gadgets 0-7 are in main, 8-15 in helper and the others outside
+    assert counter.functions == {'main': sum(len(stores) for _, stores in gadgets[:8]),
+                                 'helper': sum(len(stores) for _, stores in gadgets[8:16]),
+                                 '<unknown>': sum(len(stores) for _, stores in gadgets[16:])}
+    assert counter.as_dict()['total'] == counter.total()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('str r0, [r1, #4]', Instruction('str', None, 'r1', False, ('r0',))),
+    ('strlt r0, [r1], #4', Instruction('str', 'lt', 'r1', True, ('r0',))),
+    ('strd r0, r1, [sp, #-8]!', Instruction('strd', None, 'sp', True, ('r0', 'r1'))),
+    ('strex r0, r1, [r2]', Instruction('strex', None, 'r2', False, ('r1',))),
+    ('stmdb r0!, {r1, r2}', Instruction('stmdb', None, 'r0', True, ('r1', 'r2'))),
+    ('push.w {r4, lr}', Instruction('push', None, 'sp', True, ('r4', 'lr'))),
+])
+def test_parse_instruction(text, expected):
+    assert parse_instruction(text) == expected
@@ -0,0 +1,87 @@
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from kage_tools.gadget_analysis import analyze_binary
+
+from .test_code_scanner import SCRIPTS, random_binary
+
+
+@pytest.fixture
+def builds(tmp_path):
+    """Write two random binaries, a copy of the first and a secure API list."""
+    random_binary(tmp_path / 'one.elf', 1)
+    random_binary(tmp_path / 'two.elf', 2)
+    shutil.copy(tmp_path / 'one.elf', tmp_path / 'copy.elf')
+    (tmp_path / 'secure_api.conf').write_text('MPU_xTaskCreate\n')
+    return tmp_path
+
+
+def run_gadgets(*args):
+    return subprocess.run([sys.executable, str(SCRIPTS / 'run-gadgets.py')] + list(args),
+                          capture_output=True, universal_newlines=True)
+
+
+def table(output):
+    """Parse the rows of the comparison table into {build: (mode, numbers)}."""
+    lines = output.splitlines()
+    assert lines[0].split() == ['build', 'mode', 'total', 'reachable', 'priv', 'stores', '+gadgets', '-gadgets']
+    rows = {}
+    for line in lines[1:]:
+        if line.startswith('+gadgets') or line.startswith('NOTE'):
+            continue
+        name, mode, *numbers = line.split()
+        rows[name] = (mode, [int(number) for number in numbers])
+    return rows
+
+
+def test_compare_builds(builds):
+    manifest = builds / 'manifest.txt'
+    # Paths are relative to the manifest
+    manifest.write_text('# name mode binary\n\none kage one.elf\ncopy kage {:s}\ntwo kage two.elf\n'
+                        'free freertos one.elf\n'.format(str(builds / 'copy.elf')))
+    process = run_gadgets('--manifest', str(manifest), '--secure_api', str(builds / 'secure_api.conf'), '-j', '2')
+    assert process.returncode == 0, process.stdout
+    rows = table(process.stdout)
+    assert list(rows) == ['one', 'copy', 'two', 'free']
+
+    secure_apis = str(builds / 'secure_api.conf')
+    one = analyze_binary(str(builds / 'one.elf'), 'kage', secure_apis, collect_texts=True)
+    two = analyze_binary(str(builds / 'two.elf'), 'kage', secure_apis, collect_texts=True)
+    free = analyze_binary(str(builds / 'one.elf'), 'freertos', secure_apis, collect_texts=True)
+    assert rows['one'] == ('kage', [one.total, one.reachable, one.stores.total(), 0, 0])
+    assert rows['copy'] == rows['one']
+    assert rows['two'] == ('kage', [two.total, two.reachable, two.stores.total(),
+                                    len(two.texts - one.texts), len(one.texts - two.texts)])
+    # In FreeRTOS mode, every gadget is reachable
+    assert rows['free'] == ('freertos', [one.total, one.total, free.stores.total(), len(free.texts - one.texts), 0])
+    assert 0 < one.reachable < one.total
+    assert 'NOTE: one, copy are identical and were analyzed once.' in process.stdout.splitlines()
+
+
+def test_compare_to_reference(builds):
+    manifest = builds / 'manifest.txt'
+    manifest.write_text('one kage one.elf\ntwo kage two.elf\n')
+    secure_apis = str(builds / 'secure_api.conf')
+    process = run_gadgets('--manifest', str(manifest), '--secure_api', secure_apis, '--reference', 'two')
+    one = analyze_binary(str(builds / 'one.elf'), 'kage', secure_apis, collect_texts=True)
+    two = analyze_binary(str(builds / 'two.elf'), 'kage', secure_apis, collect_texts=True)
+    rows = table(process.stdout)
+    assert rows['one'][1][3:] == [len(one.texts - two.texts), len(two.texts - one.texts)]
+    assert rows['two'][1][3:] == [0, 0]
+    assert process.stdout.splitlines()[-1] == '+gadgets/-gadgets: reachable gadgets only in the build/only in two'
+
+
+@pytest.mark.parametrize('manifest, args, error', [
+    ('one kage one.elf\nbroken\n', [], 'manifest.txt:2: expected "<name> <kage|freertos> <binary>"'),
+    ('one linux one.elf\n', [], 'manifest.txt:1: expected'),
+    ('one kage one.elf\n', ['--reference', 'two'], 'Unknown reference build two'),
+])
+def test_manifest_errors(builds, manifest, args, error):
+    (builds / 'manifest.txt').write_text(manifest)
+    process = run_gadgets('--manifest', str(builds / 'manifest.txt'), '--secure_api',
+                          str(builds / 'secure_api.conf'), *args)
+    assert process.returncode == 1
+    assert process.stdout.startswith('ERROR: ') and error in process.stdout
@@ -0,0 +1,70 @@
+from kage_tools.code_scanner import CodeScanner
+from kage_tools.scan_report import format_text
+
+from .elf_builder import branch, word, write_elf
+
+PRIV = 0x08000000
+TEXT = 0x08010000
+
+PRIVILEGED = ('privileged_functions', PRIV, [0xbf00, 0x4770, 0xbf00, 0x4770],
+              [('prvSecret', PRIV, 4), ('vTaskDelay', PRIV + 4, 4)])
+
+# ldr r3, [pc, #0]; str r0, [r3]; then the word read by the load when the
+# function is word aligned, an MPU register. At an odd halfword, the load
+# reads the str and half of that word instead.
+LITERAL_FUNCTION = [0x4b00, 0x6018] + word(0xe000ed94) + [0x4770, 0xbf00]
+
+
+def scan(binary, cache):
+    scanner = CodeScanner(str(binary), {'.text'}, False, cache and str(cache))
+    try:
+        return [format_text(violation) for violation in scanner.violations()]
+    finally:
+        scanner.close()
+
+
+def test_alignment_is_part_of_the_key(tmp_path):
+    aligned = tmp_path / 'aligned.elf'
+    write_elf(aligned, [('.text', TEXT, LITERAL_FUNCTION, [('f', TEXT, 12)]), PRIVILEGED])
+    # The same function, two bytes further
+    shifted = tmp_path / 'shifted.elf'
+    write_elf(shifted, [('.text', TEXT, [0x4770] + LITERAL_FUNCTION, [('g', TEXT, 2), ('f', TEXT + 2, 12)]),
+                        PRIVILEGED])
+
+    cache = tmp_path / 'cache.db'
+    assert scan(aligned, cache) == scan(aligned, None) == ['[CS] Store to MPU register 0xe000ed94 at 0x8010002']
+    assert scan(shifted, cache) == scan(shifted, None) == []
+
+
+def test_only_changed_functions_are_decoded(tmp_path, monkeypatch):
+    def functions(changed):
+        text = []
+        symbols = []
+        for i in range(5):
+            start = TEXT + 2 * len(text)
+            body = [0xbf00] * 6 + branch(start + 12, PRIV, i in changed) + [0x4770]
+            symbols.append(('func{:d}'.format(i), start, 2 * len(body)))
+            text += body
+        return [('.text', TEXT, text, symbols), PRIVILEGED]
+
+    binary = tmp_path / 'binary.elf'
+    cache = tmp_path / 'cache.db'
+    write_elf(binary, functions(()))
+    assert len(scan(binary, cache)) == 5
+
+    write_elf(binary, functions((0, 1, 3)))
+    expected = scan(binary, None)
+    assert [finding.split()[1] for finding in expected] == ['BL', 'BL', 'B', 'BL', 'B']
+
+    decoded = []
+    decode = CodeScanner._CodeScanner__decode
+
+    def record(self, section, start, end, all_branches=False):
+        decoded.append((start, end))
+        return decode(self, section, start, end, all_branches)
+
+    monkeypatch.setattr(CodeScanner, '_CodeScanner__decode', record)
+    assert scan(binary, cache) == expected
+    # func0 and func1 (18 bytes each) are decoded together, func3 on its
+    # own, and neither func2 nor func4
+    assert decoded == [(0, 36), (54, 72)]
@@ -0,0 +1,123 @@
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+from kage_tools.scan_report import (CLASSES, SARIF_SCHEMA, SarifWriter, Summary, Violation, format_json, format_text,
+                                    print_reports)
+
+from .elf_builder import branch, write_elf
+from .test_code_scanner import PRIV, SCRIPTS, TEXT
+
+CPS = Violation('a.elf', '.text', TEXT + 2, 'main', 'CPS', 'CPS', None, 'CPS at 0x8010002')
+BL = Violation('a.elf', '.text', TEXT + 4, 'main', 'BRANCH', 'BL', 'prvSecret', 'BL prvSecret at 0x8010004')
+SVC = Violation('b.elf', '.text', TEXT + 8, None, 'SVC', 'SVC', '#0', 'SVC #0 at 0x8010008')
+
+
+@pytest.fixture
+def binary(tmp_path):
+    """A binary with a CPS and a call of a trusted function in main."""
+    path = tmp_path / 'small.elf'
+    text = [0xbf00, 0xb672] + branch(TEXT + 4, PRIV) + branch(TEXT + 8, PRIV + 4) + [0x4770]
+    write_elf(path, [('.text', TEXT, text, [('main', TEXT, 2 * len(text))]),
+                     ('privileged_functions', PRIV, [0xbf00, 0x4770, 0xbf00, 0x4770],
+                      [('prvSecret', PRIV, 4), ('vTaskDelay', PRIV + 4, 4)])])
+    return str(path)
+
+
+def code_scanner(*args):
+    return subprocess.run([sys.executable, str(SCRIPTS / 'code-scanner.py')] + list(args),
+                          capture_output=True, universal_newlines=True)
+
+
+def test_text_and_json_records():
+    assert format_text(BL) == '[CS] BL prvSecret at 0x8010004'
+    assert json.loads(format_json(BL)) == {'binary': 'a.elf', 'section': '.text', 'address': TEXT + 4,
+                                           'function': 'main', 'kind': 'BRANCH', 'instruction': 'BL',
+                                           'target': 'prvSecret'}
+
+
+def test_print_reports(capsys):
+    results = [('a.elf', [CPS], None), ('a.elf', [BL], None), ('b.elf', [], 'Truncated Thumb-2 instruction: .text'),
+               ('c.elf', [], None)]
+    assert list(print_reports(iter(results))) == results
+    assert capsys.readouterr().out.splitlines() == [
+        '[CS] a.elf: 2 violation(s)',
+        '  [CS] CPS at 0x8010002',
+        '  [CS] BL prvSecret at 0x8010004',
+        '[CS] b.elf: ERROR: Truncated Thumb-2 instruction: .text',
+        '[CS] c.elf: OK',
+    ]
+
+
+def test_summary():
+    summary = Summary()
+    for violation in [CPS, BL, SVC]:
+        summary.add(violation)
+    summary.add_error()
+    assert summary.as_dict() == {'violations': 3, 'binaries': 2, 'errors': 1,
+                                 'kinds': {'CPS': 1, 'BRANCH': 1, 'SVC': 1},
+                                 'functions': {'main': 2, '<unknown>': 1}}
+    lines = summary.format().splitlines()
+    assert lines[0] == '[CS] 3 violation(s) in 2 binary(ies), 1 error(s)'
+    assert lines[-2:] == ['    {:40s} {:9d}'.format('main', 2), '    {:40s} {:9d}'.format('<unknown>', 1)]
+
+
+def test_sarif_writer():
+    sarif = SarifWriter()
+    sarif.add(BL)
+    sarif.add(SVC)
+    file = io.StringIO()
+    sarif.write(file)
+    log = json.loads(file.getvalue())
+    assert log['$schema'] == SARIF_SCHEMA and log['version'] == '2.1.0'
+    [run] = log['runs']
+    assert [rule['id'] for rule in run['tool']['driver']['rules']] == list(CLASSES)
+    assert run['invocations'] == [{'executionSuccessful': True, 'toolExecutionNotifications': []}]
+    assert 'properties' not in run
+    bl, svc = run['results']
+    assert bl == {
+        'ruleId': 'BRANCH',
+        'level': 'error',
+        'message': {'text': 'BL prvSecret at 0x8010004'},
+        'locations': [{
+            'physicalLocation': {'artifactLocation': {'uri': 'a.elf'}, 'address': {'absoluteAddress': TEXT + 4}},
+            'logicalLocations': [{'name': 'main', 'kind': 'function'}],
+        }],
+        'properties': {'section': '.text', 'instruction': 'BL', 'target': 'prvSecret'},
+    }
+    # Violations outside of functions have no logical location
+    assert svc['ruleId'] == 'SVC'
+    assert 'logicalLocations' not in svc['locations'][0]
+
+
+def test_code_scanner_sarif(binary, tmp_path):
+    missing = str(tmp_path / 'missing.elf')
+    process = code_scanner('--format', 'sarif', '--summary', binary, missing)
+    assert process.returncode == 1
+    [run] = json.loads(process.stdout)['runs']
+    assert [(result['ruleId'], result['locations'][0]['physicalLocation']['address']['absoluteAddress'])
+            for result in run['results']] == [('CPS', TEXT + 2), ('BRANCH', TEXT + 4)]
+    assert {result['locations'][0]['physicalLocation']['artifactLocation']['uri'] for result in run['results']} == {
+        binary}
+    [invocation] = run['invocations']
+    assert not invocation['executionSuccessful']
+    [notification] = invocation['toolExecutionNotifications']
+    assert notification['locations'][0]['physicalLocation']['artifactLocation']['uri'] == missing
+    assert run['properties']['summary'] == {'violations': 2, 'binaries': 1, 'errors': 1,
+                                            'kinds': {'CPS': 1, 'BRANCH': 1}, 'functions': {'main': 2}}
+
+
+def test_code_scanner_jsonl(binary, tmp_path):
+    missing = str(tmp_path / 'missing.elf')
+    process = code_scanner('--format', 'jsonl', '--summary', binary, missing)
+    assert process.returncode == 1
+    records = [json.loads(line) for line in process.stdout.splitlines()]
+    assert [(record['kind'], record['address'], record['function']) for record in records[:2]] == [
+        ('CPS', TEXT + 2, 'main'), ('BRANCH', TEXT + 4, 'main')]
+    assert records[2]['binary'] == missing and 'No such file' in records[2]['error']
+    assert records[3] == {'summary': {'violations': 2, 'binaries': 1, 'errors': 1,
+                                      'kinds': {'CPS': 1, 'BRANCH': 1}, 'functions': {'main': 2}}}
+    assert len(records) == 4
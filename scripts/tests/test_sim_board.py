@@ -0,0 +1,62 @@
+import asyncio
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from kage_tools.benchmark_parsers import ResultParser
+from kage_tools.boards import BenchmarkError, SerialBoard
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def sim_board(tmp_path):
+    """Start sim-board.py with one board; yields its (port, OpenOCD configuration)."""
+    link = tmp_path / 'board'
+    process = subprocess.Popen([sys.executable, str(SCRIPTS / 'sim-board.py'), '--link', str(link)],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        # Run the benchmarks with: --openocd ./sim-openocd.py --board <port> <configuration>
+        words = process.stdout.readline().split()
+        assert words[-3] == '--board'
+        yield words[-2], words[-1]
+    finally:
+        process.terminate()
+        process.wait()
+    assert not any(tmp_path.glob('board*'))
+
+
+async def run(board, binary):
+    """Flash binary to board and parse its output like run-benchmarks.py."""
+    reader = await board.connect()
+    try:
+        log = []
+        await board.flash(binary, lambda *text, end: log.append(''.join(text)))
+        parser = ResultParser(binary.stem, 'kage', 1234)
+        while not parser.feed((await asyncio.wait_for(reader.readline(), 10)).decode()):
+            pass
+        return parser, log
+    finally:
+        board.disconnect()
+
+
+@pytest.mark.parametrize('benchmark', ['queue', 'coremark'])
+def test_serial_board_runs_on_simulated_board(sim_board, tmp_path, benchmark):
+    binary = tmp_path / 'kage-{:s}.elf'.format(benchmark)
+    binary.write_bytes(b'')
+    board = SerialBoard(*sim_board, openocd=str(SCRIPTS / 'sim-openocd.py'))
+    parser, log = asyncio.run(run(board, binary))
+
+    metrics, sizes = parser.result_names()
+    assert set(parser.perf) == set(metrics)
+    assert all(value > 0 for value in parser.perf.values())
+    assert parser.sizes == dict.fromkeys(sizes, 1234)
+    assert '** Programming Finished **\n' in log
+
+
+def test_flashing_a_missing_binary_fails(sim_board, tmp_path):
+    board = SerialBoard(*sim_board, openocd=str(SCRIPTS / 'sim-openocd.py'))
+    with pytest.raises(BenchmarkError, match='returned status code 1'):
+        asyncio.run(board.flash(tmp_path / 'kage-queue.elf'))
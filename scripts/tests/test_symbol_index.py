@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from kage_tools.symbol_index import SymbolIndex
+
+# main and helper are adjacent, a gap follows helper, and the unsized
+# handler extends up to last
+SYMBOLS = [
+    (0x08010100, 0x20, 'helper', '.text'),
+    (0x08010000, 0x100, 'main', '.text'),
+    (0x08010200, 0, 'handler', '.text'),
+    (0x08010300, 0x10, 'last', '.text'),
+    (0x08000000, 0x40, 'vTaskDelay', 'privileged_functions'),
+]
+
+
+@pytest.fixture
+def index():
+    return SymbolIndex(SYMBOLS)
+
+
+@pytest.mark.parametrize('addr, name', [
+    (0x08000000, 'vTaskDelay'),
+    (0x0800003e, 'vTaskDelay'),
+    # Before the first symbol and past the end of a function
+    (0x07fffffe, None),
+    (0x08000040, None),
+    (0x08010000, 'main'),
+    (0x080100fe, 'main'),
+    # The end of main is the start of helper
+    (0x08010100, 'helper'),
+    (0x0801011e, 'helper'),
+    # Between helper and handler
+    (0x08010120, None),
+    (0x080101fe, None),
+    (0x08010200, 'handler'),
+    (0x080102fe, 'handler'),
+    (0x08010300, 'last'),
+    (0x0801030e, 'last'),
+    # Past the last symbol
+    (0x08010310, None),
+    (0xfffffffe, None),
+])
+def test_lookup(index, addr, name):
+    i = index.lookup(addr)
+    assert (index.name(i) if i >= 0 else None) == name
+    assert index.lookup_many([addr]).tolist() == [i]
+
+
+def test_lookup_many(index):
+    addrs = np.arange(0x07fffff0, 0x08010400, 2)
+    assert index.lookup_many(addrs).tolist() == [index.lookup(addr) for addr in addrs.tolist()]
+    assert index.lookup_many([]).tolist() == []
+
+
+def test_find_and_sections(index):
+    assert len(index) == 5
+    assert index.name(index.find(0x08010100)) == 'helper'
+    assert index.find(0x08010102) == -1
+    assert index.section(index.find(0x08000000)) == 'privileged_functions'
+    assert index.in_section('.text') == [0x08010000, 0x08010100, 0x08010200, 0x08010300]
+    assert index.in_section('.data') == []
+
+
+def test_empty_and_duplicate_symbols():
+    empty = SymbolIndex([])
+    assert empty.lookup(0x08010000) == -1
+    assert empty.lookup_many([0x08010000]).tolist() == [-1]
+    # The last of several symbols at the same address wins
+    index = SymbolIndex([(0x08010000, 0x10, 'alias', '.text'), (0x08010000, 0x20, 'main', '.text')])
+    assert index.name(index.lookup(0x0801001e)) == 'main'
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from kage_tools.thumb_decoder import CFI_LABEL, DecodedSection, TruncatedInstruction, decode, instruction_boundary
+
+from .elf_builder import branch, word
+
+BASE = 0x08010000
+PRIV = 0x08000000
+
+NOP = 0xbf00
+BX_LR = 0x4770
+CPSID_I = 0xb672
+CPSIE_I = 0xb662
+SCS_REGISTER = 0xe000ed94
+FUNCTION = 0x08020101
+
+
+def section(hws, base=BASE, unaligned=False):
+    return DecodedSection(np.array(hws, dtype='<u2').tobytes(), base, unaligned)
+
+
+def test_decode_narrow_and_wide():
+    # nop; bl; bx lr; ldr.w r0, [r1]
+    narrow, wide = decode(np.array([NOP, 0xf7ff, 0xfffe, BX_LR, 0xf8d1, 0x0000], dtype=np.uint16))
+    assert narrow.tolist() == [0, 3]
+    assert wide.tolist() == [1, 4]
+
+
+def test_decode_prefix_runs():
+    # Suffixes that look like prefixes: every other halfword of a run of
+    # prefixes starts an instruction
+    hw = np.array([NOP, 0xf7ff, 0xf7ff, 0xf7ff, 0xfffe, 0xe92d, 0xe92d, BX_LR], dtype=np.uint16)
+    narrow, wide = decode(hw)
+    assert narrow.tolist() == [0, 7]
+    assert wide.tolist() == [1, 3, 5]
+    assert [instruction_boundary(hw, pos) for pos in range(len(hw))] == [0, 1, 3, 3, 5, 5, 7, 7]
+
+
+def test_decode_truncated():
+    with pytest.raises(TruncatedInstruction):
+        decode(np.array([NOP, 0xf000], dtype=np.uint16))
+
+
+def test_cps():
+    decoded = section([CPSID_I, NOP, CPSIE_I, 0xb663, BX_LR])
+    assert decoded.cps.tolist() == [BASE, BASE + 4, BASE + 6]
+
+
+def test_cps_unaligned():
+    # ldr.w r11, [r0, #0x672] hides a CPS in its second halfword
+    hws = [0xf8d0, CPSID_I, BX_LR]
+    assert section(hws).cps.tolist() == []
+    assert section(hws, unaligned=True).cps.tolist() == [BASE + 2]
+
+
+@pytest.mark.parametrize('sysm', [0x8, 0x9, 0x10, 0x11, 0x12, 0x13, 0x14, 0x3])
+def test_msr(sysm):
+    decoded = section([NOP, 0xf380, 0x8800 | sysm, BX_LR])
+    assert decoded.msr.tolist() == [BASE + 2]
+    assert decoded.msr_sysm.tolist() == [sysm]
+
+
+def test_mrs_is_not_msr():
+    assert section([0xf3ef, 0x8008, BX_LR]).msr.tolist() == []
+
+
+@pytest.mark.parametrize('link', [True, False])
+def test_branch_into_privileged_range(link):
+    hws = [NOP] + branch(BASE + 2, PRIV + 0x10, link) + branch(BASE + 6, BASE - 0x100000 + 4, link) + [BX_LR]
+    decoded = section(hws)
+    assert decoded.branch.tolist() == [BASE + 2, BASE + 6]
+    assert decoded.branch_link.tolist() == [link, link]
+    assert decoded.branch_dest.tolist() == [PRIV + 0x10, BASE - 0x100000 + 4]
+
+
+def test_backward_and_forward_branches():
+    decoded = section(branch(BASE, BASE + 0x123456) + branch(BASE + 4, BASE - 0x123456))
+    assert decoded.branch_dest.tolist() == [BASE + 0x123456, BASE - 0x123456]
+
+
+def test_cfi_label_is_skipped():
+    # The label has the encoding of a BL, but is never reported as one
+    label = [CFI_LABEL >> 16, CFI_LABEL & 0xffff]
+    narrow, wide = decode(np.array(label, dtype=np.uint16))
+    assert wide.tolist() == [0]
+    decoded = section(label + [CPSID_I] + label + branch(BASE + 10, PRIV))
+    assert decoded.branch.tolist() == [BASE + 10]
+    assert decoded.cps.tolist() == [BASE + 4]
+
+
+def literal_section(rt, hws, literal):
+    """Load literal into rt with an LDR (literal) at BASE, followed by hws."""
+    code = [0x4800 | (rt << 8)] + hws + [BX_LR]
+    code += [NOP] * (len(code) % 2)
+    code[0] |= (2 * len(code) - 4) // 4
+    return section(code + word(literal))
+
+
+@pytest.mark.parametrize('hws', [
+    [],
+    [0x2101],                                     # movs r1, #1
+    [0x6008],                                     # str r0, [r1]
+    [0x4288],                                     # cmp r0, r1
+])
+def test_literal_store_to_scs(hws):
+    # ...; str r2, [r0]
+    decoded = literal_section(0, hws + [0x6002], SCS_REGISTER)
+    assert decoded.scs_store.tolist() == [BASE + 2 + 2 * len(hws)]
+    assert decoded.scs_store_dest.tolist() == [SCS_REGISTER]
+
+
+@pytest.mark.parametrize('hws', [
+    [0x4608],                                     # mov r0, r1
+    [0x3004],                                     # adds r0, #4
+    [0xf850, 0x1b04],                             # ldr r1, [r0], #4
+    [0xf8d1, 0x0000],                             # ldr.w r0, [r1]
+    branch(BASE + 2, PRIV),                       # bl
+    [0xe000],                                     # b
+])
+def test_written_literal_is_not_stored_to_scs(hws):
+    assert literal_section(0, hws + [0x6002], SCS_REGISTER).scs_store.tolist() == []
+
+
+@pytest.mark.parametrize('hws, link', [([0x4718], False), ([0x2101, 0x4798], True), ([0x6019, 0x4718], False)])
+def test_literal_indirect_branch(hws, link):
+    # ldr r3, =FUNCTION; ...; bx/blx r3
+    decoded = literal_section(3, hws, FUNCTION)
+    assert decoded.indirect.tolist() == [BASE + 2 * len(hws)]
+    assert decoded.indirect_link.tolist() == [link]
+    assert decoded.indirect_dest.tolist() == [FUNCTION & ~1]
+
+
+@pytest.mark.parametrize('hws', [
+    [0x3304, 0x4718],                             # adds r3, #4; bx r3
+    [0xf843, 0x1b04, 0x4718],                     # str r1, [r3], #4; bx r3
+    [0xbc08, 0x4718],                             # pop {r3}; bx r3
+])
+def test_written_literal_is_not_branched_to(hws):
+    assert literal_section(3, hws, FUNCTION).indirect.tolist() == []